@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+關鍵影格縮圖拼貼 (contact sheet)
+
+從影片挑選具代表性的時間點 (優先使用場景切換點，不足時均勻補齊)，
+將擷取的影格縮小後依時間順序拼成少數幾張圖片並標示原片時間，
+讓摘要或物體識別等問題改走圖片路徑，不必上傳整段影片
+"""
+
+import os
+from typing import Any, List, Tuple
+
+# 預設擷取的影格數
+FRAME_COUNT = int(os.getenv("GEMINI_CONTACT_SHEET_FRAMES", "16"))
+# 每張拼貼圖的欄數 (每張最多 欄數 x 欄數 格)
+COLUMNS = int(os.getenv("GEMINI_CONTACT_SHEET_COLUMNS", "4"))
+# 每格影格的寬度 (像素)
+TILE_WIDTH = int(os.getenv("GEMINI_CONTACT_SHEET_TILE_WIDTH", "384"))
+# 單次最多擷取的影格數
+MAX_FRAMES = 64
+
+LABEL_PADDING = 4
+
+
+def select_times(duration: float, count: int, scenes: List[float]) -> List[float]:
+    """挑選要擷取影格的時間點
+
+    以影片開頭與場景切換點為候選：候選過多時平均挑選，
+    不足時反覆在最長的間隔中點補上時間點
+
+    Args:
+        duration: 影片長度 (秒)
+        count: 影格數
+        scenes: 場景切換時間
+
+    Returns:
+        依時間排序的時間點
+    """
+    count = max(1, min(count, MAX_FRAMES))
+    # 避開最後一刻，該處常無法解碼出影格
+    end = max(duration - 0.5, 0.0)
+    candidates = sorted({0.0, *(t for t in scenes if 0.0 < t < end)})
+
+    if len(candidates) > count:
+        step = len(candidates) / count
+        return [candidates[int(i * step)] for i in range(count)]
+
+    times = candidates
+    while len(times) < count:
+        bounds = times + [end]
+        gaps = [(bounds[i + 1] - bounds[i], i) for i in range(len(times))]
+        gap, index = max(gaps)
+        if gap < 1.0:
+            break
+        times.insert(index + 1, bounds[index] + gap / 2)
+    return times
+
+
+def _format_time(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def build_sheets(frames: List[Tuple[float, str]], columns: int = COLUMNS,
+                 tile_width: int = TILE_WIDTH) -> List[Any]:
+    """將影格拼成縮圖拼貼
+
+    Args:
+        frames: (原片時間, 影格圖片路徑) 列表
+        columns: 每張拼貼圖的欄數
+        tile_width: 每格寬度
+
+    Returns:
+        PIL 圖片列表 (每張最多 columns x columns 格，左上角標示原片時間)
+    """
+    import PIL.Image
+    import PIL.ImageDraw
+
+    columns = max(1, columns)
+    per_sheet = columns * columns
+    sheets = []
+
+    for offset in range(0, len(frames), per_sheet):
+        batch = frames[offset:offset + per_sheet]
+        images = []
+        for _, path in batch:
+            with PIL.Image.open(path) as image:
+                image = image.convert('RGB')
+                height = max(1, round(image.height * tile_width / image.width))
+                images.append(image.resize((tile_width, height)))
+
+        tile_height = max(image.height for image in images)
+        sheet_columns = min(columns, len(images))
+        rows = (len(images) + sheet_columns - 1) // sheet_columns
+        sheet = PIL.Image.new('RGB', (sheet_columns * tile_width, rows * tile_height))
+        draw = PIL.ImageDraw.Draw(sheet)
+
+        for i, ((seconds, _), image) in enumerate(zip(batch, images)):
+            x = i % sheet_columns * tile_width
+            y = i // sheet_columns * tile_height
+            sheet.paste(image, (x, y))
+            label = _format_time(seconds)
+            left, top, right, bottom = draw.textbbox((0, 0), label)
+            draw.rectangle(
+                (x, y, x + right - left + LABEL_PADDING * 2, y + bottom - top + LABEL_PADDING * 2),
+                fill=(0, 0, 0)
+            )
+            draw.text((x + LABEL_PADDING - left, y + LABEL_PADDING - top), label, fill=(255, 255, 255))
+        sheets.append(sheet)
+
+    return sheets
+
+
+def build_prompt(question: str, times: List[float], sheet_count: int) -> str:
+    """說明拼貼圖內容的提示詞"""
+    return (
+        f"以下 {sheet_count} 張圖片是從同一段影片依時間順序擷取的 {len(times)} 張關鍵影格縮圖，"
+        f"由左至右、由上而下排列，每格左上角標示該影格在原片中的時間 (HH:MM:SS)。"
+        f"請將它們視為這段影片來回答，引用時間時使用標示的時間。\n\n{question}"
+    )
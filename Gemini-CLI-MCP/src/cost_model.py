@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+本機處理成本模型
+
+記錄在這台機器上實際量測到的轉碼速度、串流複製速度、上傳頻寬與
+Gemini 檔案處理速度 (指數移動平均)，供影片優化規劃器估算各方案的耗時
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ffmpeg_runner import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_PATH = os.getenv(
+    "GEMINI_CALIBRATION_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp", "calibration.json")
+)
+
+# 新量測值的權重
+EWMA_ALPHA = 0.3
+
+
+class CostModel:
+    """以量測值校正的吞吐量模型"""
+
+    # 尚未量測時使用的保守預設值
+    DEFAULTS: Dict[str, Any] = {
+        # 轉碼速度：每實際秒可處理的媒體秒數 (依目標解析度)
+        'transcode_speed': {'high': 4.0, 'standard': 8.0, 'low': 15.0},
+        # 串流複製 (重新封裝) 速度：bytes/s
+        'copy_bytes_per_sec': 150 * 1024 * 1024,
+        # 上傳頻寬：bytes/s
+        'upload_bytes_per_sec': 5 * 1024 * 1024,
+        # Gemini 檔案處理速度：bytes/s
+        'processing_bytes_per_sec': 10 * 1024 * 1024,
+    }
+
+    def __init__(self, path: str = CALIBRATION_PATH):
+        """初始化成本模型
+
+        Args:
+            path: 量測資料的 JSON 檔案路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._values = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to load calibration data, using defaults: {e}")
+
+    def get(self, metric: str, key: Optional[str] = None) -> float:
+        """取得量測值 (未量測時回傳預設值)"""
+        with self._lock:
+            value = self._values.get(metric, self.DEFAULTS[metric])
+            if key is None:
+                return float(value)
+            if isinstance(value, dict) and key in value:
+                return float(value[key])
+            return float(self.DEFAULTS[metric][key])
+
+    def is_measured(self, metric: str, key: Optional[str] = None) -> bool:
+        """是否已有本機量測值"""
+        with self._lock:
+            value = self._values.get(metric)
+            if key is None:
+                return value is not None
+            return isinstance(value, dict) and key in value
+
+    def record(self, metric: str, value: float, key: Optional[str] = None):
+        """以指數移動平均記錄一次量測"""
+        if value <= 0:
+            return
+        with self._lock:
+            if key is None:
+                previous = self._values.get(metric)
+                self._values[metric] = value if previous is None else (
+                    EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+                )
+            else:
+                bucket = self._values.setdefault(metric, {})
+                previous = bucket.get(key)
+                bucket[key] = value if previous is None else (
+                    EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+                )
+            self._save()
+
+    def _save(self):
+        """以原子寫入方式儲存量測資料"""
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.calibration_')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._values, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save calibration data: {e}")
+
+    def calibrate_transcode(self, scales: Dict[str, str], sample_seconds: int = 10) -> Dict[str, float]:
+        """以 ffmpeg 測試訊號量測各解析度的轉碼速度
+
+        Args:
+            scales: 解析度名稱對應 ffmpeg scale 參數
+            sample_seconds: 測試影片長度
+
+        Returns:
+            各解析度量測到的速度 (媒體秒/實際秒)
+        """
+        results = {}
+        with tempfile.TemporaryDirectory(prefix='gemini_calibrate_') as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'calibrate.mp4')
+            for name, scale in scales.items():
+                cmd = [
+                    'ffmpeg', '-y', '-f', 'lavfi',
+                    '-i', f'testsrc2=size=1920x1080:rate=30:duration={sample_seconds}',
+                    '-vf', f'scale={scale}', '-c:v', 'libx264', output_path
+                ]
+                started = time.monotonic()
+                run_ffmpeg(cmd)
+                speed = sample_seconds / (time.monotonic() - started)
+                self.record('transcode_speed', speed, key=name)
+                results[name] = speed
+        return results
+
+    def snapshot(self) -> Dict[str, Any]:
+        """取得目前使用中的數值 (含預設值)"""
+        with self._lock:
+            snapshot = {}
+            for metric, default in self.DEFAULTS.items():
+                value = self._values.get(metric, default)
+                snapshot[metric] = {**default, **value} if isinstance(default, dict) else value
+            return snapshot
+
+
+# 全域成本模型
+cost_model = CostModel()
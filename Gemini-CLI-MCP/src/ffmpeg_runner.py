@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+ffmpeg/ffprobe 執行層
+
+以 -progress 逐行讀取 ffmpeg 的處理進度，stderr 只保留最後數行，
+並可透過 CancelToken 從其他執行緒 (例如事件迴圈) 立即終止執行中的行程。
+FFmpegStream 讓 ffmpeg 將媒體輸出到管線，供呼叫端邊編碼邊讀取。
+所有行程都經由全域 ResourceGovernor 取得執行名額，並依名額分配 ffmpeg 執行緒數
+"""
+
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, IO, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 失敗時錯誤訊息保留的 stderr 行數
+STDERR_TAIL_LINES = 50
+
+# 同時執行的 ffmpeg/ffprobe 行程數 (0 表示 CPU 核心數的一半)
+FFMPEG_SLOTS = int(os.getenv("GEMINI_FFMPEG_SLOTS", "0"))
+# 每個 ffmpeg 行程的執行緒數 (0 表示 CPU 核心數 / 名額數)
+FFMPEG_THREADS = int(os.getenv("GEMINI_FFMPEG_THREADS", "0"))
+# 保留給互動式工作的名額數 (批次工作不會佔用)
+FFMPEG_INTERACTIVE_RESERVE = int(os.getenv("GEMINI_FFMPEG_INTERACTIVE_RESERVE", "1"))
+# 批次工作行程的 nice 值
+FFMPEG_BATCH_NICE = int(os.getenv("GEMINI_FFMPEG_BATCH_NICE", "10"))
+
+# 等待名額時檢查取消的間隔 (秒)
+ADMISSION_POLL_INTERVAL = 0.5
+
+# 工作優先順序 (數值小者優先)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# 目前情境的工作優先順序 (背景工作與批次 CLI 設為 PRIORITY_BATCH)
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "ffmpeg_priority", default=PRIORITY_INTERACTIVE
+)
+
+
+class FFmpegCancelled(RuntimeError):
+    """ffmpeg 行程因取消而終止"""
+
+
+class CancelToken:
+    """取消權杖：取消時終止所有已註冊的行程"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes: Set[subprocess.Popen] = set()
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        """取消並終止所有執行中的行程 (可從任何執行緒呼叫)"""
+        with self._lock:
+            self._cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+
+    def register(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self._cancelled
+        # 註冊前已取消時立即終止
+        if cancelled:
+            _kill(process)
+
+    def unregister(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+
+class ResourceGovernor:
+    """全域 ffmpeg/ffprobe 行程名額
+
+    同時執行的行程數不超過名額數；等待中的請求依優先順序、同優先順序依
+    到達先後取得名額，且批次工作不會佔用保留給互動式工作的名額，
+    讓互動式工具在批次工作滿載時仍能立即執行
+    """
+
+    def __init__(self, slots: int = FFMPEG_SLOTS, threads: int = FFMPEG_THREADS,
+                 interactive_reserve: int = FFMPEG_INTERACTIVE_RESERVE,
+                 batch_nice: int = FFMPEG_BATCH_NICE):
+        """初始化資源排程
+
+        Args:
+            slots: 名額數 (0 表示 CPU 核心數的一半)
+            threads: 每個 ffmpeg 行程的執行緒數 (0 表示平均分配 CPU 核心)
+            interactive_reserve: 保留給互動式工作的名額數
+            batch_nice: 批次工作行程的 nice 值
+        """
+        cores = os.cpu_count() or 1
+        self.slots = max(1, slots or cores // 2)
+        self.threads = max(1, threads or cores // self.slots)
+        self.interactive_reserve = max(0, min(interactive_reserve, self.slots - 1))
+        self.batch_nice = batch_nice
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._admitted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._wait_time = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BATCH: 0.0}
+        self._max_wait = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BATCH: 0.0}
+
+    def _limit(self, priority: int) -> int:
+        return self.slots - (self.interactive_reserve if priority >= PRIORITY_BATCH else 0)
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, cancel: Optional['CancelToken'] = None):
+        """等待並取得一個名額
+
+        Raises:
+            FFmpegCancelled: 等待期間被取消
+        """
+        started = time.monotonic()
+        entry = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while self._waiting[0] != entry or self._running >= self._limit(priority):
+                    if cancel is not None and cancel.cancelled:
+                        raise FFmpegCancelled("ffmpeg 處理已取消")
+                    self._cond.wait(ADMISSION_POLL_INTERVAL)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._running += 1
+
+            waited = time.monotonic() - started
+            self._admitted[priority] = self._admitted.get(priority, 0) + 1
+            self._wait_time[priority] = self._wait_time.get(priority, 0.0) + waited
+            self._max_wait[priority] = max(self._max_wait.get(priority, 0.0), waited)
+            # 下一個等待者可能也能取得名額
+            self._cond.notify_all()
+
+    def release(self):
+        """歸還名額"""
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE,
+             cancel: Optional['CancelToken'] = None) -> Iterator[None]:
+        """在名額內執行"""
+        self.acquire(priority, cancel)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def apply_threads(self, cmd: List[str]) -> List[str]:
+        """為未指定執行緒數的 ffmpeg 命令加入輸出端 -threads"""
+        if os.path.basename(cmd[0]) != 'ffmpeg' or '-threads' in cmd:
+            return cmd
+        return [*cmd[:-1], '-threads', str(self.threads), cmd[-1]]
+
+    def renice(self, process: subprocess.Popen, priority: int):
+        """降低批次工作行程的 CPU 優先權"""
+        if priority < PRIORITY_BATCH or self.batch_nice <= 0 or not hasattr(os, 'setpriority'):
+            return
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, self.batch_nice)
+        except OSError as e:
+            logger.debug(f"Failed to renice ffmpeg process {process.pid}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """取得名額使用統計"""
+        names = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BATCH: 'batch'}
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'threads_per_process': self.threads,
+                'interactive_reserve': self.interactive_reserve,
+                'running': self._running,
+                'waiting': {
+                    name: sum(1 for priority, _ in self._waiting if priority == level)
+                    for level, name in names.items()
+                },
+                'admitted': {names[level]: count for level, count in self._admitted.items()},
+                'avg_wait_seconds': {
+                    names[level]: round(self._wait_time[level] / count, 3) if count else 0.0
+                    for level, count in self._admitted.items()
+                },
+                'max_wait_seconds': {names[level]: round(wait, 3) for level, wait in self._max_wait.items()}
+            }
+
+
+# 全域資源排程
+governor = ResourceGovernor()
+
+
+class ProgressTracker:
+    """彙整一或多個 ffmpeg 行程的進度，計算完成百分比與剩餘時間"""
+
+    def __init__(self, total_seconds: float,
+                 callback: Callable[[float, Optional[float], str], None],
+                 label: str = '', min_interval: float = 1.0):
+        """初始化進度追蹤
+
+        Args:
+            total_seconds: 全部要處理的媒體秒數
+            callback: 以 (百分比, 剩餘秒數或 None, 描述) 呼叫的回呼
+            label: 進度描述
+            min_interval: 兩次回呼的最短間隔秒數
+        """
+        self.total_seconds = max(total_seconds, 0.001)
+        self.callback = callback
+        self.label = label
+        self.min_interval = min_interval
+        self._done: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_report = 0.0
+
+    def update(self, key: Hashable, seconds: float, force: bool = False):
+        """更新某個行程已處理的媒體秒數"""
+        with self._lock:
+            self._done[key] = max(self._done.get(key, 0.0), seconds)
+            done = min(sum(self._done.values()), self.total_seconds)
+            now = time.monotonic()
+            if not force and now - self._last_report < self.min_interval:
+                return
+            self._last_report = now
+            elapsed = now - self._started
+
+        percent = done / self.total_seconds * 100
+        eta = elapsed * (self.total_seconds - done) / done if done > 0 else None
+        message = f"{self.label} {percent:.0f}%"
+        if eta is not None:
+            message += f" (剩餘約 {eta:.0f} 秒)"
+        try:
+            self.callback(percent, eta, message)
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {e}")
+
+    def complete(self, key: Hashable, seconds: float):
+        """標記某個行程已完成"""
+        self.update(key, seconds, force=True)
+
+
+def _kill(process: subprocess.Popen):
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+def _parse_progress(line: str, on_progress: Optional[Callable[[float], None]]) -> bool:
+    """解析 -progress 輸出的一行，回傳是否為進度資訊"""
+    key, separator, value = line.partition('=')
+    if not separator or ' ' in key:
+        return False
+    # out_time_ms 在 ffmpeg 中實際上也是微秒
+    if on_progress is not None and key in ('out_time_us', 'out_time_ms'):
+        try:
+            on_progress(max(int(value), 0) / 1_000_000)
+        except ValueError:
+            pass
+    return True
+
+
+def _drain(stream: IO[Any], tail: deque,
+           on_progress: Optional[Callable[[float], None]] = None,
+           progress_on_stderr: bool = False):
+    """持續讀取 stderr 以免管線阻塞，只保留最後數行 (可同時解析進度)"""
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.rstrip()
+        if progress_on_stderr and _parse_progress(line, on_progress):
+            continue
+        tail.append(line)
+
+
+def _start(cmd: List[str], cancel: Optional[CancelToken], text: bool = True,
+           priority: int = PRIORITY_INTERACTIVE) -> subprocess.Popen:
+    if cancel is not None and cancel.cancelled:
+        raise FFmpegCancelled("ffmpeg 處理已取消")
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        **({'text': True, 'errors': 'replace'} if text else {})
+    )
+    governor.renice(process, priority)
+    if cancel is not None:
+        cancel.register(process)
+    return process
+
+
+def run_ffmpeg(cmd: List[str],
+               on_progress: Optional[Callable[[float], None]] = None,
+               cancel: Optional[CancelToken] = None,
+               priority: Optional[int] = None):
+    """在名額內執行 ffmpeg 並回報已處理的媒體秒數
+
+    Args:
+        cmd: ffmpeg 命令 (第一個元素為執行檔)
+        on_progress: 以已處理秒數呼叫的回呼
+        cancel: 取消權杖
+        priority: 名額優先順序 (預設取自 current_priority)
+
+    Raises:
+        FFmpegCancelled: 處理被取消
+        subprocess.CalledProcessError: ffmpeg 執行失敗 (stderr 為最後數行輸出)
+    """
+    if priority is None:
+        priority = current_priority.get()
+    with governor.slot(priority, cancel):
+        _run_ffmpeg(governor.apply_threads(cmd), on_progress, cancel, priority)
+
+
+def _run_ffmpeg(cmd: List[str], on_progress: Optional[Callable[[float], None]],
+                cancel: Optional[CancelToken], priority: int):
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1', *cmd[1:]]
+    process = _start(cmd, cancel, priority=priority)
+    stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(target=_drain, args=(process.stderr, stderr_tail), daemon=True)
+    drain.start()
+
+    try:
+        for line in process.stdout:
+            _parse_progress(line.strip(), on_progress)
+        returncode = process.wait()
+        drain.join()
+    finally:
+        _kill(process)
+        process.wait()
+        if cancel is not None:
+            cancel.unregister(process)
+
+    if cancel is not None and cancel.cancelled:
+        raise FFmpegCancelled("ffmpeg 處理已取消")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr='\n'.join(stderr_tail))
+
+
+def run_capture(cmd: List[str], cancel: Optional[CancelToken] = None,
+                priority: Optional[int] = None) -> str:
+    """在名額內執行 ffprobe 等輸出結果的命令並回傳 stdout
+
+    Raises:
+        FFmpegCancelled: 執行被取消
+        subprocess.CalledProcessError: 命令執行失敗
+    """
+    if priority is None:
+        priority = current_priority.get()
+    with governor.slot(priority, cancel):
+        process = _start(cmd, cancel, priority=priority)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            _kill(process)
+            process.wait()
+            if cancel is not None:
+                cancel.unregister(process)
+
+    if cancel is not None and cancel.cancelled:
+        raise FFmpegCancelled("ffmpeg 處理已取消")
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout,
+                                            stderr=stderr[-4096:])
+    return stdout
+
+
+class FFmpegStream:
+    """輸出到管線的 ffmpeg 行程
+
+    stdout 為媒體資料 (以 read() 讀取)，進度改由 stderr 的 -progress 輸出解析。
+    管線容量有限，讀取端較慢時 ffmpeg 會自然暫停，記憶體用量不隨影片長度成長。
+    行程的名額在 close() 或 abort() 時歸還
+    """
+
+    def __init__(self, cmd: List[str],
+                 on_progress: Optional[Callable[[float], None]] = None,
+                 cancel: Optional[CancelToken] = None,
+                 priority: Optional[int] = None):
+        """等待名額並啟動 ffmpeg
+
+        Args:
+            cmd: 輸出到 pipe:1 的 ffmpeg 命令
+            on_progress: 以已處理秒數呼叫的回呼
+            cancel: 取消權杖
+            priority: 名額優先順序 (預設取自 current_priority)
+        """
+        if priority is None:
+            priority = current_priority.get()
+        cmd = governor.apply_threads(cmd)
+        self.cmd = [cmd[0], '-nostats', '-progress', 'pipe:2', *cmd[1:]]
+        self._cancel = cancel
+        governor.acquire(priority, cancel)
+        try:
+            self._process = _start(self.cmd, cancel, text=False, priority=priority)
+        except BaseException:
+            governor.release()
+            raise
+        self._stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+        self._drain = threading.Thread(
+            target=_drain, args=(self._process.stderr, self._stderr_tail, on_progress, True), daemon=True
+        )
+        self._drain.start()
+        self._closed = False
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """讀取輸出資料，回傳空位元組表示結束"""
+        data = self._process.stdout.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """等待 ffmpeg 結束並確認執行成功
+
+        Raises:
+            FFmpegCancelled: 處理被取消
+            subprocess.CalledProcessError: ffmpeg 執行失敗
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._process.stdout.close()
+            returncode = self._process.wait()
+            self._drain.join()
+        finally:
+            _kill(self._process)
+            self._process.wait()
+            if self._cancel is not None:
+                self._cancel.unregister(self._process)
+            governor.release()
+
+        if self._cancel is not None and self._cancel.cancelled:
+            raise FFmpegCancelled("ffmpeg 處理已取消")
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.cmd, stderr='\n'.join(self._stderr_tail))
+
+    def abort(self):
+        """終止 ffmpeg 並釋放資源"""
+        if self._closed:
+            return
+        self._closed = True
+        _kill(self._process)
+        self._process.stdout.close()
+        self._process.wait()
+        if self._cancel is not None:
+            self._cancel.unregister(self._process)
+        governor.release()
+
+    def __enter__(self) -> 'FFmpegStream':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+Gemini 檔案上傳工具
+
+將同步的 genai 檔案 API 移出事件迴圈執行，並以非阻塞方式等待檔案處理完成，
+並以內容雜湊索引已上傳的檔案，讓重複分析同一影片時可直接重用。
+也支援從長度未知的串流 (例如 ffmpeg 輸出管線) 以有限緩衝直接上傳
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+import googleapiclient.http
+from google.generativeai.client import get_default_file_client
+from google.generativeai.types import file_types
+
+from cost_model import cost_model
+
+logger = logging.getLogger(__name__)
+
+# 檔案處理等待設定
+FILE_POLL_INITIAL_INTERVAL = float(os.getenv("GEMINI_FILE_POLL_INITIAL", "1.0"))
+FILE_POLL_MAX_INTERVAL = float(os.getenv("GEMINI_FILE_POLL_MAX", "10.0"))
+FILE_POLL_BACKOFF = 1.5
+FILE_PROCESSING_TIMEOUT = float(os.getenv("GEMINI_FILE_PROCESSING_TIMEOUT", "600"))
+
+# 同時進行的上傳數量上限
+MAX_CONCURRENT_UPLOADS = int(os.getenv("GEMINI_MAX_CONCURRENT_UPLOADS", "4"))
+
+# 已上傳檔案重用設定 (預設停用：分析後即刪除遠端檔案；設定 TTL 秒數後才保留重用)
+FILE_CACHE_TTL = float(os.getenv("GEMINI_FILE_CACHE_TTL", "0"))
+FILE_CACHE_MAX_BYTES = int(os.getenv("GEMINI_FILE_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+FILE_CACHE_INDEX_PATH = os.getenv(
+    "GEMINI_FILE_CACHE_INDEX",
+    os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp", "uploaded_files.json")
+)
+
+# 遠端檔案到期前保留的安全餘裕 (秒)
+REMOTE_EXPIRY_MARGIN = 300
+
+# 串流上傳的分塊大小 (需為 256 KiB 的倍數)
+STREAM_UPLOAD_CHUNK_SIZE = int(os.getenv("GEMINI_STREAM_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+_upload_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_upload_semaphore() -> asyncio.Semaphore:
+    """取得全域上傳信號量"""
+    global _upload_semaphore
+    if _upload_semaphore is None:
+        _upload_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_UPLOADS))
+    return _upload_semaphore
+
+
+async def upload_file_async(path: str, **kwargs) -> Any:
+    """在背景執行緒上傳檔案
+
+    Args:
+        path: 本機檔案路徑
+        **kwargs: 傳遞給 genai.upload_file 的其他參數
+
+    Returns:
+        上傳後的 genai File 物件
+    """
+    async with _get_upload_semaphore():
+        logger.info(f"Uploading file: {path}")
+        started = time.monotonic()
+        uploaded = await asyncio.to_thread(genai.upload_file, path, **kwargs)
+        cost_model.record('upload_bytes_per_sec', os.path.getsize(path) / (time.monotonic() - started))
+        logger.info(f"File uploaded successfully. URI: {uploaded.uri}")
+        return uploaded
+
+
+async def wait_for_file_active(uploaded: Any,
+                               timeout: Optional[float] = None) -> Any:
+    """以自適應退避輪詢檔案狀態，直到處理完成
+
+    Args:
+        uploaded: genai File 物件
+        timeout: 最長等待秒數 (預設 GEMINI_FILE_PROCESSING_TIMEOUT)
+
+    Returns:
+        狀態為 ACTIVE 的 File 物件
+
+    Raises:
+        TimeoutError: 超過等待期限
+        ValueError: 檔案處理失敗
+    """
+    timeout = FILE_PROCESSING_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    interval = FILE_POLL_INITIAL_INTERVAL
+
+    while uploaded.state.name == "PROCESSING":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"File processing timed out after {timeout:.0f}s: {uploaded.name}"
+            )
+
+        logger.info(f"File processing: {uploaded.name} (next check in {interval:.1f}s)")
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * FILE_POLL_BACKOFF, FILE_POLL_MAX_INTERVAL)
+        uploaded = await asyncio.to_thread(genai.get_file, uploaded.name)
+
+    if uploaded.state.name == "FAILED":
+        raise ValueError(f"File processing failed: {uploaded.state}")
+
+    return uploaded
+
+
+async def upload_and_wait(path: str,
+                          timeout: Optional[float] = None,
+                          **kwargs) -> Any:
+    """上傳檔案並等待處理完成
+
+    若等待失敗會嘗試刪除已上傳的遠端檔案
+    """
+    uploaded = await upload_file_async(path, **kwargs)
+    try:
+        started = time.monotonic()
+        uploaded = await wait_for_file_active(uploaded, timeout)
+        cost_model.record('processing_bytes_per_sec',
+                          os.path.getsize(path) / max(time.monotonic() - started, 1.0))
+        return uploaded
+    except BaseException:
+        await delete_file_async(uploaded.name)
+        raise
+
+
+class StreamMediaUpload(googleapiclient.http.MediaUpload):
+    """從不可回溯、長度未知的串流進行 resumable 上傳
+
+    只保留伺服器尚未確認的資料與最多兩個分塊的預讀，記憶體用量與檔案大小無關。
+    預讀讓最後一塊剛好等於分塊大小時，也能在送出前得知總長度。
+    讀到結尾時呼叫串流的 close()，若來源失敗 (例如 ffmpeg 錯誤) 則在送出
+    最後一塊前中止上傳，不會留下截斷的遠端檔案
+    """
+
+    def __init__(self, stream: Any, mimetype: str, chunksize: int = STREAM_UPLOAD_CHUNK_SIZE):
+        self._stream = stream
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._offset = 0
+        self._eof = False
+        self._fill(chunksize + 1)
+
+    def _fill(self, end: int):
+        """讀取串流直到緩衝涵蓋 end 位置或串流結束"""
+        while not self._eof and self._offset + len(self._buffer) < end:
+            data = self._stream.read(min(end - self._offset - len(self._buffer), 1024 * 1024))
+            if not data:
+                self._eof = True
+                self._stream.close()
+                break
+            self._buffer.extend(data)
+
+    @property
+    def bytes_read(self) -> int:
+        return self._offset + len(self._buffer)
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def mimetype(self) -> str:
+        return self._mimetype
+
+    def size(self) -> Optional[int]:
+        return self.bytes_read if self._eof else None
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        # 丟棄伺服器已確認的資料
+        if begin > self._offset:
+            del self._buffer[:begin - self._offset]
+            self._offset = begin
+        self._fill(begin + 2 * length + 1)
+        start = begin - self._offset
+        return bytes(self._buffer[start:start + length])
+
+    def to_json(self) -> str:
+        """上傳狀態的 JSON 表示 (串流與緩衝無法序列化，不包含在內)"""
+        return self._to_json(strip=['_stream', '_buffer'])
+
+
+def _get_discovery_api(client: Any) -> Optional[Any]:
+    """取得檔案 API 的 discovery 用戶端
+
+    SDK 沒有公開以自訂 MediaUpload 上傳的介面，只能使用 FileServiceClient
+    的內部屬性；SDK 版本不提供這些屬性時回傳 None
+    """
+    local = getattr(client, '_local', None)
+    setup = getattr(client, '_setup_discovery_api', None)
+    if local is None or not callable(setup):
+        return None
+    if getattr(local, 'discovery_api', None) is None:
+        setup()
+    return getattr(local, 'discovery_api', None)
+
+
+def _upload_spooled(stream: Any, mime_type: str,
+                    display_name: Optional[str]) -> Tuple[Any, int]:
+    """先將串流寫入暫存檔，再以 genai.upload_file 上傳"""
+    fd, tmp_path = tempfile.mkstemp(prefix='gemini_stream_')
+    try:
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = stream.read(1024 * 1024)
+                    if not data:
+                        break
+                    f.write(data)
+                    size += len(data)
+            # 確認來源成功後才上傳
+            stream.close()
+        except BaseException:
+            stream.abort()
+            raise
+        uploaded = genai.upload_file(tmp_path, mime_type=mime_type, display_name=display_name)
+        return uploaded, size
+    finally:
+        os.remove(tmp_path)
+
+
+def _upload_stream(open_stream: Callable[[], Any], mime_type: str,
+                   display_name: Optional[str]) -> Tuple[Any, int]:
+    """在目前執行緒以串流上傳 (genai.upload_file 需要可回溯的檔案)
+
+    SDK 內部介面不可用時改為先寫入暫存檔再上傳
+    """
+    client = get_default_file_client()
+    discovery_api = _get_discovery_api(client)
+
+    stream = open_stream()
+    if discovery_api is None:
+        logger.warning("Streaming upload is not supported by this SDK version, spooling to a temporary file")
+        return _upload_spooled(stream, mime_type, display_name)
+
+    try:
+        media = StreamMediaUpload(stream, mime_type)
+        body = {'file': {'displayName': display_name}} if display_name else {'file': {}}
+        request = discovery_api.media().upload(body=body, media_body=media)
+        result = request.execute()
+    except BaseException:
+        stream.abort()
+        raise
+
+    remote = client.get_file({'name': result['file']['name']})
+    return file_types.File(remote), media.bytes_read
+
+
+async def upload_stream_and_wait(open_stream: Callable[[], Any], mime_type: str,
+                                 display_name: Optional[str] = None,
+                                 timeout: Optional[float] = None) -> Tuple[Any, int]:
+    """從串流上傳並等待處理完成
+
+    Args:
+        open_stream: 在上傳執行緒中開啟串流的函數；串流需提供 read()、
+            close() (確認來源成功) 與 abort()
+        mime_type: 檔案 MIME 類型
+        display_name: 遠端顯示名稱
+        timeout: 等待處理完成的最長秒數
+
+    Returns:
+        (狀態為 ACTIVE 的 File 物件, 上傳位元組數)
+    """
+    async with _get_upload_semaphore():
+        logger.info(f"Streaming upload: {display_name or mime_type}")
+        uploaded, size = await asyncio.to_thread(_upload_stream, open_stream, mime_type, display_name)
+        logger.info(f"Stream uploaded successfully ({size} bytes). URI: {uploaded.uri}")
+
+    try:
+        started = time.monotonic()
+        uploaded = await wait_for_file_active(uploaded, timeout)
+        cost_model.record('processing_bytes_per_sec', size / max(time.monotonic() - started, 1.0))
+        return uploaded, size
+    except BaseException:
+        await delete_file_async(uploaded.name)
+        raise
+
+
+async def delete_file_async(name: str) -> bool:
+    """在背景執行緒刪除遠端檔案
+
+    Returns:
+        是否刪除成功
+    """
+    try:
+        await asyncio.to_thread(genai.delete_file, name)
+        logger.info(f"Uploaded file cleaned up: {name}")
+        return True
+    except Exception as cleanup_error:
+        logger.warning(f"Failed to cleanup uploaded file {name}: {cleanup_error}")
+        return False
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """計算檔案內容的 SHA-256 雜湊"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadedFileCache:
+    """以內容雜湊索引已上傳至 Gemini 的檔案
+
+    索引記錄遠端檔案名稱、URI、到期時間與狀態，持久化為 JSON 檔案。
+    超過 TTL、遠端到期或超出容量預算 (LRU) 的項目會被移除並刪除遠端檔案；
+    get_or_upload 取得、尚未 release 的檔案有參照計數，不會被淘汰。
+    """
+
+    def __init__(self, index_path: str = FILE_CACHE_INDEX_PATH,
+                 ttl: float = FILE_CACHE_TTL,
+                 max_bytes: int = FILE_CACHE_MAX_BYTES):
+        """初始化檔案快取
+
+        Args:
+            index_path: 本機索引檔案路徑
+            ttl: 項目存活秒數 (0 表示停用快取)
+            max_bytes: 快取遠端檔案的總容量上限
+        """
+        self.index_path = index_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # 等待共用查詢/上傳結果的呼叫端 (記錄是否已取得參照)
+        self._waiters: Dict[str, List[Dict[str, Any]]] = {}
+        # 使用中的遠端檔案名稱 -> 參照數
+        self._refs: Dict[str, int] = {}
+        self._loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        """快取是否啟用"""
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def _load(self):
+        """從磁碟載入索引"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to load uploaded file index, starting empty: {e}")
+            self._entries = {}
+
+    def _save(self):
+        """以原子寫入方式儲存索引"""
+        directory = os.path.dirname(self.index_path) or '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.uploaded_files_')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Failed to save uploaded file index: {e}")
+
+    def _pinned(self, entry: Dict[str, Any]) -> bool:
+        """項目的遠端檔案是否仍在使用中"""
+        return self._refs.get(entry['name'], 0) > 0
+
+    def _take_expired(self) -> List[Dict[str, Any]]:
+        """移除已到期且未使用中的項目並回傳"""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items()
+                   if entry['expires_at'] <= now and not self._pinned(entry)]
+        return [self._entries.pop(key) for key in expired]
+
+    def _take_over_budget(self, keep: Optional[str] = None) -> List[Dict[str, Any]]:
+        """依 LRU 移除超出容量預算的項目並回傳
+
+        Args:
+            keep: 不可淘汰的項目 (例如剛上傳、正要使用的檔案)
+        """
+        evicted = []
+        total = sum(entry['size'] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep or self._pinned(self._entries[key]):
+                continue
+            entry = self._entries.pop(key)
+            total -= entry['size']
+            evicted.append(entry)
+        return evicted
+
+    async def _delete_entries(self, entries: List[Dict[str, Any]]):
+        """刪除被淘汰項目的遠端檔案"""
+        for entry in entries:
+            await delete_file_async(entry['name'])
+
+    async def evict(self):
+        """清除到期與超出預算的項目"""
+        self._load()
+        removed = self._take_expired() + self._take_over_budget()
+        if removed:
+            self._save()
+            await self._delete_entries(removed)
+
+    async def _lookup(self, digest: str) -> Optional[Any]:
+        """查詢並驗證遠端檔案仍然可用"""
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+
+        try:
+            remote = await asyncio.to_thread(genai.get_file, entry['name'])
+        except Exception as e:
+            logger.info(f"Cached file {entry['name']} no longer available: {e}")
+            self._entries.pop(digest, None)
+            self._save()
+            return None
+
+        if remote.state.name != "ACTIVE":
+            self._entries.pop(digest, None)
+            self._save()
+            await delete_file_async(entry['name'])
+            return None
+
+        entry['last_used'] = time.time()
+        entry['state'] = remote.state.name
+        self._save()
+        return remote
+
+    def _record(self, digest: str, uploaded: Any, size: int):
+        """記錄新上傳的檔案"""
+        now = time.time()
+        expires_at = now + self.ttl
+        remote_expiry = getattr(uploaded, 'expiration_time', None)
+        if remote_expiry is not None:
+            expires_at = min(expires_at, remote_expiry.timestamp() - REMOTE_EXPIRY_MARGIN)
+
+        self._entries[digest] = {
+            'name': uploaded.name,
+            'uri': uploaded.uri,
+            'state': uploaded.state.name,
+            'size': size,
+            'created_at': now,
+            'last_used': now,
+            'expires_at': expires_at
+        }
+
+    async def get_or_upload(self, path: str, timeout: Optional[float] = None) -> Any:
+        """取得內容相同的已上傳檔案，不存在時才上傳
+
+        Args:
+            path: 本機檔案路徑
+            timeout: 等待處理完成的最長秒數
+
+        Returns:
+            狀態為 ACTIVE 的 File 物件
+        """
+        if not self.enabled:
+            return await upload_and_wait(path, timeout)
+
+        digest = await asyncio.to_thread(file_sha256, path)
+
+        async def upload() -> Tuple[Any, int]:
+            return await upload_and_wait(path, timeout), os.path.getsize(path)
+
+        return await self._get_or_create(digest, upload, path)
+
+    async def get_or_upload_stream(self, key: str, open_stream: Callable[[], Any],
+                                   mime_type: str, display_name: Optional[str] = None,
+                                   timeout: Optional[float] = None) -> Any:
+        """取得以 key 識別的已上傳內容，不存在時從串流上傳
+
+        Args:
+            key: 可決定串流內容的識別鍵 (例如來源雜湊加處理設定)
+            open_stream: 開啟串流的函數，參見 upload_stream_and_wait
+            mime_type: 檔案 MIME 類型
+            display_name: 遠端顯示名稱
+            timeout: 等待處理完成的最長秒數
+
+        Returns:
+            狀態為 ACTIVE 的 File 物件
+        """
+        async def upload() -> Tuple[Any, int]:
+            return await upload_stream_and_wait(open_stream, mime_type, display_name, timeout)
+
+        if not self.enabled:
+            uploaded, _ = await upload()
+            return uploaded
+
+        return await self._get_or_create(key, upload, display_name or key)
+
+    def _acquire(self, uploaded: Any) -> Any:
+        """增加遠端檔案的參照數 (由 release 減少)"""
+        self._refs[uploaded.name] = self._refs.get(uploaded.name, 0) + 1
+        return uploaded
+
+    def _pin_waiters(self, digest: str, uploaded: Any):
+        """為等待此內容且尚未取得參照的呼叫端增加參照數"""
+        for waiter in self._waiters.get(digest, []):
+            if waiter['file'] is None:
+                waiter['file'] = self._acquire(uploaded)
+
+    def _unpin(self, uploaded: Any):
+        """減少遠端檔案的參照數"""
+        count = self._refs.get(uploaded.name, 0) - 1
+        if count > 0:
+            self._refs[uploaded.name] = count
+        else:
+            self._refs.pop(uploaded.name, None)
+
+    async def _fetch(self, digest: str,
+                     upload: Callable[[], Awaitable[Tuple[Any, int]]],
+                     label: str) -> Any:
+        """查詢快取，未命中時上傳並記錄 (在共用的背景工作中執行)"""
+        try:
+            await self.evict()
+
+            cached = await self._lookup(digest)
+            if cached is not None:
+                self.hits += 1
+                logger.info(f"Reusing uploaded file {cached.name} for {label}")
+                self._pin_waiters(digest, cached)
+                return cached
+
+            self.misses += 1
+            uploaded, size = await upload()
+            self._record(digest, uploaded, size)
+            # 淘汰前先為等待中的呼叫端增加參照，避免剛上傳的檔案被其他請求淘汰
+            self._pin_waiters(digest, uploaded)
+            evicted = self._take_over_budget(keep=digest)
+            self._save()
+            await self._delete_entries(evicted)
+            self._pin_waiters(digest, uploaded)
+            return uploaded
+        finally:
+            self._inflight.pop(digest, None)
+            self._waiters.pop(digest, None)
+
+    async def _get_or_create(self, digest: str,
+                             upload: Callable[[], Awaitable[Tuple[Any, int]]],
+                             label: str) -> Any:
+        """查詢快取，未命中時上傳並記錄 (相同內容的並行請求共用同一次查詢與上傳)
+
+        查詢與上傳在獨立的工作中執行：第一個呼叫端被取消時上傳仍會完成，
+        其他等待同一內容的呼叫端不受影響
+        """
+        task = self._inflight.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(digest, upload, label))
+            # 所有呼叫端都已取消時，避免出現未取用例外的警告
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[digest] = task
+        else:
+            self.hits += 1
+
+        waiter = {'file': None}
+        self._waiters.setdefault(digest, []).append(waiter)
+        try:
+            uploaded = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 取消前已取得的參照立即歸還
+            if waiter['file'] is not None:
+                self._unpin(waiter['file'])
+            else:
+                waiters = self._waiters.get(digest, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+            raise
+        if waiter['file'] is None:
+            self._acquire(uploaded)
+        return uploaded
+
+    async def release(self, uploaded: Any):
+        """使用完畢後釋放檔案 (未啟用快取時刪除遠端檔案)"""
+        if not self.enabled:
+            await delete_file_async(uploaded.name)
+            return
+        self._unpin(uploaded)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        self._load()
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': sum(entry['size'] for entry in self._entries.values()),
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
@@ -6,10 +6,14 @@ A Model Context Protocol (MCP) server that provides access to Google Gemini AI c
 """
 
 import asyncio
+import contextvars
+import functools
 import json
 import logging
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Union
 
 import google.generativeai as genai
@@ -18,6 +22,12 @@ import mcp.types as types
 from mcp.server import NotificationOptions, Server
 import mcp.server.stdio
 
+from gemini_files import UploadedFileCache
+from model_pool import ModelPool
+from rate_governor import RateGovernor, estimate_tokens
+from response_cache import ResponseCache, make_cache_key
+from video_jobs import JobScheduler, current_job
+
 # 配置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -31,6 +41,60 @@ server = Server("gemini-mcp-server")
 # 全域模型變數
 model = None
 
+# 模型實例池
+model_pool = ModelPool(int(os.getenv("GEMINI_MODEL_POOL_SIZE", "32")))
+
+# API 速率控制 (RPM/TPM 排隊、重試與斷路器)
+rate_governor = RateGovernor()
+
+# 確定性呼叫的回應快取 (GEMINI_RESPONSE_CACHE=true 啟用)
+response_cache = ResponseCache()
+
+# 僅快取溫度不高於此值的請求
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("GEMINI_RESPONSE_CACHE_MAX_TEMPERATURE", "0.2"))
+
+# 程式碼分析固定使用低溫度，結果穩定且可快取
+ANALYZE_CODE_TEMPERATURE = float(os.getenv("GEMINI_ANALYZE_CODE_TEMPERATURE", "0.2"))
+
+# 已上傳影片檔案的內容雜湊索引
+uploaded_file_cache = UploadedFileCache()
+
+# 影片背景工作 (提交後以工作 ID 查詢進度與結果)
+job_scheduler = JobScheduler()
+
+# 可作為背景工作提交的工具
+JOB_TOOLS = ("gemini_video_analysis", "gemini_video_optimizer")
+
+# 串流輸出預設值 (客戶端提供 progressToken 時以進度通知轉送部分輸出)
+STREAMING_DEFAULT = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
+
+# 長影片分段 map-reduce 分析的並行數量
+SEGMENT_CONCURRENCY = int(os.getenv("GEMINI_SEGMENT_CONCURRENCY", "4"))
+
+# 管線化分段處理中，已編碼但尚未上傳的分段數上限
+PIPELINE_DEPTH = int(os.getenv("GEMINI_PIPELINE_DEPTH", "2"))
+
+# 單檔優化改為 ffmpeg 輸出 fMP4 到管線並直接串流上傳 (不寫入中間檔案)
+STREAM_UPLOAD = os.getenv("GEMINI_STREAM_UPLOAD", "false").lower() == "true"
+
+# 影片分析預設移除長時間靜態的片段
+REMOVE_STATIC_DEFAULT = os.getenv("GEMINI_REMOVE_STATIC", "false").lower() == "true"
+
+# 批次生成預設並行數量
+BATCH_CONCURRENCY = int(os.getenv("GEMINI_BATCH_CONCURRENCY", "8"))
+
+# 影片處理專用執行緒池的大小 (每個優先順序各一個)
+VIDEO_WORKERS = int(os.getenv("GEMINI_VIDEO_WORKERS", "8"))
+
+# 影片處理執行緒池，依 ffmpeg 優先順序分開；等待 ffmpeg 名額的執行緒
+# 不佔用 asyncio 預設執行緒池 (上傳、輪詢、雜湊)，背景工作也不會排在互動式工作之前
+_video_executors: Dict[int, ThreadPoolExecutor] = {}
+
+# 工具預設生成配置 (用於預熱模型池)
+DEFAULT_CHAT_CONFIG = {"temperature": 0.7}
+DEFAULT_GENERATE_CONFIG = {"max_output_tokens": 2048, "temperature": 0.7}
+ANALYZE_CODE_CONFIG = {"temperature": ANALYZE_CODE_TEMPERATURE}
+
 def setup_authentication():
     """設置 Google Gemini API 認證"""
     global model
@@ -58,7 +122,9 @@ def setup_authentication():
     # 初始化模型
     model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
     try:
-        model = genai.GenerativeModel(model_name)
+        # 初始化不計入模型池命中統計
+        model = model_pool.get(model_name, track=False)
+        model_pool.warm_up(model.model_name, [DEFAULT_CHAT_CONFIG, DEFAULT_GENERATE_CONFIG, ANALYZE_CODE_CONFIG])
         logger.info(f"Initialized model: {model_name}")
     except Exception as e:
         logger.error(f"Failed to initialize model {model_name}: {e}")
@@ -87,6 +153,10 @@ async def handle_list_tools() -> list[types.Tool]:
                         "description": "創意度控制 (0.0-1.0)，預設 0.7",
                         "minimum": 0.0,
                         "maximum": 1.0
+                    },
+                    "stream": {
+                        "type": "boolean",
+                        "description": "以 MCP 進度通知串流部分輸出 (需客戶端提供 progressToken)"
                     }
                 },
                 "required": ["message"]
@@ -113,11 +183,101 @@ async def handle_list_tools() -> list[types.Tool]:
                         "description": "創意度控制 (0.0-1.0)",
                         "minimum": 0.0,
                         "maximum": 1.0
+                    },
+                    "stream": {
+                        "type": "boolean",
+                        "description": "以 MCP 進度通知串流部分輸出 (需客戶端提供 progressToken)"
+                    },
+                    "bypass_cache": {
+                        "type": "boolean",
+                        "description": "略過回應快取，強制重新呼叫 API"
                     }
                 },
                 "required": ["prompt"]
             }
         ),
+        types.Tool(
+            name="gemini_batch_generate",
+            description="使用 Gemini 並行批次生成多個提示詞的內容",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "description": "批次項目，每項為提示詞字串，或提供 prompt/messages 並可覆寫生成配置的物件",
+                        "items": {
+                            "anyOf": [
+                                {"type": "string"},
+                                {
+                                    "type": "object",
+                                    "properties": {
+                                        "prompt": {
+                                            "type": "string",
+                                            "description": "生成文本的提示詞"
+                                        },
+                                        "messages": {
+                                            "type": "array",
+                                            "description": "多輪對話訊息 (role: user/model)",
+                                            "items": {
+                                                "type": "object",
+                                                "properties": {
+                                                    "role": {
+                                                        "type": "string",
+                                                        "enum": ["user", "model"]
+                                                    },
+                                                    "content": {
+                                                        "type": "string"
+                                                    }
+                                                },
+                                                "required": ["content"]
+                                            }
+                                        },
+                                        "system_instruction": {
+                                            "type": "string",
+                                            "description": "此項目的系統指令"
+                                        },
+                                        "max_output_tokens": {
+                                            "type": "integer",
+                                            "minimum": 1,
+                                            "maximum": 8192
+                                        },
+                                        "temperature": {
+                                            "type": "number",
+                                            "minimum": 0.0,
+                                            "maximum": 1.0
+                                        }
+                                    }
+                                }
+                            ]
+                        },
+                        "minItems": 1
+                    },
+                    "system_instruction": {
+                        "type": "string",
+                        "description": "所有項目的預設系統指令"
+                    },
+                    "max_output_tokens": {
+                        "type": "integer",
+                        "description": "所有項目的預設最大輸出 token 數量",
+                        "minimum": 1,
+                        "maximum": 8192
+                    },
+                    "temperature": {
+                        "type": "number",
+                        "description": "所有項目的預設創意度 (0.0-1.0)",
+                        "minimum": 0.0,
+                        "maximum": 1.0
+                    },
+                    "max_concurrency": {
+                        "type": "integer",
+                        "description": f"最大並行請求數 (預設 {BATCH_CONCURRENCY})",
+                        "minimum": 1,
+                        "maximum": 64
+                    }
+                },
+                "required": ["items"]
+            }
+        ),
         types.Tool(
             name="gemini_analyze_code",
             description="使用 Gemini 分析程式碼，提供改進建議",
@@ -136,6 +296,14 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "string",
                         "description": "分析類型: review, optimize, debug, explain",
                         "enum": ["review", "optimize", "debug", "explain"]
+                    },
+                    "stream": {
+                        "type": "boolean",
+                        "description": "以 MCP 進度通知串流部分輸出 (需客戶端提供 progressToken)"
+                    },
+                    "bypass_cache": {
+                        "type": "boolean",
+                        "description": "略過回應快取，強制重新呼叫 API"
                     }
                 },
                 "required": ["code"]
@@ -154,6 +322,10 @@ async def handle_list_tools() -> list[types.Tool]:
                     "question": {
                         "type": "string",
                         "description": "關於圖像的問題或分析要求"
+                    },
+                    "stream": {
+                        "type": "boolean",
+                        "description": "以 MCP 進度通知串流部分輸出 (需客戶端提供 progressToken)"
                     }
                 },
                 "required": ["image_path"]
@@ -187,6 +359,49 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "string",
                         "description": "目標解析度: high (720p), standard (480p), low (360p)",
                         "enum": ["high", "standard", "low"]
+                    },
+                    "segment_mode": {
+                        "type": "string",
+                        "description": "長影片分段時的處理方式: map_reduce (並行分析全部分段後合併，預設), first (僅分析第一段)",
+                        "enum": ["map_reduce", "first"]
+                    },
+                    "remove_static": {
+                        "type": "boolean",
+                        "description": "移除長時間靜態的片段以節省 Token 與上傳量，回答中以方括號標示的時間戳記 (例如 [01:23]) 會換算回原片時間，未加方括號的時間不換算 (需要 numpy)"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "description": "輸入方式: video (上傳影片，預設), keyframes (擷取關鍵影格拼成縮圖，以圖片分析；免上傳等待、Token 少，適合摘要或物體識別), audio (只上傳單聲道音軌，適合逐字稿或會議摘要)",
+                        "enum": ["video", "keyframes", "audio"]
+                    },
+                    "keyframe_count": {
+                        "type": "integer",
+                        "description": "keyframes 模式擷取的影格數 (預設: 16)；audio 模式下指定時附上該數量的關鍵影格縮圖 (預設不附)",
+                        "minimum": 1,
+                        "maximum": 64
+                    },
+                    "start": {
+                        "type": ["number", "string"],
+                        "description": "只分析從此時間開始的片段 (秒數或 HH:MM:SS)"
+                    },
+                    "end": {
+                        "type": ["number", "string"],
+                        "description": "只分析到此時間為止的片段 (秒數或 HH:MM:SS)"
+                    },
+                    "ranges": {
+                        "type": "array",
+                        "description": "只分析這些時間範圍 (合併為一段影片分析，回答中以方括號標示的時間戳記會換算為原片時間)；指定時忽略 start/end",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "start": {"type": ["number", "string"]},
+                                "end": {"type": ["number", "string"]}
+                            }
+                        }
+                    },
+                    "stream": {
+                        "type": "boolean",
+                        "description": "以 MCP 進度通知串流部分輸出 (需客戶端提供 progressToken)"
                     }
                 },
                 "required": ["video_path"]
@@ -211,10 +426,70 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "boolean",
                         "description": "僅分析不處理 (預設: false)",
                         "default": False
+                    },
+                    "remove_static": {
+                        "type": "boolean",
+                        "description": "移除長時間靜態的片段 (需要 numpy)",
+                        "default": False
                     }
                 },
                 "required": ["video_path"]
             }
+        ),
+        types.Tool(
+            name="video_job_submit",
+            description="以背景工作提交影片分析或優化，立即回傳工作 ID，不佔用請求等待處理完成",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tool": {
+                        "type": "string",
+                        "description": "要執行的工具",
+                        "enum": list(JOB_TOOLS)
+                    },
+                    "arguments": {
+                        "type": "object",
+                        "description": "該工具的參數 (與直接呼叫時相同)"
+                    }
+                },
+                "required": ["tool", "arguments"]
+            }
+        ),
+        types.Tool(
+            name="video_job_status",
+            description="查詢背景工作的狀態、處理階段與進度",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "string",
+                        "description": "video_job_submit 回傳的工作 ID"
+                    }
+                },
+                "required": ["job_id"]
+            }
+        ),
+        types.Tool(
+            name="video_job_result",
+            description="取得已完成背景工作的輸出",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {
+                        "type": "string",
+                        "description": "video_job_submit 回傳的工作 ID"
+                    }
+                },
+                "required": ["job_id"]
+            }
+        ),
+        types.Tool(
+            name="gemini_server_stats",
+            description="查看伺服器執行統計 (模型池與檔案快取命中率、限流佇列深度與等待時間等)",
+            inputSchema={
+                "type": "object",
+                "properties": {}
+            }
         )
     ]
 
@@ -226,6 +501,8 @@ async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent
             return await chat_tool(arguments)
         elif name == "gemini_generate":
             return await generate_tool(arguments)
+        elif name == "gemini_batch_generate":
+            return await batch_generate_tool(arguments)
         elif name == "gemini_analyze_code":
             return await analyze_code_tool(arguments)
         elif name == "gemini_vision":
@@ -234,6 +511,14 @@ async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent
             return await video_analysis_tool(arguments)
         elif name == "gemini_video_optimizer":
             return await video_optimizer_tool(arguments)
+        elif name == "video_job_submit":
+            return await video_job_submit_tool(arguments)
+        elif name == "video_job_status":
+            return await video_job_status_tool(arguments)
+        elif name == "video_job_result":
+            return await video_job_result_tool(arguments)
+        elif name == "gemini_server_stats":
+            return await server_stats_tool(arguments)
         else:
             raise ValueError(f"Unknown tool: {name}")
     
@@ -246,37 +531,113 @@ async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent
             )
         ]
 
+def _get_progress_target() -> Optional[tuple]:
+    """取得目前請求的進度通知目標 (session, progressToken)"""
+    # 背景工作的進度記錄在工作表，不送往提交工作的請求
+    if current_job.get() is not None:
+        return None
+    try:
+        ctx = server.request_context
+    except LookupError:
+        return None
+    
+    token = ctx.meta.progressToken if ctx.meta else None
+    if token is None:
+        return None
+    return ctx.session, token
+
+async def generate_text(gen_model: genai.GenerativeModel, contents: Any, stream: bool = False) -> str:
+    """呼叫模型生成文字
+    
+    啟用串流且客戶端提供 progressToken 時，逐段消費回應並以進度通知
+    轉送部分文字，最後仍回傳完整組合的結果
+    """
+    target = _get_progress_target() if stream else None
+    model_name = gen_model.model_name
+    estimated_tokens = estimate_tokens(contents)
+    
+    if target is None:
+        response = await rate_governor.call(
+            model_name,
+            lambda: gen_model.generate_content_async(contents),
+            estimated_tokens
+        )
+        rate_governor.settle(model_name, estimated_tokens, response.usage_metadata)
+        return response.text
+    
+    session, token = target
+    started = time.monotonic()
+    received = 0
+    
+    response = await rate_governor.call(
+        model_name,
+        lambda: gen_model.generate_content_async(contents, stream=True),
+        estimated_tokens
+    )
+    async for chunk in response:
+        try:
+            partial = chunk.text
+        except ValueError:
+            # 沒有文字部分的區塊 (例如僅含結束原因)
+            continue
+        if not partial:
+            continue
+        
+        if received == 0:
+            logger.info(f"Time to first token: {time.monotonic() - started:.2f}s")
+        received += len(partial)
+        
+        try:
+            await session.send_progress_notification(token, received, message=partial)
+        except Exception as e:
+            logger.warning(f"Failed to send progress notification: {e}")
+    
+    rate_governor.settle(model_name, estimated_tokens, response.usage_metadata)
+    return response.text
+
+async def generate_text_cached(tool: str, model_name: str, prompt: str,
+                               stream: bool = False, cacheable: bool = True,
+                               generation_config: Optional[Dict[str, Any]] = None,
+                               system_instruction: Optional[str] = None) -> str:
+    """呼叫模型生成文字，並在回應快取啟用時查詢/寫入快取
+    
+    模型實例與快取鍵以相同的生成配置與系統指令建立，設定不同的請求不會共用快取
+    """
+    gen_model = model_pool.get(model_name, generation_config, system_instruction)
+    if not (response_cache.enabled and cacheable):
+        return await generate_text(gen_model, prompt, stream)
+    
+    cache_key = make_cache_key(tool, gen_model.model_name, prompt, generation_config, system_instruction)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Response cache hit for {tool}")
+        return cached
+    
+    text = await generate_text(gen_model, prompt, stream)
+    response_cache.set(cache_key, text)
+    return text
+
 async def chat_tool(arguments: dict) -> list[types.TextContent]:
     """基本對話功能"""
     message = arguments["message"]
     system_instruction = arguments.get("system_instruction")
     temperature = arguments.get("temperature", 0.7)
+    stream = arguments.get("stream", STREAMING_DEFAULT)
     
     try:
-        # 設置生成配置
-        generation_config = genai.types.GenerationConfig(
-            temperature=temperature
+        # 從模型池取得對應設定的模型實例
+        chat_model = model_pool.get(
+            model.model_name,
+            {"temperature": temperature},
+            system_instruction
         )
         
-        # 如果有系統指令，建立新的模型實例
-        if system_instruction:
-            chat_model = genai.GenerativeModel(
-                model_name=model.model_name,
-                generation_config=generation_config,
-                system_instruction=system_instruction
-            )
-        else:
-            chat_model = genai.GenerativeModel(
-                model_name=model.model_name,
-                generation_config=generation_config
-            )
-        
-        response = await chat_model.generate_content_async(message)
+        text = await generate_text(chat_model, message, stream)
         
         return [
             types.TextContent(
                 type="text",
-                text=response.text
+                text=text
             )
         ]
     
@@ -289,24 +650,22 @@ async def generate_tool(arguments: dict) -> list[types.TextContent]:
     prompt = arguments["prompt"]
     max_tokens = arguments.get("max_output_tokens", 2048)
     temperature = arguments.get("temperature", 0.7)
+    stream = arguments.get("stream", STREAMING_DEFAULT)
+    bypass_cache = arguments.get("bypass_cache", False)
     
     try:
-        generation_config = genai.types.GenerationConfig(
-            max_output_tokens=max_tokens,
-            temperature=temperature
-        )
+        generation_config = {"max_output_tokens": max_tokens, "temperature": temperature}
         
-        gen_model = genai.GenerativeModel(
-            model_name=model.model_name,
-            generation_config=generation_config
+        # 僅低溫度 (接近確定性) 的請求使用回應快取
+        cacheable = not bypass_cache and temperature <= RESPONSE_CACHE_MAX_TEMPERATURE
+        text = await generate_text_cached(
+            "gemini_generate", model.model_name, prompt, stream, cacheable, generation_config
         )
         
-        response = await gen_model.generate_content_async(prompt)
-        
         return [
             types.TextContent(
                 type="text",
-                text=response.text
+                text=text
             )
         ]
     
@@ -314,11 +673,105 @@ async def generate_tool(arguments: dict) -> list[types.TextContent]:
         logger.error(f"Generation error: {e}")
         raise
 
+def _build_batch_contents(item: dict) -> Any:
+    """將批次項目轉換為模型輸入內容"""
+    if item.get("messages"):
+        return [
+            {"role": message.get("role", "user"), "parts": [message["content"]]}
+            for message in item["messages"]
+        ]
+    if item.get("prompt"):
+        return item["prompt"]
+    raise ValueError("Batch item requires 'prompt' or 'messages'")
+
+async def batch_generate_tool(arguments: dict) -> list[types.TextContent]:
+    """批次文本生成功能"""
+    items = arguments["items"]
+    max_concurrency = max(1, int(arguments.get("max_concurrency", BATCH_CONCURRENCY)))
+    defaults = {
+        "max_output_tokens": arguments.get("max_output_tokens", 2048),
+        "temperature": arguments.get("temperature", 0.7)
+    }
+    default_instruction = arguments.get("system_instruction")
+    
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run_item(index: int, item: Any) -> dict:
+        if isinstance(item, str):
+            item = {"prompt": item}
+        
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                contents = _build_batch_contents(item)
+                generation_config = {
+                    key: item.get(key, value) for key, value in defaults.items()
+                }
+                gen_model = model_pool.get(
+                    model.model_name,
+                    generation_config,
+                    item.get("system_instruction", default_instruction)
+                )
+                
+                estimated_tokens = estimate_tokens(contents)
+                response = await rate_governor.call(
+                    gen_model.model_name,
+                    lambda: gen_model.generate_content_async(contents),
+                    estimated_tokens
+                )
+                usage = getattr(response, "usage_metadata", None)
+                rate_governor.settle(gen_model.model_name, estimated_tokens, usage)
+                result = {
+                    "index": index,
+                    "text": response.text,
+                    "latency_seconds": round(time.monotonic() - started, 3)
+                }
+                if usage is not None:
+                    result["output_tokens"] = usage.candidates_token_count
+                return result
+            
+            except Exception as e:
+                logger.warning(f"Batch item {index} failed: {e}")
+                return {
+                    "index": index,
+                    "error": str(e),
+                    "latency_seconds": round(time.monotonic() - started, 3)
+                }
+    
+    started = time.monotonic()
+    results = await asyncio.gather(
+        *(run_item(index, item) for index, item in enumerate(items))
+    )
+    elapsed = time.monotonic() - started
+    
+    succeeded = sum(1 for r in results if "error" not in r)
+    output_tokens = sum(r.get("output_tokens", 0) for r in results)
+    summary = {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "max_concurrency": max_concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_second": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+        "output_tokens": output_tokens,
+        "output_tokens_per_second": round(output_tokens / elapsed, 1) if elapsed > 0 else None
+    }
+    logger.info(f"Batch generation finished: {summary}")
+    
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({"summary": summary, "results": results}, ensure_ascii=False, indent=2)
+        )
+    ]
+
 async def analyze_code_tool(arguments: dict) -> list[types.TextContent]:
     """程式碼分析功能"""
     code = arguments["code"]
     language = arguments.get("language", "未指定")
     analysis_type = arguments.get("analysis_type", "review")
+    stream = arguments.get("stream", STREAMING_DEFAULT)
+    bypass_cache = arguments.get("bypass_cache", False)
     
     # 建立分析提示詞
     analysis_prompts = {
@@ -331,12 +784,15 @@ async def analyze_code_tool(arguments: dict) -> list[types.TextContent]:
     prompt = f"{analysis_prompts.get(analysis_type, analysis_prompts['review'])}\n\n```{language}\n{code}\n```"
     
     try:
-        response = await model.generate_content_async(prompt)
+        cacheable = not bypass_cache and ANALYZE_CODE_TEMPERATURE <= RESPONSE_CACHE_MAX_TEMPERATURE
+        text = await generate_text_cached(
+            "gemini_analyze_code", model.model_name, prompt, stream, cacheable, ANALYZE_CODE_CONFIG
+        )
         
         return [
             types.TextContent(
                 type="text",
-                text=response.text
+                text=text
             )
         ]
     
@@ -348,6 +804,7 @@ async def vision_tool(arguments: dict) -> list[types.TextContent]:
     """圖像分析功能"""
     image_path = arguments["image_path"]
     question = arguments.get("question", "請描述這張圖片的內容")
+    stream = arguments.get("stream", STREAMING_DEFAULT)
     
     try:
         # 檢查圖片檔案是否存在
@@ -358,12 +815,12 @@ async def vision_tool(arguments: dict) -> list[types.TextContent]:
         import PIL.Image
         image = PIL.Image.open(image_path)
         
-        response = await model.generate_content_async([question, image])
+        text = await generate_text(model, [question, image], stream)
         
         return [
             types.TextContent(
                 type="text",
-                text=response.text
+                text=text
             )
         ]
     
@@ -371,6 +828,344 @@ async def vision_tool(arguments: dict) -> list[types.TextContent]:
         logger.error(f"Vision analysis error: {e}")
         raise
 
+def _format_timestamp(seconds: float) -> str:
+    """將秒數轉換為 HH:MM:SS"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def _select_video_model_name() -> str:
+    """選擇支援影片分析的模型"""
+    # 優先順序：gemini-2.0-flash-001 > gemini-1.5-pro > gemini-1.5-flash
+    video_models = ['gemini-2.0-flash-001', 'gemini-1.5-pro', 'gemini-1.5-flash']
+    current_model = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    
+    # 如果當前模型支援影片分析，使用當前模型，否則使用 gemini-1.5-pro
+    if current_model in video_models:
+        return current_model
+    
+    logger.info(f"Current model {current_model} doesn't support video analysis, using gemini-1.5-pro")
+    return 'gemini-1.5-pro'
+
+async def _analyze_segment(vision_model: genai.GenerativeModel, segment: dict,
+                           total: int, question: str) -> str:
+    """上傳並分析單一分段，提示詞中標示其在原片中的時間範圍"""
+    index = segment['index']
+    start = segment['start']
+    end = start + (segment['duration'] or 0)
+    segment_question = (
+        f"這是完整影片的第 {index + 1}/{total} 段，對應原片時間 "
+        f"{_format_timestamp(start)} - {_format_timestamp(end)}。"
+        f"提及時間點時，請換算為原片的絕對時間戳記並以方括號標示 ([HH:MM:SS])。\n\n{question}"
+    )
+    
+    video_file = await uploaded_file_cache.get_or_upload(segment['file'])
+    try:
+        logger.info(f"Analyzing segment {index + 1}/{total}")
+        return await generate_text(vision_model, [segment_question, video_file])
+    finally:
+        await uploaded_file_cache.release(video_file)
+
+async def _reduce_segment_answers(vision_model: genai.GenerativeModel, segments: List[dict],
+                                  results: List[Any], question: str, stream: bool = False) -> str:
+    """將各分段的回答合併為帶有原片時間戳記的完整結果"""
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+    
+    parts = []
+    for i, (segment, result) in enumerate(zip(segments, results)):
+        start = segment['start']
+        end = start + (segment['duration'] or 0)
+        header = f"[第 {i + 1} 段 {_format_timestamp(start)} - {_format_timestamp(end)}]"
+        if isinstance(result, BaseException):
+            logger.warning(f"Segment {i + 1} analysis failed: {result}")
+            parts.append(f"{header}\n(此段分析失敗: {result})")
+        else:
+            parts.append(f"{header}\n{result}")
+    
+    reduce_prompt = (
+        "以下是同一部影片依時間順序切分後，各分段分別回答同一問題的結果。"
+        "請整合為一份連貫、依時間排序的完整回答，保留並使用原片的絕對時間戳記 ([HH:MM:SS])，"
+        "去除重複內容；若某段分析失敗，請註明該時段缺少資訊。\n\n"
+        f"問題：{question}\n\n" + "\n\n".join(parts)
+    )
+    return await generate_text(vision_model, reduce_prompt, stream)
+
+async def _analyze_video_segments(vision_model: genai.GenerativeModel, segments: List[dict],
+                                  question: str, stream: bool = False) -> str:
+    """以 map-reduce 分析已完成編碼的多段影片
+    
+    各分段以有限並行度上傳並分析 (map)，再以一次呼叫將各段回答
+    合併為帶有原片時間戳記的完整結果 (reduce)
+    """
+    semaphore = asyncio.Semaphore(max(1, SEGMENT_CONCURRENCY))
+    segments = [{**segment, 'index': i} for i, segment in enumerate(segments)]
+    
+    async def run(segment: dict) -> str:
+        async with semaphore:
+            return await _analyze_segment(vision_model, segment, len(segments), question)
+    
+    results = await asyncio.gather(*(run(segment) for segment in segments), return_exceptions=True)
+    return await _reduce_segment_answers(vision_model, segments, results, question, stream)
+
+def _attach_video_progress(optimizer: Any):
+    """客戶端提供 progressToken 時，將 ffmpeg 進度 (百分比與剩餘時間) 轉為 MCP 進度通知
+    
+    在背景工作中執行時改為更新工作進度
+    """
+    job_id = current_job.get()
+    if job_id is not None:
+        optimizer.progress_callback = (
+            lambda percent, eta, message: job_scheduler.report_progress(job_id, percent, eta, message)
+        )
+        return
+    
+    target = _get_progress_target()
+    if target is None:
+        return
+    session, token = target
+    loop = asyncio.get_running_loop()
+    
+    def report(percent: float, eta: Optional[float], message: str):
+        # 由 ffmpeg 工作執行緒呼叫，交回事件迴圈送出
+        asyncio.run_coroutine_threadsafe(
+            session.send_progress_notification(token, round(percent, 1), total=100, message=message),
+            loop
+        )
+    
+    optimizer.progress_callback = report
+
+def _video_executor() -> ThreadPoolExecutor:
+    """目前優先順序的影片處理執行緒池"""
+    from ffmpeg_runner import current_priority
+    
+    priority = current_priority.get()
+    executor = _video_executors.get(priority)
+    if executor is None:
+        executor = _video_executors[priority] = ThreadPoolExecutor(
+            max_workers=max(1, VIDEO_WORKERS), thread_name_prefix=f'video-{priority}'
+        )
+    return executor
+
+async def _run_optimizer(optimizer: Any, func: Any, *args: Any, **kwargs: Any) -> Any:
+    """在影片處理執行緒池執行，不阻塞其他工具呼叫；呼叫被取消時終止 ffmpeg 行程"""
+    # 與 asyncio.to_thread 相同，帶入目前的 contextvars (優先順序、所屬工作)
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_video_executor(), call)
+    except asyncio.CancelledError:
+        optimizer.cancel_token.cancel()
+        raise
+
+async def _pipeline_video_segments(optimizer: Any, video_path: str, strategy: Dict[str, Any],
+                                   vision_model: genai.GenerativeModel, question: str,
+                                   stream: bool = False) -> tuple:
+    """以管線方式編碼、上傳並分析長影片分段
+    
+    編碼在背景執行緒逐段進行；每段完成後立即進入上傳/處理/分析階段，
+    因此第 N+1 段編碼時，第 N 段可同時上傳、第 N-1 段在 Gemini 端處理。
+    已編碼待上傳的分段數受 GEMINI_PIPELINE_DEPTH 限制，進行中的上傳/分析
+    數量受 GEMINI_SEGMENT_CONCURRENCY 限制，以免編碼過度超前。
+    
+    Returns:
+        (合併後的分析結果, 分段數量)
+    """
+    from video_optimizer import remove_temp_output
+    
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, PIPELINE_DEPTH))
+    in_flight = asyncio.Semaphore(max(1, SEGMENT_CONCURRENCY))
+    segments_iter = optimizer.iter_optimized_segments(video_path, strategy)
+    done = object()
+    # 已編碼但未進入分析的分段 (取消或失敗時清理)
+    unprocessed: List[dict] = []
+    
+    def discard(segment: dict):
+        # 快取中的分段保留供之後重複分析
+        if not segment.get('cached') and os.path.exists(segment['file']):
+            remove_temp_output(segment['file'])
+    
+    async def produce():
+        try:
+            while True:
+                encoding = asyncio.ensure_future(_run_optimizer(optimizer, next, segments_iter, done))
+                try:
+                    segment = await asyncio.shield(encoding)
+                except asyncio.CancelledError:
+                    # 背景執行緒中的編碼無法中斷，終止 ffmpeg 後等它結束以清理輸出
+                    optimizer.cancel_token.cancel()
+                    segment = (await asyncio.gather(encoding, return_exceptions=True))[0]
+                    if isinstance(segment, dict):
+                        unprocessed.append(segment)
+                    raise
+                try:
+                    await queue.put(segment)
+                except asyncio.CancelledError:
+                    if segment is not done:
+                        unprocessed.append(segment)
+                    raise
+                if segment is done:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 通知消費端結束，例外於 await producer 時拋出
+            await queue.put(done)
+            raise
+    
+    async def process(segment: dict) -> str:
+        try:
+            return await _analyze_segment(vision_model, segment, segment['count'], question)
+        finally:
+            in_flight.release()
+            discard(segment)
+    
+    producer = asyncio.create_task(produce())
+    segments: List[dict] = []
+    tasks: List[asyncio.Task] = []
+    try:
+        while True:
+            await in_flight.acquire()
+            segment = await queue.get()
+            if segment is done:
+                in_flight.release()
+                break
+            segments.append(segment)
+            tasks.append(asyncio.create_task(process(segment)))
+        
+        # 編碼失敗時拋出例外
+        await producer
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    except BaseException:
+        optimizer.cancel_token.cancel()
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+        while not queue.empty():
+            segment = queue.get_nowait()
+            if segment is not done:
+                unprocessed.append(segment)
+        for segment in unprocessed:
+            discard(segment)
+        raise
+    finally:
+        # 歸還快取項目的釘選 (分段檔案已全部處理完畢)
+        optimizer.output_cache.release(segments + unprocessed)
+    
+    text = await _reduce_segment_answers(vision_model, segments, results, question, stream)
+    return text, len(segments)
+
+async def _keyframe_video_analysis(video_path: str, question: str,
+                                   keyframe_count: Optional[int], stream: bool) -> tuple:
+    """以關鍵影格縮圖拼貼經圖片路徑分析影片 (不上傳影片、無檔案處理等待)
+    
+    Returns:
+        (分析結果, 處理說明)
+    """
+    from contact_sheet import FRAME_COUNT, build_prompt
+    from video_optimizer import VideoOptimizer
+    
+    optimizer = VideoOptimizer(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
+    _attach_video_progress(optimizer)
+    result = await _run_optimizer(
+        optimizer, optimizer.extract_contact_sheets, video_path, keyframe_count or FRAME_COUNT
+    )
+    sheets, times = result['sheets'], result['times']
+    
+    video_model_name = _select_video_model_name()
+    vision_model = model_pool.get(video_model_name)
+    logger.info(f"Using model {video_model_name} for keyframe analysis ({len(times)} frames)")
+    
+    analysis_text = await generate_text(
+        vision_model, [build_prompt(question, times, len(sheets)), *sheets], stream
+    )
+    method = "場景切換點" if result['method'] == 'scene' else "均勻取樣"
+    return analysis_text, f"\n🖼️ 關鍵影格模式: 依{method}擷取 {len(times)} 張影格，拼成 {len(sheets)} 張縮圖分析 (未上傳影片)"
+
+async def _audio_video_analysis(video_path: str, question: str,
+                                keyframe_count: Optional[int], stream: bool) -> tuple:
+    """只上傳縮混後的音軌分析影片，可選擇附上少量關鍵影格縮圖
+    
+    Returns:
+        (分析結果, 處理說明)
+    """
+    from contact_sheet import build_prompt
+    from video_optimizer import VideoOptimizer, remove_temp_output
+    
+    optimizer = VideoOptimizer(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
+    _attach_video_progress(optimizer)
+    
+    # 音軌擷取與關鍵影格擷取同時進行
+    jobs = [_run_optimizer(optimizer, optimizer.extract_audio, video_path)]
+    if keyframe_count:
+        jobs.append(_run_optimizer(optimizer, optimizer.extract_contact_sheets, video_path, keyframe_count))
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            if not isinstance(results[0], BaseException):
+                if results[0]['cached']:
+                    optimizer.output_cache.release([results[0]])
+                else:
+                    remove_temp_output(results[0]['file'])
+            raise result
+    audio = results[0]
+    sheets = results[1]['sheets'] if keyframe_count else []
+    
+    if sheets:
+        prompt = "附上的音訊是這段影片的完整音軌 (單聲道)。" + build_prompt(question, results[1]['times'], len(sheets))
+    else:
+        prompt = f"附上的音訊是一段影片的完整音軌 (單聲道，不含畫面)。\n\n{question}"
+    
+    video_model_name = _select_video_model_name()
+    vision_model = model_pool.get(video_model_name)
+    logger.info(f"Using model {video_model_name} for audio-only analysis")
+    
+    audio_mb = os.path.getsize(audio['file']) / (1024 * 1024)
+    try:
+        audio_file = await uploaded_file_cache.get_or_upload(audio['file'])
+        try:
+            analysis_text = await generate_text(vision_model, [prompt, audio_file, *sheets], stream)
+        finally:
+            await uploaded_file_cache.release(audio_file)
+    finally:
+        if audio['cached']:
+            optimizer.output_cache.release([audio])
+        elif os.path.exists(audio['file']):
+            remove_temp_output(audio['file'])
+    
+    video_mb = os.path.getsize(video_path) / (1024 * 1024)
+    info = f"\n🎧 純音訊模式: 只上傳單聲道音軌 {audio_mb:.1f} MB (影片 {video_mb:.1f} MB)"
+    if sheets:
+        info += f"，附 {len(results[1]['times'])} 張關鍵影格縮圖"
+    return analysis_text, info
+
+def _parse_time(value: Union[int, float, str]) -> float:
+    """將秒數或 HH:MM:SS / MM:SS 字串轉換為秒數"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _parse_time_ranges(arguments: dict) -> Optional[List[tuple]]:
+    """取得要分析的時間範圍 (ranges 或 start/end)，未指定時回傳 None"""
+    if arguments.get("ranges"):
+        items = arguments["ranges"]
+    elif arguments.get("start") is not None or arguments.get("end") is not None:
+        items = [{"start": arguments.get("start"), "end": arguments.get("end")}]
+    else:
+        return None
+    
+    ranges = []
+    for item in items:
+        start = _parse_time(item["start"]) if item.get("start") is not None else 0.0
+        end = _parse_time(item["end"]) if item.get("end") is not None else float("inf")
+        if end <= start:
+            raise ValueError(f"Invalid time range: end must be after start ({item})")
+        ranges.append((start, end))
+    return ranges
+
 async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
     """影片分析功能"""
     video_path = arguments["video_path"]
@@ -378,6 +1173,11 @@ async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
     analysis_type = arguments.get("analysis_type", "summary")
     auto_optimize = arguments.get("auto_optimize", True)
     target_resolution = arguments.get("target_resolution")
+    segment_mode = arguments.get("segment_mode", "map_reduce")
+    remove_static = arguments.get("remove_static", REMOVE_STATIC_DEFAULT)
+    mode = arguments.get("mode", "video")
+    stream = arguments.get("stream", STREAMING_DEFAULT)
+    time_ranges = _parse_time_ranges(arguments)
     
     # 分析類型對應的提示詞
     analysis_prompts = {
@@ -393,6 +1193,14 @@ async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
     else:
         enhanced_question = question
     
+    # 回答的時間戳記需換算回原片時間時，請模型以方括號標示
+    if remove_static or time_ranges:
+        from static_removal import TIMESTAMP_INSTRUCTION
+        enhanced_question = f"{enhanced_question}\n\n{TIMESTAMP_INSTRUCTION}"
+    
+    segments = [{'file': video_path, 'start': 0.0, 'duration': None}]
+    clip = None
+    
     try:
         # 檢查影片檔案是否存在
         if not os.path.exists(video_path):
@@ -404,9 +1212,43 @@ async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
         if file_ext not in supported_formats:
             raise ValueError(f"Unsupported video format: {file_ext}. Supported formats: {', '.join(supported_formats)}")
         
+        # 指定時間範圍時先剪出該範圍，後續處理與上傳量只隨範圍長度成長
+        source_path = video_path
+        clip_info = ""
+        if time_ranges:
+            from video_optimizer import VideoOptimizer
+            
+            job_scheduler.report_stage("剪輯時間範圍")
+            clipper = VideoOptimizer(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
+            _attach_video_progress(clipper)
+            clip = await _run_optimizer(clipper, clipper.clip_video, video_path, time_ranges)
+            source_path = clip['file']
+            segments = [{'file': source_path, 'start': 0.0, 'duration': None, 'cached': clip['cached']}]
+            clip_info = "\n✂️ 只分析指定時間範圍: " + ", ".join(
+                f"{_format_timestamp(span['start'])}–{_format_timestamp(span['end'])}" for span in clip['timeline']
+            )
+        
+        if mode in ("keyframes", "audio"):
+            handler = _keyframe_video_analysis if mode == "keyframes" else _audio_video_analysis
+            job_scheduler.report_stage("擷取關鍵影格" if mode == "keyframes" else "擷取音軌")
+            analysis_text, optimization_info = await handler(
+                source_path, enhanced_question, arguments.get("keyframe_count"), stream
+            )
+            if clip is not None:
+                from static_removal import remap_timestamps
+                analysis_text = remap_timestamps(analysis_text, clip['timeline'])
+            return [
+                types.TextContent(
+                    type="text",
+                    text=analysis_text + clip_info + optimization_info
+                )
+            ]
+        
         # 自動優化影片（如果啟用）
-        final_video_path = video_path
         optimization_info = ""
+        pipeline_strategy = None
+        stream_strategy = None
+        timeline = None
         
         if auto_optimize:
             try:
@@ -414,27 +1256,47 @@ async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
                 
                 current_model = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
                 optimizer = VideoOptimizer(current_model)
+                _attach_video_progress(optimizer)
                 
-                # 分析影片
-                video_info = optimizer.analyze_video(video_path)
-                strategy = optimizer.get_optimization_strategy(video_info)
+                # 分析影片 (ffprobe/ffmpeg 皆在背景執行緒執行)
+                job_scheduler.report_stage("分析影片資訊")
+                video_info = await _run_optimizer(optimizer, optimizer.analyze_video, source_path)
+                strategy = await _run_optimizer(optimizer, optimizer.get_optimization_strategy, video_info)
                 
                 # 如果指定了目標解析度，覆蓋策略
                 if target_resolution:
                     strategy['target_resolution'] = target_resolution
                     strategy['needs_processing'] = True
+                    optimizer.update_encode_mode(video_info, strategy)
+                
+                # 移除靜態片段 (回答中的時間戳記稍後依 timeline 換算回原片時間)
+                if remove_static and await _run_optimizer(
+                    optimizer, optimizer.apply_static_removal, video_info, strategy
+                ):
+                    timeline = strategy['timeline']
+                    optimization_info += f"\n✂️ {strategy['recommendations'][-1]}"
                 
-                if strategy['needs_processing']:
+                if strategy['needs_processing'] and strategy['segment_required'] and segment_mode == "map_reduce":
+                    # 需要分段的長影片改以管線方式邊編碼邊上傳分析
+                    pipeline_strategy = strategy
+                elif strategy['needs_processing'] and not strategy['segment_required'] and STREAM_UPLOAD:
+                    # 單檔優化：編碼輸出直接串流上傳
+                    stream_strategy = strategy
+                elif strategy['needs_processing']:
                     logger.info("影片需要優化，正在處理...")
-                    optimization_result = optimizer.optimize_video(video_path)
+                    job_scheduler.report_stage("優化影片")
+                    optimization_result = await _run_optimizer(
+                        optimizer, optimizer.optimize_video, source_path, strategy=strategy
+                    )
                     
                     if optimization_result['success']:
-                        final_video_path = optimization_result['optimized_files'][0]
-                        optimization_info = f"\n🔧 影片已優化: {optimization_result['message']}"
-                        logger.info(f"影片優化完成: {final_video_path}")
+                        segments = optimization_result['segments']
+                        optimization_info += f"\n🔧 影片已優化: {optimization_result['message']}"
+                        logger.info(f"影片優化完成: {optimization_result['optimized_files']}")
                     else:
                         logger.warning(f"影片優化失敗，使用原檔案: {optimization_result['message']}")
                         optimization_info = f"\n⚠️ 優化失敗，使用原檔案: {optimization_result['message']}"
+                        timeline = None
                 else:
                     optimization_info = "\n✅ 影片格式已最佳化，無需處理"
                     
@@ -444,137 +1306,110 @@ async def video_analysis_tool(arguments: dict) -> list[types.TextContent]:
             except Exception as e:
                 logger.warning(f"自動優化失敗: {e}")
                 optimization_info = f"\n⚠️ 自動優化失敗: {str(e)}"
+                timeline = None
         
-        # 上傳影片檔案到 Gemini
-        logger.info(f"Uploading video file: {final_video_path}")
-        video_file = genai.upload_file(final_video_path)
-        logger.info(f"Video uploaded successfully. URI: {video_file.uri}")
-        
-        # 等待檔案處理完成
-        import time
-        while video_file.state.name == "PROCESSING":
-            logger.info("Video processing...")
-            time.sleep(2)
-            video_file = genai.get_file(video_file.name)
-        
-        if video_file.state.name == "FAILED":
-            raise ValueError(f"Video processing failed: {video_file.state}")
-        
-        logger.info("Video processing completed, generating analysis...")
-        
-        # 選擇支援影片分析的模型
-        # 優先順序：gemini-2.0-flash-001 > gemini-1.5-pro > gemini-1.5-flash
-        video_models = ['gemini-2.0-flash-001', 'gemini-1.5-pro', 'gemini-1.5-flash']
-        current_model = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-        
-        # 如果當前模型支援影片分析，使用當前模型，否則使用 gemini-1.5-pro
-        if current_model in video_models:
-            video_model_name = current_model
-        else:
-            video_model_name = 'gemini-1.5-pro'
-            logger.info(f"Current model {current_model} doesn't support video analysis, using {video_model_name}")
+        job_scheduler.report_stage("上傳與分析")
         
         # 建立支援影片分析的模型
-        vision_model = genai.GenerativeModel(video_model_name)
+        video_model_name = _select_video_model_name()
+        vision_model = model_pool.get(video_model_name)
         logger.info(f"Using model {video_model_name} for video analysis")
-        response = await vision_model.generate_content_async([enhanced_question, video_file])
         
-        # 清理上傳的檔案
-        try:
-            genai.delete_file(video_file.name)
-            logger.info("Uploaded video file cleaned up")
-        except Exception as cleanup_error:
-            logger.warning(f"Failed to cleanup uploaded file: {cleanup_error}")
-        
-        # 清理優化後的檔案（如果不是原始檔案）
-        if final_video_path != video_path and os.path.exists(final_video_path):
+        if pipeline_strategy is not None:
+            # 分段編碼、上傳、處理與分析重疊進行
+            analysis_text, segment_count = await _pipeline_video_segments(
+                optimizer, source_path, pipeline_strategy, vision_model, enhanced_question, stream
+            )
+            optimization_info = (
+                f"\n🔧 影片已分段優化 (編碼與上傳管線化)"
+                f"\n🧩 已分析全部 {segment_count} 個分段並合併結果"
+            )
+        elif stream_strategy is not None:
+            # 編碼與上傳同時進行；相同來源與設定的結果可重用已上傳的檔案
+            cache_key = await _run_optimizer(optimizer, optimizer.output_cache_key, source_path, stream_strategy)
             try:
-                os.remove(final_video_path)
-                logger.info("Optimized video file cleaned up")
-            except Exception as cleanup_error:
-                logger.warning(f"Failed to cleanup optimized file: {cleanup_error}")
+                video_file = await uploaded_file_cache.get_or_upload_stream(
+                    f"stream:{cache_key}",
+                    lambda: optimizer.open_video_stream(source_path, stream_strategy),
+                    mime_type="video/mp4",
+                    display_name=f"{os.path.splitext(os.path.basename(source_path))[0]}_optimized.mp4"
+                )
+            except asyncio.CancelledError:
+                optimizer.cancel_token.cancel()
+                raise
+            try:
+                analysis_text = await generate_text(vision_model, [enhanced_question, video_file], stream)
+            finally:
+                await uploaded_file_cache.release(video_file)
+            optimization_info += "\n🔧 影片已優化 (編碼輸出直接串流上傳)"
+        elif len(segments) > 1 and segment_mode == "map_reduce":
+            # 長影片分段：並行分析所有分段後合併
+            analysis_text = await _analyze_video_segments(vision_model, segments, enhanced_question, stream)
+            optimization_info += f"\n🧩 已分析全部 {len(segments)} 個分段並合併結果"
+        else:
+            if len(segments) > 1:
+                optimization_info += f"\n⚠️ 僅分析第 1 段 (共 {len(segments)} 段)"
+            
+            # 上傳影片檔案到 Gemini 並等待處理完成 (不阻塞事件迴圈)
+            # 相同內容的影片若已上傳且尚未到期，直接重用遠端檔案
+            video_file = await uploaded_file_cache.get_or_upload(segments[0]['file'])
+            try:
+                logger.info("Video processing completed, generating analysis...")
+                analysis_text = await generate_text(vision_model, [enhanced_question, video_file], stream)
+            finally:
+                # 釋放上傳的檔案 (未啟用重用時刪除)
+                await uploaded_file_cache.release(video_file)
+        
+        if timeline is not None or clip is not None:
+            from static_removal import remap_timestamps
+            # 先換算回剪輯後的時間，再換算回原片時間
+            if timeline is not None:
+                analysis_text = remap_timestamps(analysis_text, timeline)
+            if clip is not None:
+                analysis_text = remap_timestamps(analysis_text, clip['timeline'])
+            optimization_info += "\n🕒 時間戳記已換算為原片時間"
         
         return [
             types.TextContent(
                 type="text",
-                text=response.text + optimization_info
+                text=analysis_text + clip_info + optimization_info
             )
         ]
     
     except Exception as e:
         logger.error(f"Video analysis error: {e}")
-        # 嘗試清理可能的上傳檔案
-        try:
-            if 'video_file' in locals():
-                genai.delete_file(video_file.name)
-        except:
-            pass
         raise
+    
+    finally:
+        # 歸還優化輸出快取項目的釘選
+        cached_outputs = [item for item in segments + [clip or {}] if item.get('cache_key')]
+        if cached_outputs:
+            from video_optimizer import VideoOptimizer
+            VideoOptimizer.output_cache.release(cached_outputs)
+        # 清理優化後的檔案（如果不是原始檔案，且不屬於優化輸出快取）
+        for segment in segments:
+            optimized_path = segment['file']
+            if segment.get('cached'):
+                continue
+            if optimized_path != video_path and os.path.exists(optimized_path):
+                try:
+                    from video_optimizer import remove_temp_output
+                    remove_temp_output(optimized_path)
+                    logger.info(f"Optimized video file cleaned up: {optimized_path}")
+                except Exception as cleanup_error:
+                    logger.warning(f"Failed to cleanup optimized file: {cleanup_error}")
+        # 清理剪輯出的暫存檔案
+        if clip is not None and not clip['cached'] and clip['file'] != video_path and os.path.exists(clip['file']):
+            try:
+                from video_optimizer import remove_temp_output
+                remove_temp_output(clip['file'])
+            except Exception as cleanup_error:
+                logger.warning(f"Failed to cleanup clipped file: {cleanup_error}")
 
 async def video_optimizer_tool(arguments: dict) -> list[types.TextContent]:
     """影片優化工具"""
-    video_path = arguments["video_path"]
-    target_model = arguments.get("target_model", os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
-    analyze_only = arguments.get("analyze_only", False)
-    
     try:
-        from video_optimizer import VideoOptimizer
-        
-        optimizer = VideoOptimizer(target_model)
-        
-        if analyze_only:
-            # 僅分析模式
-            summary = optimizer.get_processing_summary(video_path)
-            return [
-                types.TextContent(
-                    type="text",
-                    text=f"📊 影片分析報告\n\n{summary}"
-                )
-            ]
-        else:
-            # 完整優化模式
-            result = optimizer.optimize_video(video_path)
-            
-            if result['success']:
-                response_text = f"✅ 影片優化完成\n\n"
-                response_text += f"📊 原始檔案: {result['original_file']}\n"
-                response_text += f"🎯 目標模型: {target_model}\n"
-                response_text += f"📈 處理結果: {result['message']}\n\n"
-                
-                if len(result['optimized_files']) > 1:
-                    response_text += f"📁 生成檔案 ({len(result['optimized_files'])} 個):\n"
-                    for i, file in enumerate(result['optimized_files'], 1):
-                        response_text += f"  {i}. {file}\n"
-                else:
-                    response_text += f"📁 優化檔案: {result['optimized_files'][0]}\n"
-                
-                # 添加策略資訊
-                strategy = result['strategy']
-                response_text += f"\n🎯 優化策略:\n"
-                response_text += f"  - 解析度: {strategy['target_resolution']}\n"
-                response_text += f"  - 幀率: {strategy['target_fps']} fps\n"
-                response_text += f"  - 預估 Token: {strategy['estimated_tokens']:,}\n"
-                response_text += f"  - 上傳方式: {strategy['upload_method']}\n"
-                
-                if strategy['recommendations']:
-                    response_text += f"\n💡 建議:\n"
-                    for rec in strategy['recommendations']:
-                        response_text += f"  - {rec}\n"
-                
-                return [
-                    types.TextContent(
-                        type="text",
-                        text=response_text
-                    )
-                ]
-            else:
-                return [
-                    types.TextContent(
-                        type="text",
-                        text=f"❌ 優化失敗: {result['message']}"
-                    )
-                ]
-                
+        text = await _optimize_video(arguments)
     except ImportError:
         return [
             types.TextContent(
@@ -590,26 +1425,203 @@ async def video_optimizer_tool(arguments: dict) -> list[types.TextContent]:
                 text=f"❌ 優化過程發生錯誤: {str(e)}"
             )
         ]
+    return [
+        types.TextContent(
+            type="text",
+            text=text
+        )
+    ]
+
+async def _optimize_video(arguments: dict) -> str:
+    """執行影片優化並回傳報告文字 (失敗時拋出例外，供背景工作記錄為失敗)"""
+    video_path = arguments["video_path"]
+    target_model = arguments.get("target_model", os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
+    analyze_only = arguments.get("analyze_only", False)
+    remove_static = arguments.get("remove_static", REMOVE_STATIC_DEFAULT)
+    
+    from video_optimizer import VideoOptimizer
+    
+    optimizer = VideoOptimizer(target_model)
+    _attach_video_progress(optimizer)
+    
+    if analyze_only:
+        # 僅分析模式
+        summary = await _run_optimizer(
+            optimizer, optimizer.get_processing_summary, video_path, remove_static
+        )
+        return f"📊 影片分析報告\n\n{summary}"
+    
+    # 完整優化模式
+    job_scheduler.report_stage("優化影片")
+    
+    def optimize():
+        strategy = None
+        if remove_static:
+            video_info = optimizer.analyze_video(video_path)
+            strategy = optimizer.get_optimization_strategy(video_info)
+            optimizer.apply_static_removal(video_info, strategy)
+        return optimizer.optimize_video(video_path, strategy=strategy)
+    
+    result = await _run_optimizer(optimizer, optimize)
+    # 回報的檔案不再使用，歸還快取項目的釘選
+    optimizer.output_cache.release(result.get('segments', []))
+    if not result['success']:
+        raise RuntimeError(result['message'])
+    
+    response_text = f"✅ 影片優化完成\n\n"
+    response_text += f"📊 原始檔案: {result['original_file']}\n"
+    response_text += f"🎯 目標模型: {target_model}\n"
+    response_text += f"📈 處理結果: {result['message']}\n\n"
+    
+    if len(result['optimized_files']) > 1:
+        response_text += f"📁 生成檔案 ({len(result['optimized_files'])} 個):\n"
+        for i, file in enumerate(result['optimized_files'], 1):
+            response_text += f"  {i}. {file}\n"
+    else:
+        response_text += f"📁 優化檔案: {result['optimized_files'][0]}\n"
+    
+    # 添加策略資訊
+    strategy = result['strategy']
+    response_text += f"\n🎯 優化策略:\n"
+    response_text += f"  - 解析度: {strategy['target_resolution']}\n"
+    response_text += f"  - 幀率: {strategy['target_fps']} fps\n"
+    response_text += f"  - 預估 Token: {strategy['estimated_tokens']:,}\n"
+    response_text += f"  - 上傳方式: {strategy['upload_method']}\n"
+    response_text += f"  - 處理方式: {'串流複製 (不重新編碼)' if strategy.get('encode_mode') == 'copy' else '重新編碼'}\n"
+    
+    timeline = strategy.get('timeline')
+    if timeline:
+        response_text += f"\n🕒 時間軸對應 (輸出 → 原片):\n"
+        for span in timeline[:20]:
+            response_text += (
+                f"  - {_format_timestamp(span['output_start'])} → "
+                f"{_format_timestamp(span['start'])}–{_format_timestamp(span['end'])}\n"
+            )
+        if len(timeline) > 20:
+            response_text += f"  - ... 其餘 {len(timeline) - 20} 段\n"
+    
+    if strategy['recommendations']:
+        response_text += f"\n💡 建議:\n"
+        for rec in strategy['recommendations']:
+            response_text += f"  - {rec}\n"
+    
+    return response_text
+
+async def _run_video_job(tool: str, arguments: Dict[str, Any]) -> str:
+    """執行背景工作並回傳輸出文字"""
+    if tool == "gemini_video_optimizer":
+        return await _optimize_video(arguments)
+    contents = await video_analysis_tool(arguments)
+    return "\n".join(content.text for content in contents)
+
+async def video_job_submit_tool(arguments: dict) -> list[types.TextContent]:
+    """提交影片背景工作"""
+    tool = arguments["tool"]
+    if tool not in JOB_TOOLS:
+        raise ValueError(f"Unsupported job tool: {tool}. Supported: {', '.join(JOB_TOOLS)}")
+    tool_arguments = arguments.get("arguments") or {}
+    if "video_path" not in tool_arguments:
+        raise ValueError("Job arguments must include video_path")
+    
+    status = job_scheduler.submit(tool, tool_arguments)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(status, ensure_ascii=False, indent=2)
+        )
+    ]
+
+async def video_job_status_tool(arguments: dict) -> list[types.TextContent]:
+    """查詢影片背景工作狀態"""
+    status = job_scheduler.status(arguments["job_id"])
+    if status is None:
+        raise ValueError(f"Job not found: {arguments['job_id']}")
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(status, ensure_ascii=False, indent=2)
+        )
+    ]
+
+async def video_job_result_tool(arguments: dict) -> list[types.TextContent]:
+    """取得影片背景工作的輸出"""
+    job = job_scheduler.get(arguments["job_id"])
+    if job is None:
+        raise ValueError(f"Job not found: {arguments['job_id']}")
+    
+    if job["status"] == "succeeded":
+        text = job["result"]
+    elif job["status"] == "failed":
+        text = f"❌ 工作失敗: {job['error']}"
+    else:
+        text = f"⏳ 工作尚未完成 (狀態: {job['status']})，請稍後再以 video_job_status 查詢"
+    return [
+        types.TextContent(
+            type="text",
+            text=text
+        )
+    ]
+
+async def server_stats_tool(arguments: dict) -> list[types.TextContent]:
+    """伺服器統計資訊"""
+    stats = {
+        "model_pool": model_pool.stats(),
+        "uploaded_file_cache": uploaded_file_cache.stats(),
+        "rate_governor": rate_governor.stats(),
+        "response_cache": response_cache.stats(),
+        "video_jobs": job_scheduler.stats()
+    }
+    
+    try:
+        from ffmpeg_runner import governor
+        from video_optimizer import VideoOptimizer
+        stats["probe_cache"] = VideoOptimizer.probe_cache.stats()
+        stats["output_cache"] = VideoOptimizer.output_cache.stats()
+        stats["ffmpeg_governor"] = governor.stats()
+    except ImportError:
+        pass
+    
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(stats, ensure_ascii=False, indent=2)
+        )
+    ]
 
 async def main():
     """主函數"""
     # 設置認證
     setup_authentication()
     
+    # 清除先前異常結束時遺留的影片暫存目錄
+    try:
+        from video_optimizer import VideoOptimizer
+        VideoOptimizer.output_cache.cleanup_orphans()
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to clean up orphaned video temp dirs: {e}")
+    
+    # 啟動影片背景工作者 (重新排入上次未完成的工作)
+    await job_scheduler.start(_run_video_job)
+    
     # 使用 stdio 伺服器
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="gemini-mcp-server",
-                server_version="1.0.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="gemini-mcp-server",
+                    server_version="1.0.0",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    )
                 )
             )
-        )
+    finally:
+        await job_scheduler.stop()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+GenerativeModel 實例池
+
+以 (model_name, generation_config, system_instruction) 為鍵快取已建立的
+genai.GenerativeModel，避免每次工具呼叫都重新建構模型實例
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPool:
+    """有上限的 LRU 模型實例池"""
+
+    def __init__(self, max_size: int = 32):
+        """初始化模型池
+
+        Args:
+            max_size: 最多保留的模型實例數量
+        """
+        self.max_size = max(1, max_size)
+        self._models: "OrderedDict[Tuple[str, str, Optional[str]], genai.GenerativeModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _make_key(model_name: str,
+                  generation_config: Optional[Dict[str, Any]],
+                  system_instruction: Optional[str]) -> Tuple[str, str, Optional[str]]:
+        """建立正規化的快取鍵 (數值一律以浮點數表示，1 與 1.0 視為相同)"""
+        config = {
+            name: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+            for name, value in (generation_config or {}).items()
+        }
+        config_key = json.dumps(config, sort_keys=True)
+        return (model_name, config_key, system_instruction or None)
+
+    def get(self, model_name: str,
+            generation_config: Optional[Dict[str, Any]] = None,
+            system_instruction: Optional[str] = None,
+            track: bool = True) -> genai.GenerativeModel:
+        """取得 (或建立) 對應設定的模型實例
+
+        Args:
+            model_name: Gemini 模型名稱
+            generation_config: 生成配置 (dict 格式)
+            system_instruction: 可選的系統指令
+            track: 是否計入命中統計 (初始化與預熱時不計入)
+
+        Returns:
+            可重複使用的 GenerativeModel 實例
+        """
+        key = self._make_key(model_name, generation_config, system_instruction)
+
+        with self._lock:
+            instance = self._models.get(key)
+            if instance is not None:
+                self._models.move_to_end(key)
+                if track:
+                    self.hits += 1
+                return instance
+            if track:
+                self.misses += 1
+
+        kwargs: Dict[str, Any] = {'model_name': model_name}
+        if generation_config:
+            kwargs['generation_config'] = dict(generation_config)
+        if system_instruction:
+            kwargs['system_instruction'] = system_instruction
+        instance = genai.GenerativeModel(**kwargs)
+
+        with self._lock:
+            # 其他執行緒可能已先建立相同的實例
+            existing = self._models.get(key)
+            if existing is not None:
+                self._models.move_to_end(key)
+                return existing
+
+            self._models[key] = instance
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+                self.evictions += 1
+
+        return instance
+
+    def warm_up(self, model_name: str,
+                configs: Iterable[Optional[Dict[str, Any]]]) -> int:
+        """預先建立常用設定的模型實例
+
+        Args:
+            model_name: Gemini 模型名稱
+            configs: 要預熱的生成配置列表
+
+        Returns:
+            實際建立的實例數量
+        """
+        created = 0
+        for config in configs:
+            key = self._make_key(model_name, config, None)
+            with self._lock:
+                exists = key in self._models
+            if not exists:
+                self.get(model_name, config, track=False)
+                created += 1
+        logger.info(f"Model pool warmed up with {created} instance(s) for {model_name}")
+        return created
+
+    def stats(self) -> Dict[str, Any]:
+        """取得池的使用統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._models),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
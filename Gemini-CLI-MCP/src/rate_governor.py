@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Gemini API 速率控制器
+
+以每個模型的 token bucket 限制每分鐘請求數 (RPM) 與 token 數 (TPM)，
+超出額度的呼叫依抵達順序排隊等待，遇到 429/5xx 時以抖動指數退避重試，
+持續的上游錯誤則觸發斷路器快速失敗
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 預設額度 (可用 GEMINI_RATE_LIMITS 依模型覆寫)
+DEFAULT_RPM = int(os.getenv("GEMINI_RPM_LIMIT", "60"))
+DEFAULT_TPM = int(os.getenv("GEMINI_TPM_LIMIT", "1000000"))
+
+# 重試與斷路器設定
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "32.0"))
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30.0"))
+
+# 可重試的上游錯誤
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+# 非文字內容的 token 估算 (Gemini 的計費單位：每張圖片固定數量，影片與音訊依秒數)
+IMAGE_TOKENS = 258
+VIDEO_TOKENS_PER_SECOND = 263
+AUDIO_TOKENS_PER_SECOND = 32
+# 檔案沒有時長資訊時，以位元率由檔案大小推算時長
+VIDEO_BYTES_PER_SECOND = 125_000
+AUDIO_BYTES_PER_SECOND = 4_000
+# 無法判斷類型的內容
+FALLBACK_PART_TOKENS = 1000
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路器開啟時拋出的例外"""
+
+
+def _load_model_limits() -> Dict[str, Dict[str, int]]:
+    """讀取 GEMINI_RATE_LIMITS 中的模型額度覆寫"""
+    raw = os.getenv("GEMINI_RATE_LIMITS")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Invalid GEMINI_RATE_LIMITS, ignoring: {e}")
+        return {}
+
+
+def normalize_model_name(model_name: str) -> str:
+    """移除 'models/' 前綴"""
+    return model_name.split("/", 1)[1] if model_name.startswith("models/") else model_name
+
+
+def _media_seconds(part: Any) -> Optional[float]:
+    """取得已上傳影片的時長 (File API 處理完成後才有)"""
+    duration = getattr(getattr(part, "video_metadata", None), "video_duration", None)
+    if hasattr(duration, "total_seconds"):
+        return duration.total_seconds() or None
+    return None
+
+
+def _estimate_part_tokens(part: Any) -> int:
+    """估計單一非文字內容的 token 數"""
+    if type(part).__module__.startswith("PIL."):
+        return IMAGE_TOKENS
+
+    if isinstance(part, dict):
+        mime_type = part.get("mime_type") or ""
+        size = len(part.get("data") or b"")
+    else:
+        mime_type = getattr(part, "mime_type", None) or ""
+        size = getattr(part, "size_bytes", None) or 0
+
+    if mime_type.startswith("image/"):
+        return IMAGE_TOKENS
+    if mime_type.startswith(("video/", "audio/")):
+        video = mime_type.startswith("video/")
+        seconds = _media_seconds(part)
+        if seconds is None and size:
+            seconds = size / (VIDEO_BYTES_PER_SECOND if video else AUDIO_BYTES_PER_SECOND)
+        if seconds:
+            return max(1, int(seconds * (VIDEO_TOKENS_PER_SECOND if video else AUDIO_TOKENS_PER_SECOND)))
+    return FALLBACK_PART_TOKENS
+
+
+def estimate_tokens(contents: Any) -> int:
+    """在本機估計請求的輸入 token 數 (不額外呼叫 count_tokens API)
+
+    文字以字元數粗估，圖片以固定數量計，影片與音訊依時長計算；
+    實際用量於回應後以 settle 修正
+    """
+    parts = contents if isinstance(contents, list) else [contents]
+    chars = 0
+    tokens = 0
+    for part in parts:
+        if isinstance(part, str):
+            chars += len(part)
+        elif isinstance(part, dict) and "parts" in part:
+            tokens += estimate_tokens(part["parts"])
+        else:
+            tokens += _estimate_part_tokens(part)
+    return max(1, tokens + chars // 4)
+
+
+class ModelLimiter:
+    """單一模型的 RPM/TPM token bucket 與公平排隊"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        # asyncio.Lock 依等待順序喚醒，確保先到先服務
+        self._lock = asyncio.Lock()
+
+        self.waiting = 0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        """依經過時間補充額度"""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm > 0:
+            self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int) -> float:
+        """等待直到有足夠額度
+
+        Args:
+            tokens: 預留的 token 數
+
+        Returns:
+            等待秒數
+        """
+        if self.tpm > 0:
+            tokens = min(tokens, self.tpm)
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    delays = []
+                    if self.rpm > 0 and self._requests < 1:
+                        delays.append((1 - self._requests) * 60 / self.rpm)
+                    if self.tpm > 0 and self._tokens < tokens:
+                        delays.append((tokens - self._tokens) * 60 / self.tpm)
+                    if not delays:
+                        break
+                    await asyncio.sleep(max(delays))
+
+                if self.rpm > 0:
+                    self._requests -= 1
+                if self.tpm > 0:
+                    self._tokens -= tokens
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def settle(self, reserved: int, actual: int):
+        """依實際用量修正預留的 token 數 (可產生負額度，延後後續請求)"""
+        if self.tpm > 0:
+            self._refill()
+            self._tokens = min(float(self.tpm), self._tokens - (actual - reserved))
+
+    def refund(self, reserved: int):
+        """退還失敗呼叫預留的 token (請求次數不退還)"""
+        if self.tpm > 0:
+            self.settle(min(reserved, self.tpm), 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得限流統計"""
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "avg_wait_seconds": round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
+
+
+class CircuitBreaker:
+    """連續上游錯誤達門檻後開啟，冷卻後進入半開狀態只允許一個試探請求"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        # 半開狀態下是否已有試探請求進行中
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        """目前狀態: closed / open / half_open"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        """斷路器開啟時拋出 CircuitOpenError
+
+        半開狀態下第一個呼叫成為試探請求，試探結束前其他呼叫同樣快速失敗
+        """
+        state = self.state
+        if state == "open":
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(
+                f"Gemini API circuit breaker is open after {self.failures} consecutive errors; "
+                f"retry in {remaining:.0f}s"
+            )
+        if state == "half_open":
+            if self.probing:
+                raise CircuitOpenError(
+                    "Gemini API circuit breaker is half-open; waiting for the probe request"
+                )
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or (self.failures >= self.threshold and self.state != "open"):
+            # 試探失敗時重新開始冷卻
+            self.opened_at = time.monotonic()
+            self.probing = False
+            self.trips += 1
+            logger.warning(f"Circuit breaker opened after {self.failures} consecutive upstream errors")
+
+    def release_probe(self):
+        """試探請求未取得上游結果 (例如被取消) 時，讓下一個呼叫重新試探"""
+        self.probing = False
+
+
+class RateGovernor:
+    """依模型管理限流、重試與斷路器"""
+
+    def __init__(self, max_retries: int = MAX_RETRIES):
+        self.max_retries = max_retries
+        self._model_limits = _load_model_limits()
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+
+    def _limiter(self, model_name: str) -> ModelLimiter:
+        limiter = self._limiters.get(model_name)
+        if limiter is None:
+            limits = self._model_limits.get(model_name, {})
+            limiter = ModelLimiter(int(limits.get("rpm", DEFAULT_RPM)),
+                                   int(limits.get("tpm", DEFAULT_TPM)))
+            self._limiters[model_name] = limiter
+        return limiter
+
+    def _breaker(self, model_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model_name)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            self._breakers[model_name] = breaker
+        return breaker
+
+    def settle(self, model_name: str, reserved: int, usage_metadata: Any):
+        """以回應的 usage_metadata 修正 token 用量"""
+        actual = getattr(usage_metadata, "total_token_count", None) if usage_metadata else None
+        if actual:
+            self._limiter(normalize_model_name(model_name)).settle(reserved, int(actual))
+
+    async def call(self, model_name: str, func: Callable[[], Awaitable[T]],
+                   estimated_tokens: int = 1) -> T:
+        """在額度內執行 API 呼叫，必要時排隊與重試
+
+        Args:
+            model_name: 模型名稱
+            func: 建立 API 呼叫的函數 (每次重試都會重新呼叫)
+            estimated_tokens: 預留的 token 數
+
+        Returns:
+            API 呼叫的結果
+        """
+        model_name = normalize_model_name(model_name)
+        limiter = self._limiter(model_name)
+        breaker = self._breaker(model_name)
+
+        attempt = 0
+        while True:
+            breaker.check()
+            await limiter.acquire(estimated_tokens)
+            try:
+                result = await func()
+            except RETRYABLE_ERRORS as e:
+                limiter.refund(estimated_tokens)
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                # 全抖動指數退避
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+                attempt += 1
+                self.retries += 1
+                logger.warning(
+                    f"Upstream error from {model_name} ({type(e).__name__}), "
+                    f"retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 請求錯誤或取消：未使用的 token 額度退還，上游狀態未知時釋放試探
+                limiter.refund(estimated_tokens)
+                breaker.release_probe()
+                raise
+
+            breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """取得各模型的限流與斷路器統計"""
+        return {
+            "retries": self.retries,
+            "models": {
+                name: {
+                    **limiter.stats(),
+                    "circuit": self._breaker(name).state,
+                    "circuit_trips": self._breaker(name).trips
+                }
+                for name, limiter in self._limiters.items()
+            }
+        }
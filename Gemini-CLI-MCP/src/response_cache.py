@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Gemini 回應快取
+
+以 (工具, 模型, 提示詞, 生成配置, 系統指令) 的正規化雜湊為鍵，
+快取確定性呼叫的回應文字：記憶體 LRU 為第一層，SQLite 為持久化第二層
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 回應快取設定 (預設停用)
+RESPONSE_CACHE_ENABLED = os.getenv("GEMINI_RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("GEMINI_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("GEMINI_RESPONSE_CACHE_MEMORY_ENTRIES", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("GEMINI_RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+RESPONSE_CACHE_PATH = os.getenv(
+    "GEMINI_RESPONSE_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp", "responses.sqlite3")
+)
+
+
+def make_cache_key(tool: str, model_name: str, prompt: Any,
+                   generation_config: Optional[Dict[str, Any]] = None,
+                   system_instruction: Optional[str] = None) -> str:
+    """建立正規化的快取鍵"""
+    payload = json.dumps(
+        {
+            "tool": tool,
+            "model": model_name,
+            "prompt": prompt,
+            "generation_config": generation_config or {},
+            "system_instruction": system_instruction or None
+        },
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """記憶體 LRU + SQLite 的兩層回應快取"""
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED,
+                 db_path: str = RESPONSE_CACHE_PATH,
+                 ttl: float = RESPONSE_CACHE_TTL,
+                 memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        """初始化回應快取
+
+        Args:
+            enabled: 是否啟用
+            db_path: SQLite 資料庫路徑 (空字串表示僅使用記憶體)
+            ttl: 項目存活秒數
+            memory_entries: 記憶體層最多保留的項目數
+            max_bytes: SQLite 層的總容量上限
+        """
+        self.enabled = enabled
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_entries = max(1, memory_entries)
+        self.max_bytes = max_bytes
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._hit_time = 0.0
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """延遲開啟 SQLite 連線"""
+        if self._db is not None or not self.db_path:
+            return self._db
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache database unavailable, using memory only: {e}")
+            self.db_path = ""
+        return self._db
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        """寫入記憶體層並維持 LRU 上限"""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """查詢快取，未命中或已到期時回傳 None"""
+        started = time.perf_counter()
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self._hit_time += time.perf_counter() - started
+                    return entry[1]
+                del self._memory[key]
+
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute(
+                        "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and row[1] > now:
+                        db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                        db.commit()
+                        self._remember(key, row[1], row[0])
+                        self.disk_hits += 1
+                        self._hit_time += time.perf_counter() - started
+                        return row[0]
+                except sqlite3.Error as e:
+                    logger.warning(f"Response cache read failed: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """寫入快取"""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._remember(key, expires_at, value)
+
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                size = len(value.encode("utf-8"))
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, expires_at, now)
+                )
+                self._evict(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache write failed: {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """移除到期項目，並依最近存取時間淘汰超出容量的項目"""
+        db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "avg_hit_latency_us": round(self._hit_time / hits * 1e6, 1) if hits else 0.0
+            }
+            db = self._db
+            if db is not None:
+                try:
+                    count, size = db.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                    ).fetchone()
+                    stats["disk_entries"] = count
+                    stats["disk_bytes"] = size
+                except sqlite3.Error:
+                    pass
+            return stats
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+靜態片段偵測與時間軸對應
+
+將低解析度灰階影格讀入 NumPy 陣列，批次計算相鄰影格的平均差異，
+找出畫面幾乎不變的長片段 (投影片講解、螢幕錄影、監視器畫面)，
+並建立移除後的新時間軸與原片時間的對應索引。
+
+NumPy 為可選相依套件，未安裝時 available() 回傳 False
+"""
+
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 可選相依
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 偵測用的取樣影格率與影格大小
+SAMPLE_FPS = float(os.getenv("GEMINI_STATIC_SAMPLE_FPS", "2"))
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 36
+# 每批讀入的影格數
+BATCH_FRAMES = 512
+
+# 相鄰影格平均絕對差 (0~255) 低於此值視為靜態
+DIFF_THRESHOLD = float(os.getenv("GEMINI_STATIC_THRESHOLD", "2.0"))
+# 靜態持續超過此秒數才移除
+MIN_STATIC_SECONDS = float(os.getenv("GEMINI_STATIC_MIN_SECONDS", "10"))
+# 每個移除的靜態片段保留開頭的秒數，讓模型仍能看到該畫面
+KEEP_STATIC_SECONDS = float(os.getenv("GEMINI_STATIC_KEEP_SECONDS", "1.0"))
+
+_TIMESTAMP_PATTERN = re.compile(r"(?<![\d:])(?:(\d{1,2}):)?(\d{1,2}):(\d{2})(?![\d:])")
+# 只換算方括號內的時間戳記或時間範圍 (例如 [01:23]、[00:10 - 00:25])，避免改寫「12:30 開會」這類內文
+_BRACKETED_PATTERN = re.compile(r"\[\s*\d{1,2}:\d{2}(?::\d{2})?(?:\s*[-–~至]\s*\d{1,2}:\d{2}(?::\d{2})?)?\s*\]")
+
+# 附加在提示詞後，請模型以可換算的格式標示時間點
+TIMESTAMP_INSTRUCTION = "提及影片中的時間點時，請以方括號標示，例如 [01:23] 或 [01:02:03]。"
+
+
+def available() -> bool:
+    """NumPy 是否可用"""
+    return np is not None
+
+
+def frame_differences(stream: Any, width: int = FRAME_WIDTH, height: int = FRAME_HEIGHT,
+                      batch_frames: int = BATCH_FRAMES) -> "np.ndarray":
+    """從原始灰階影格串流計算相鄰影格的平均絕對差
+
+    Args:
+        stream: 提供 read() 的 gray rawvideo 串流
+        width: 影格寬度
+        height: 影格高度
+        batch_frames: 每批讀入的影格數
+
+    Returns:
+        長度為 (影格數 - 1) 的差異陣列；第 i 項為影格 i 與 i+1 的差異
+    """
+    frame_size = width * height
+    differences = []
+    previous = None
+
+    while True:
+        data = stream.read(frame_size * batch_frames)
+        usable = len(data) - len(data) % frame_size
+        if usable == 0:
+            break
+
+        frames = np.frombuffer(data[:usable], dtype=np.uint8).reshape(-1, frame_size).astype(np.int16)
+        # 與上一批最後一張影格相接，跨批次的差異也不遺漏
+        if previous is not None:
+            frames = np.concatenate([previous[np.newaxis], frames])
+        if len(frames) > 1:
+            differences.append(np.abs(np.diff(frames, axis=0)).mean(axis=1))
+        previous = frames[-1]
+
+    if not differences:
+        return np.zeros(0, dtype=np.float64)
+    return np.concatenate(differences)
+
+
+def find_keep_spans(differences: "np.ndarray", duration: float,
+                    sample_fps: float = SAMPLE_FPS,
+                    threshold: float = DIFF_THRESHOLD,
+                    min_static: float = MIN_STATIC_SECONDS,
+                    keep_static: float = KEEP_STATIC_SECONDS) -> List[Tuple[float, float]]:
+    """依影格差異決定要保留的原片時間區間
+
+    Returns:
+        依時間排序、互不重疊的 (起始秒數, 結束秒數) 列表
+    """
+    if len(differences) == 0:
+        return [(0.0, duration)]
+
+    static = differences < threshold
+    # 找出連續靜態區間的起訖索引 (以差異索引計)
+    padded = np.concatenate([[False], static, [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    runs = edges.reshape(-1, 2)
+
+    spans = []
+    position = 0.0
+    for run_start, run_end in runs:
+        # 差異 i 介於影格 i 與 i+1；靜態區間從影格 run_start 持續到影格 run_end
+        start = float(run_start / sample_fps)
+        end = float(min(run_end / sample_fps, duration))
+        if end - start < min_static:
+            continue
+        cut_start = start + keep_static
+        if cut_start > position:
+            spans.append((position, cut_start))
+        position = end
+
+    if position < duration:
+        spans.append((position, duration))
+    return spans
+
+
+def build_timeline(spans: List[Tuple[float, float]]) -> List[Dict[str, float]]:
+    """建立輸出時間軸與原片時間的對應索引"""
+    timeline = []
+    output_start = 0.0
+    for start, end in spans:
+        timeline.append({'start': start, 'end': end, 'output_start': output_start})
+        output_start += end - start
+    return timeline
+
+
+def to_original_time(timeline: List[Dict[str, float]], seconds: float) -> float:
+    """將輸出影片中的時間換算為原片時間"""
+    for span in reversed(timeline):
+        if seconds >= span['output_start']:
+            return min(span['start'] + seconds - span['output_start'], span['end'])
+    return seconds
+
+
+def remap_timestamps(text: str, timeline: List[Dict[str, float]]) -> str:
+    """將文字中以方括號標示的時間戳記 ([HH:MM:SS] 或 [MM:SS]) 由輸出時間軸換算回原片時間
+
+    未加方括號的時間 (例如內文提到的時刻) 無法與影片時間區分，保持不變
+    """
+    def replace(match: "re.Match") -> str:
+        hours, minutes, seconds = match.groups()
+        value = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+        original = int(round(to_original_time(timeline, value)))
+        if hours is None and original < 3600:
+            return f"{original // 60:02d}:{original % 60:02d}"
+        return f"{original // 3600:02d}:{original % 3600 // 60:02d}:{original % 60:02d}"
+
+    return _BRACKETED_PATTERN.sub(lambda match: _TIMESTAMP_PATTERN.sub(replace, match.group(0)), text)
+
+
+def select_expression(spans: List[Tuple[float, float]]) -> str:
+    """產生 ffmpeg select/aselect 保留指定時間區間的運算式"""
+    return '+'.join(f"between(t,{start:.3f},{end:.3f})" for start, end in spans)
+
+
+def kept_duration(spans: List[Tuple[float, float]]) -> float:
+    """保留區間的總秒數"""
+    return sum(end - start for start, end in spans)
+
+
+def summarize(spans: List[Tuple[float, float]], duration: float) -> Optional[str]:
+    """移除結果的簡短說明"""
+    removed = duration - kept_duration(spans)
+    if removed <= 0:
+        return None
+    return f"移除 {removed:.0f} 秒靜態片段 (約 {removed / duration * 100:.0f}%)"
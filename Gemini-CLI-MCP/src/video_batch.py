@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+影片批次優化
+
+展開目錄與萬用字元後，以有界的工作者數同時優化多個影片
+(ffmpeg 行程總數仍受全域名額限制)。每個完成的檔案立即寫入清單檔，
+中斷後重新執行會略過清單中輸出仍然有效的檔案，結束時列出整體吞吐量
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from ffmpeg_runner import PRIORITY_BATCH, current_priority, governor
+from video_optimizer import VideoOptimizer
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.getenv(
+    "GEMINI_BATCH_MANIFEST_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp", "batch_manifest.json")
+)
+# 指定輸出目錄時清單檔存放在輸出目錄內
+MANIFEST_NAME = "batch_manifest.json"
+
+# 展開目錄時收集的影片副檔名
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v',
+                    '.mpeg', '.mpg', '.wmv', '.flv', '.3gp')
+
+# 單一檔案的處理結果
+OPTIMIZED = "optimized"
+CACHED = "cached"
+UNCHANGED = "unchanged"
+RESUMED = "resumed"
+FAILED = "failed"
+
+
+def collect_inputs(patterns: List[str]) -> List[str]:
+    """展開輸入路徑
+
+    目錄遞迴收集影片檔案，含 * ? [ 的路徑視為萬用字元 (支援 **)，
+    其餘視為單一檔案
+
+    Returns:
+        依路徑排序、不重複的影片檔案列表
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif glob.has_magic(pattern):
+            paths.extend(path for path in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(path))
+        else:
+            paths.append(pattern)
+
+    unique = {}
+    for path in paths:
+        unique.setdefault(os.path.realpath(path), path)
+    return [unique[key] for key in sorted(unique)]
+
+
+def file_identity(video_path: str) -> str:
+    """以檔案大小與修改時間辨識來源是否變更"""
+    st = os.stat(video_path)
+    return f"{st.st_size}|{st.st_mtime_ns}"
+
+
+class BatchManifest:
+    """已完成檔案的清單 (JSON，每次更新以原子寫入)"""
+
+    def __init__(self, path: str):
+        """載入清單
+
+        Args:
+            path: 清單檔路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to load batch manifest, starting over: {e}")
+
+    def lookup(self, video_path: str, settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查詢來源未變更、設定相同且輸出檔案仍存在的完成記錄"""
+        with self._lock:
+            entry = self._entries.get(os.path.realpath(video_path))
+        if (entry is None or entry['identity'] != file_identity(video_path)
+                or entry['settings'] != settings):
+            return None
+        if not all(os.path.exists(path) for path in entry['files']):
+            return None
+        return entry
+
+    def record(self, video_path: str, entry: Dict[str, Any]):
+        """記錄完成的檔案"""
+        with self._lock:
+            self._entries[os.path.realpath(video_path)] = entry
+            self._save()
+
+    def _save(self):
+        """以原子寫入方式儲存清單"""
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.batch_manifest_')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save batch manifest: {e}")
+
+
+class BatchOptimizer:
+    """並行優化多個影片並記錄進度"""
+
+    def __init__(self, model_name: str, output_dir: Optional[str] = None,
+                 manifest_path: Optional[str] = None, jobs: int = 0):
+        """初始化批次處理
+
+        Args:
+            model_name: 目標 Gemini 模型名稱
+            output_dir: 輸出目錄 (未指定時輸出到優化輸出快取)
+            manifest_path: 清單檔路徑 (預設為輸出目錄內或 GEMINI_BATCH_MANIFEST_PATH)
+            jobs: 同時處理的檔案數 (0 表示全域 ffmpeg 名額數)
+        """
+        self.model_name = model_name
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        if manifest_path is None:
+            manifest_path = (os.path.join(self.output_dir, MANIFEST_NAME)
+                             if self.output_dir else MANIFEST_PATH)
+        self.manifest = BatchManifest(manifest_path)
+        self.jobs = max(1, jobs or governor.slots)
+
+        self._lock = threading.Lock()
+        self._optimizers: List[VideoOptimizer] = []
+
+    def _file_output_dir(self, video_path: str) -> Optional[str]:
+        """每個來源使用獨立的輸出子目錄，避免不同目錄下的同名檔案互相覆蓋"""
+        if self.output_dir is None:
+            return None
+        digest = hashlib.sha1(os.path.realpath(video_path).encode('utf-8')).hexdigest()[:8]
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        return os.path.join(self.output_dir, f"{stem}_{digest}")
+
+    def process(self, video_path: str) -> Dict[str, Any]:
+        """處理單一檔案
+
+        Returns:
+            包含 path, status, duration, files, seconds, message 的結果
+        """
+        started = time.monotonic()
+        settings = {'model': self.model_name, 'output_dir': self.output_dir}
+        try:
+            entry = self.manifest.lookup(video_path, settings)
+        except OSError as e:
+            return {'path': video_path, 'status': FAILED, 'duration': 0.0, 'files': [],
+                    'seconds': 0.0, 'message': str(e)}
+        if entry is not None:
+            return {'path': video_path, 'status': RESUMED, 'duration': entry['duration'],
+                    'files': entry['files'], 'seconds': 0.0, 'message': '清單中已完成'}
+
+        optimizer = VideoOptimizer(self.model_name)
+        with self._lock:
+            self._optimizers.append(optimizer)
+        try:
+            identity = file_identity(video_path)
+            result = optimizer.optimize_video(video_path, self._file_output_dir(video_path))
+            # 只需記錄輸出路徑，歸還快取項目的釘選
+            optimizer.output_cache.release(result.get('segments', []))
+        except Exception as e:
+            logger.error(f"批次處理失敗 {video_path}: {e}")
+            return {'path': video_path, 'status': FAILED, 'duration': 0.0, 'files': [],
+                    'seconds': time.monotonic() - started, 'message': str(e)}
+        finally:
+            with self._lock:
+                self._optimizers.remove(optimizer)
+
+        seconds = time.monotonic() - started
+        duration = result['video_info']['duration']
+        if not result['success']:
+            return {'path': video_path, 'status': FAILED, 'duration': duration, 'files': [],
+                    'seconds': seconds, 'message': result['message']}
+
+        if not result['strategy']['needs_processing']:
+            status = UNCHANGED
+        elif result.get('from_cache'):
+            status = CACHED
+        else:
+            status = OPTIMIZED
+        self.manifest.record(video_path, {
+            'identity': identity,
+            'settings': settings,
+            'status': status,
+            'duration': duration,
+            'files': result['optimized_files'],
+            'finished_at': time.time()
+        })
+        return {'path': video_path, 'status': status, 'duration': duration,
+                'files': result['optimized_files'], 'seconds': seconds, 'message': result['message']}
+
+    def probe(self, paths: List[str]) -> Dict[str, str]:
+        """並行取得尚未完成之檔案的影片資訊 (結果存入 ffprobe 快取供後續處理使用)
+
+        Returns:
+            無法分析的檔案對應其錯誤訊息
+        """
+        settings = {'model': self.model_name, 'output_dir': self.output_dir}
+        pending = []
+        for path in paths:
+            try:
+                if self.manifest.lookup(path, settings) is None:
+                    pending.append(path)
+            except OSError:
+                pending.append(path)
+        if not pending:
+            return {}
+
+        optimizer = VideoOptimizer(self.model_name)
+        optimizer.priority = PRIORITY_BATCH
+        with self._lock:
+            self._optimizers.append(optimizer)
+        try:
+            infos = optimizer.analyze_videos(pending, max_workers=self.jobs)
+        finally:
+            with self._lock:
+                self._optimizers.remove(optimizer)
+        return {path: str(info) for path, info in infos.items() if isinstance(info, Exception)}
+
+    def run(self, paths: List[str]) -> Dict[str, Any]:
+        """並行處理所有檔案並逐一列出結果
+
+        中斷 (Ctrl+C) 時終止執行中的 ffmpeg；已完成的檔案已寫入清單，
+        下次執行會從未完成的檔案繼續
+
+        Returns:
+            整體統計
+        """
+        started = time.monotonic()
+        results: List[Dict[str, Any]] = []
+        icons = {OPTIMIZED: '✅', CACHED: '♻️', UNCHANGED: '➖', RESUMED: '⏭️', FAILED: '❌'}
+
+        # 工作者執行緒以批次優先順序取得 ffmpeg 名額 (較低 CPU 優先權)
+        executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='batch',
+                                      initializer=current_priority.set, initargs=(PRIORITY_BATCH,))
+
+        def report(result: Dict[str, Any]):
+            results.append(result)
+            detail = f" ({result['seconds']:.1f}s)" if result['status'] != RESUMED else ''
+            print(f"[{len(results)}/{len(paths)}] {icons[result['status']]} "
+                  f"{result['path']}: {result['message']}{detail}")
+
+        try:
+            # 先並行分析所有檔案，無法分析的檔案不進入優化
+            errors = self.probe(paths)
+            for path, message in errors.items():
+                report({'path': path, 'status': FAILED, 'duration': 0.0, 'files': [],
+                        'seconds': 0.0, 'message': message})
+            futures = [executor.submit(self.process, path) for path in paths if path not in errors]
+            for future in as_completed(futures):
+                report(future.result())
+        except KeyboardInterrupt:
+            print("中斷：終止執行中的處理，已完成的檔案已記錄於清單")
+            with self._lock:
+                for optimizer in self._optimizers:
+                    optimizer.cancel_token.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return summarize(results, time.monotonic() - started)
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """計算批次統計；吞吐量只計入本次實際處理的檔案"""
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    processed = [result for result in results if result['status'] == OPTIMIZED]
+    media_seconds = sum(result['duration'] for result in processed)
+    return {
+        'total': len(results),
+        'counts': counts,
+        'elapsed': elapsed,
+        'media_seconds': media_seconds,
+        'files_per_second': len(processed) / elapsed if elapsed > 0 else 0.0,
+        'media_seconds_per_second': media_seconds / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def format_summary(stats: Dict[str, Any]) -> str:
+    """批次統計的文字說明"""
+    counts = stats['counts']
+    return "\n".join([
+        f"共 {stats['total']} 個檔案，耗時 {stats['elapsed']:.1f} 秒",
+        f"  優化 {counts.get(OPTIMIZED, 0)}、使用快取 {counts.get(CACHED, 0)}、"
+        f"無需處理 {counts.get(UNCHANGED, 0)}、先前已完成 {counts.get(RESUMED, 0)}、"
+        f"失敗 {counts.get(FAILED, 0)}",
+        f"  吞吐量: {stats['files_per_second']:.3f} 檔案/秒，"
+        f"{stats['media_seconds_per_second']:.1f} 媒體秒/秒 "
+        f"(共處理 {stats['media_seconds']:.0f} 媒體秒)"
+    ])
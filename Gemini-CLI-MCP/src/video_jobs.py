@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+影片背景工作排程
+
+長時間的影片分析/優化改為工作：提交後立即回傳工作 ID，由固定數量的
+背景工作者依序執行，客戶端再以工作 ID 查詢階段、進度與結果。
+工作表保存在 SQLite，伺服器重新啟動後未完成的工作會重新排入佇列。
+工作中的 ffmpeg 以批次優先順序取得名額，不佔用保留給互動式請求的名額
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ffmpeg_runner import PRIORITY_BATCH, current_priority
+
+logger = logging.getLogger(__name__)
+
+# 同時執行的工作數
+JOB_WORKERS = int(os.getenv("GEMINI_JOB_WORKERS", "2"))
+# 已結束工作的保留秒數
+JOB_RETENTION = float(os.getenv("GEMINI_JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_DB_PATH = os.getenv(
+    "GEMINI_JOB_DB_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "gemini-mcp", "jobs.sqlite3")
+)
+# 因伺服器重新啟動而中斷的工作最多重新執行的次數
+MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+# 目前執行中的工作 ID (在工作者內設定，供進度回報辨識)
+current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+_COLUMNS = ("id", "tool", "arguments", "status", "stage", "result", "error",
+            "attempts", "created_at", "started_at", "finished_at")
+
+
+class JobScheduler:
+    """有界工作者池 + SQLite 工作表的背景工作排程器"""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, workers: int = JOB_WORKERS,
+                 retention: float = JOB_RETENTION):
+        """初始化排程器
+
+        Args:
+            db_path: SQLite 資料庫路徑 (空字串表示僅保存在記憶體)
+            workers: 同時執行的工作數
+            retention: 已結束工作的保留秒數
+        """
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.retention = retention
+
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[Callable[[str, Dict[str, Any]], Awaitable[str]]] = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """延遲開啟 SQLite 連線"""
+        if self._db is not None or not self.db_path:
+            return self._db
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, tool TEXT NOT NULL, arguments TEXT NOT NULL, "
+                "status TEXT NOT NULL, stage TEXT, result TEXT, error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning(f"Job database unavailable, jobs will not survive restarts: {e}")
+            self.db_path = ""
+        return self._db
+
+    def _save(self, job: Dict[str, Any]):
+        """寫入工作記錄 (呼叫端需持有鎖)"""
+        db = self._connect()
+        if db is None:
+            return
+        try:
+            db.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                tuple(
+                    json.dumps(job[column], ensure_ascii=False) if column == "arguments" else job[column]
+                    for column in _COLUMNS
+                )
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to save job {job['id']}: {e}")
+
+    def _delete_expired(self, db: sqlite3.Connection, cutoff: float):
+        db.execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_STATES)}) "
+            f"AND finished_at < ?",
+            (*FINISHED_STATES, cutoff)
+        )
+        db.commit()
+
+    def _load(self) -> List[Dict[str, Any]]:
+        """載入保留期限內的工作，並清除過期的已結束工作"""
+        db = self._connect()
+        if db is None:
+            return []
+        try:
+            self._delete_expired(db, time.time() - self.retention)
+            rows = db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY created_at").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to load jobs: {e}")
+            return []
+
+        jobs = []
+        for row in rows:
+            job = dict(zip(_COLUMNS, row))
+            job["arguments"] = json.loads(job["arguments"])
+            jobs.append(job)
+        return jobs
+
+    def _prune(self):
+        """移除超過保留期限的已結束工作 (呼叫端需持有鎖)"""
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in FINISHED_STATES and job["finished_at"] < cutoff
+        ]
+        if not expired:
+            return
+        for job_id in expired:
+            del self._jobs[job_id]
+        db = self._connect()
+        if db is not None:
+            try:
+                self._delete_expired(db, cutoff)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to prune expired jobs: {e}")
+        logger.info(f"Pruned {len(expired)} expired video jobs")
+
+    async def start(self, runner: Callable[[str, Dict[str, Any]], Awaitable[str]]):
+        """啟動工作者，並將上次未完成的工作重新排入佇列
+
+        Args:
+            runner: 以 (工具名稱, 參數) 執行工作並回傳結果文字的協程函式
+        """
+        self._runner = runner
+        self._queue = asyncio.Queue()
+
+        recovered = 0
+        with self._lock:
+            for job in self._load():
+                self._jobs[job["id"]] = job
+                if job["status"] not in (QUEUED, RUNNING):
+                    continue
+                if job["attempts"] >= MAX_ATTEMPTS:
+                    job.update(status=FAILED, stage=None, finished_at=time.time(),
+                               error="伺服器多次在執行中重新啟動，已放棄此工作")
+                else:
+                    job.update(status=QUEUED, stage=None)
+                    self._queue.put_nowait(job["id"])
+                    recovered += 1
+                self._save(job)
+        if recovered:
+            logger.info(f"Recovered {recovered} unfinished video jobs")
+
+        # 工作者不繼承呼叫端的情境 (例如 MCP 請求)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"video-job-{i}", context=contextvars.Context())
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        """停止工作者 (執行中的工作於下次啟動時重新執行)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, tool: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """提交工作，回傳工作狀態"""
+        if self._queue is None:
+            raise RuntimeError("工作排程器尚未啟動")
+        job = {
+            "id": uuid.uuid4().hex,
+            "tool": tool,
+            "arguments": arguments,
+            "status": QUEUED,
+            "stage": None,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job["id"]] = job
+            self._save(job)
+        self._queue.put_nowait(job["id"])
+        logger.info(f"Video job submitted: {job['id']} ({tool})")
+        return self.status(job["id"])
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取得工作記錄 (含結果)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取得工作狀態 (不含結果)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = {
+                "job_id": job["id"],
+                "tool": job["tool"],
+                "status": job["status"],
+                "stage": job["stage"],
+                "created_at": job["created_at"],
+                "started_at": job["started_at"],
+                "finished_at": job["finished_at"]
+            }
+            if job["status"] == QUEUED:
+                status["queue_position"] = 1 + sum(
+                    1 for other in self._jobs.values()
+                    if other["status"] == QUEUED and other["created_at"] < job["created_at"]
+                )
+            elif job["status"] == RUNNING:
+                progress = self._progress.get(job_id, {})
+                status["progress"] = progress.get("percent")
+                status["eta_seconds"] = progress.get("eta")
+                status["message"] = progress.get("message")
+                status["elapsed_seconds"] = round(time.time() - job["started_at"], 1)
+            elif job["status"] == FAILED:
+                status["error"] = job["error"]
+            return status
+
+    def report_stage(self, stage: str):
+        """更新目前工作的處理階段 (不在工作中時不做任何事)"""
+        job_id = current_job.get()
+        if job_id is None:
+            return
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["stage"] = stage
+                self._progress.pop(job_id, None)
+                self._save(job)
+
+    def report_progress(self, job_id: str, percent: float, eta: Optional[float], message: str):
+        """更新工作進度 (可從任何執行緒呼叫；只保存在記憶體)"""
+        with self._lock:
+            self._progress[job_id] = {
+                "percent": round(percent, 1),
+                "eta": round(eta) if eta is not None else None,
+                "message": message
+            }
+
+    async def _worker(self):
+        """依序取出並執行工作"""
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return
+            job.update(status=RUNNING, started_at=time.time(), attempts=job["attempts"] + 1)
+            self._save(job)
+
+        token = current_job.set(job_id)
+        priority_token = current_priority.set(PRIORITY_BATCH)
+        started = time.monotonic()
+        try:
+            result = await self._runner(job["tool"], job["arguments"])
+            update = {"status": SUCCEEDED, "result": result}
+        except asyncio.CancelledError:
+            # 伺服器關閉：保留為執行中，下次啟動時重新執行
+            raise
+        except Exception as e:
+            logger.error(f"Video job {job_id} failed: {e}")
+            update = {"status": FAILED, "error": str(e)}
+        finally:
+            current_priority.reset(priority_token)
+            current_job.reset(token)
+
+        with self._lock:
+            job.update(stage=None, finished_at=time.time(), **update)
+            self._progress.pop(job_id, None)
+            self._save(job)
+            self._prune()
+        logger.info(f"Video job {job_id} {job['status']} in {time.monotonic() - started:.1f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """取得工作統計"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {
+                "workers": self.workers,
+                "persistent": bool(self.db_path),
+                "jobs": counts
+            }
@@ -5,16 +5,457 @@
 根據 Gemini 模型能力自動優化影片格式、解析度和分段
 """
 
+import bisect
+import hashlib
+import math
 import os
+import shutil
 import subprocess
 import json
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, Callable, Iterator, List, Tuple, Optional, Union
 import tempfile
+import time
+
+import contact_sheet
+import static_removal
+from cost_model import cost_model
+from ffmpeg_runner import (
+    CancelToken, FFmpegStream, ProgressTracker, current_priority, governor, run_capture, run_ffmpeg
+)
 
 logger = logging.getLogger(__name__)
 
+# 並行編碼分段的 ffmpeg 行程數 (0 表示依全域 ffmpeg 名額數)
+SEGMENT_WORKERS = int(os.getenv('GEMINI_SEGMENT_WORKERS', '0'))
+
+# 分段方式：scene (依場景切換點切割) 或 fixed (等長切割)
+SEGMENTATION_MODE = os.getenv('GEMINI_SEGMENTATION', 'scene').lower()
+# 場景切換判定門檻 (ffmpeg scene 分數，0~1)
+SCENE_THRESHOLD = float(os.getenv('GEMINI_SCENE_THRESHOLD', '0.3'))
+# 切割點可偏離理想位置的比例 (相對於平均分段長度)
+SCENE_SEARCH_WINDOW = 0.1
+# 依大小分段時每段預估大小佔上傳上限的比例 (保留關鍵影格對齊與位元率波動的餘裕)
+SEGMENT_SIZE_MARGIN = 0.8
+
+# 純音訊模式的輸出格式 (單聲道 AAC)
+AUDIO_SAMPLE_RATE = int(os.getenv('GEMINI_AUDIO_SAMPLE_RATE', '16000'))
+AUDIO_ONLY_BITRATE = os.getenv('GEMINI_AUDIO_BITRATE', '32k')
+
+# 時間範圍剪輯時，範圍邊界與關鍵影格的差距小於此秒數則不另外重新編碼
+CLIP_EDGE_EPSILON = 0.05
+
+# 優化輸出快取 (容量上限設為 0 表示停用)
+OUTPUT_CACHE_DIR = os.getenv(
+    'GEMINI_OUTPUT_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'gemini-mcp', 'optimized')
+)
+OUTPUT_CACHE_MAX_BYTES = int(os.getenv('GEMINI_OUTPUT_CACHE_MAX_BYTES', str(20 * 1024 ** 3)))
+
+# 暫存輸出目錄前綴 (含行程 ID，供啟動時辨識遺留目錄)
+TEMP_DIR_PREFIX = 'gemini_video_opt_'
+# 無法辨識擁有者的遺留暫存目錄保留秒數
+ORPHAN_MAX_AGE = 24 * 3600
+
+# 輸出格式版本，變更 ffmpeg 參數時遞增以使舊快取失效
+OUTPUT_FORMAT_VERSION = 1
+
+
+def _pid_alive(pid: int) -> bool:
+    """檢查行程是否仍在執行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def make_temp_dir() -> str:
+    """建立以本行程 ID 標記的暫存輸出目錄"""
+    return tempfile.mkdtemp(prefix=f'{TEMP_DIR_PREFIX}{os.getpid()}_')
+
+
+def remove_temp_output(path: str):
+    """刪除暫存輸出檔；所在的暫存輸出目錄已清空時一併移除"""
+    os.remove(path)
+    directory = os.path.dirname(path)
+    if os.path.basename(directory).startswith(TEMP_DIR_PREFIX):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # 目錄中仍有其他分段尚未處理
+            pass
+
+
+class ProbeCache:
+    """ffprobe 影片資訊快取
+    
+    以 (實際路徑, 檔案大小, 修改時間, inode) 為鍵，檔案內容變更後自動失效。
+    程序內為 LRU 字典，可選擇以 SQLite 持久化跨程序共用
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 1024):
+        """初始化快取
+        
+        Args:
+            db_path: SQLite 持久化路徑 (None 表示僅使用記憶體)
+            max_entries: 記憶體中最多保留的項目數
+        """
+        self.db_path = db_path
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(video_path: str) -> str:
+        """依檔案身分建立快取鍵"""
+        st = os.stat(video_path)
+        return f"{os.path.realpath(video_path)}|{st.st_size}|{st.st_mtime_ns}|{st.st_ino}"
+    
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """延遲開啟 SQLite 連線"""
+        if self._db is not None or not self.db_path:
+            return self._db
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS probes (key TEXT PRIMARY KEY, info TEXT NOT NULL)")
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning(f"無法開啟影片資訊快取資料庫，改用記憶體快取: {e}")
+            self.db_path = None
+        return self._db
+    
+    def _remember(self, key: str, info: Dict[str, Any]):
+        self._entries[key] = info
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查詢快取"""
+        with self._lock:
+            info = self._entries.get(key)
+            if info is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(info)
+            
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT info FROM probes WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        info = json.loads(row[0])
+                        self._remember(key, info)
+                        self.hits += 1
+                        return dict(info)
+                except (sqlite3.Error, json.JSONDecodeError) as e:
+                    logger.warning(f"讀取影片資訊快取失敗: {e}")
+            
+            self.misses += 1
+            return None
+    
+    def set(self, key: str, info: Dict[str, Any]):
+        """寫入快取"""
+        with self._lock:
+            self._remember(key, dict(info))
+            db = self._connect()
+            if db is not None:
+                try:
+                    db.execute("INSERT OR REPLACE INTO probes (key, info) VALUES (?, ?)",
+                               (key, json.dumps(info)))
+                    db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"寫入影片資訊快取失敗: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'persistent': bool(self.db_path),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+class OutputCache:
+    """以內容定址的優化輸出快取
+    
+    以 (來源內容雜湊, 優化策略, ffmpeg 設定) 為鍵，每個項目為一個目錄，
+    內含輸出檔案與最後以原子寫入的 manifest.json；沒有 manifest 的目錄
+    視為尚未完成。超出容量時依最近使用時間 (manifest 修改時間) 淘汰
+    
+    lookup 命中與 commit 完成的項目交給呼叫端時保持釘選 (分段標記 cache_key)，
+    呼叫端用完後以 release 歸還，使用中的項目不會被其他請求的淘汰刪除
+    """
+    
+    MANIFEST = 'manifest.json'
+    OWNER = '.owner'
+    
+    def __init__(self, cache_dir: str = OUTPUT_CACHE_DIR, max_bytes: int = OUTPUT_CACHE_MAX_BYTES):
+        """初始化快取
+        
+        Args:
+            cache_dir: 快取目錄
+            max_bytes: 總容量上限 (0 表示停用)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 本行程使用中的項目，淘汰時略過
+        self._pinned: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(source_digest: str, settings: Dict[str, Any]) -> str:
+        """建立快取鍵"""
+        payload = json.dumps({'source': source_digest, 'settings': settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+    
+    def lookup(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """查詢快取，命中時回傳分段資訊 (檔案為絕對路徑) 並更新使用時間
+        
+        命中的項目會被釘選，呼叫端用完後須呼叫 release
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, self.MANIFEST)
+        # 先釘選再檢查檔案，避免檢查後被並行的淘汰刪除
+        self.pin(key)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            segments = []
+            for segment in manifest['segments']:
+                file_path = os.path.join(entry_dir, segment['file'])
+                if not os.path.exists(file_path):
+                    raise FileNotFoundError(file_path)
+                segments.append({**segment, 'file': file_path, 'cached': True, 'cache_key': key})
+            os.utime(manifest_path)
+        except FileNotFoundError:
+            self.unpin(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            self.unpin(key)
+            logger.warning(f"優化輸出快取項目損毀，移除: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return segments
+    
+    def begin(self, key: str) -> Optional[str]:
+        """建立新項目的輸出目錄
+        
+        Returns:
+            輸出目錄；其他行程正在建立相同項目時回傳 None
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            os.mkdir(entry_dir)
+        except FileExistsError:
+            return None
+        with open(os.path.join(entry_dir, self.OWNER), 'w') as f:
+            f.write(str(os.getpid()))
+        self.pin(key)
+        return entry_dir
+    
+    def commit(self, key: str, segments: List[Dict[str, Any]]):
+        """以原子寫入 manifest 完成項目，並依容量淘汰舊項目
+        
+        begin 時的釘選轉交給呼叫端 (分段標記 cache_key)，用完後須呼叫 release
+        """
+        entry_dir = self._entry_dir(key)
+        manifest = {
+            'created_at': time.time(),
+            'segments': [
+                {
+                    'file': os.path.basename(segment['file']),
+                    'start': segment['start'],
+                    'duration': segment['duration'],
+                    'index': segment.get('index', i),
+                    'count': segment.get('count', len(segments))
+                }
+                for i, segment in enumerate(segments)
+            ]
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix='.manifest_')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(entry_dir, self.MANIFEST))
+        
+        try:
+            os.remove(os.path.join(entry_dir, self.OWNER))
+        except FileNotFoundError:
+            pass
+        for segment in segments:
+            segment['cache_key'] = key
+        self.evict(keep=key)
+    
+    def abort(self, key: str):
+        """放棄未完成的項目"""
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self.unpin(key)
+    
+    def release(self, segments: List[Dict[str, Any]]):
+        """歸還 lookup 或 commit 交給呼叫端的項目 (同一項目的分段只歸還一次)"""
+        for key in {segment.get('cache_key') for segment in segments} - {None}:
+            self.unpin(key)
+    
+    def pin(self, key: str):
+        with self._lock:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+    
+    def unpin(self, key: str):
+        with self._lock:
+            count = self._pinned.get(key, 0) - 1
+            if count > 0:
+                self._pinned[key] = count
+            else:
+                self._pinned.pop(key, None)
+    
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """列出已完成的項目 (最近使用時間, 大小, 鍵)"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            entry_dir = self._entry_dir(name)
+            try:
+                last_used = os.path.getmtime(os.path.join(entry_dir, self.MANIFEST))
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            except OSError:
+                continue
+            entries.append((last_used, size, name))
+        return entries
+    
+    def evict(self, keep: Optional[str] = None) -> int:
+        """依最近使用時間淘汰超出容量的項目
+        
+        Args:
+            keep: 不淘汰的項目 (例如剛完成的項目)
+            
+        Returns:
+            淘汰的項目數
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            # 持有鎖刪除，確保 lookup 釘選後項目不會被刪除
+            with self._lock:
+                if key == keep or key in self._pinned:
+                    continue
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            evicted += 1
+        
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+            logger.info(f"優化輸出快取淘汰 {evicted} 個項目")
+        return evicted
+    
+    def cleanup_orphans(self) -> int:
+        """清除已結束行程遺留的未完成項目與暫存輸出目錄
+        
+        Returns:
+            清除的目錄數
+        """
+        removed = 0
+        
+        # 快取中沒有 manifest 且建立者已結束的項目
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            entry_dir = self._entry_dir(name)
+            if not os.path.isdir(entry_dir) or os.path.exists(os.path.join(entry_dir, self.MANIFEST)):
+                continue
+            try:
+                with open(os.path.join(entry_dir, self.OWNER), 'r') as f:
+                    owner = int(f.read().strip())
+            except (OSError, ValueError):
+                owner = None
+            if owner is None or not _pid_alive(owner):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed += 1
+        
+        # 系統暫存目錄中的 gemini_video_opt_<pid>_* 目錄
+        temp_root = tempfile.gettempdir()
+        now = time.time()
+        for name in os.listdir(temp_root):
+            if not name.startswith(TEMP_DIR_PREFIX):
+                continue
+            path = os.path.join(temp_root, name)
+            owner_text = name[len(TEMP_DIR_PREFIX):].split('_', 1)[0]
+            try:
+                if owner_text.isdigit():
+                    orphaned = not _pid_alive(int(owner_text))
+                else:
+                    # 舊版目錄名稱不含行程 ID，以存在時間判斷
+                    orphaned = now - os.path.getmtime(path) > ORPHAN_MAX_AGE
+            except OSError:
+                continue
+            if orphaned and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        
+        if removed:
+            logger.info(f"已清除 {removed} 個遺留的影片暫存目錄")
+        return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        entries = self._entries()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
 class VideoOptimizer:
     """影片優化器 - 根據 Gemini 模型規格自動優化影片"""
     
@@ -78,6 +519,30 @@ class VideoOptimizer:
         }
     }
     
+    # Gemini File API 可直接接受的影片容器
+    GEMINI_VIDEO_FORMATS = ('.mp4', '.mov', '.avi', '.webm', '.mpeg', '.mpg', '.wmv', '.flv', '.3gp')
+    
+    # 轉碼輸出的預估影像位元率 (bits/s，以 30fps 為基準)
+    TARGET_VIDEO_BITRATES = {
+        'high': 1_500_000,
+        'standard': 800_000,
+        'low': 400_000
+    }
+    AUDIO_BITRATE = 128_000
+    
+    # 處理方案名稱
+    PLAN_DESCRIPTIONS = {
+        'upload_original': '直接上傳原檔',
+        'copy': '串流複製後上傳',
+        'transcode': '轉碼後上傳'
+    }
+    
+    # ffprobe 結果快取 (所有實例共用)
+    probe_cache = ProbeCache(os.getenv('GEMINI_PROBE_CACHE_PATH') or None)
+    
+    # 優化輸出快取 (所有實例共用)
+    output_cache = OutputCache()
+    
     def __init__(self, model_name: str = 'gemini-1.5-flash'):
         """初始化優化器
         
@@ -87,6 +552,13 @@ class VideoOptimizer:
         self.model_name = model_name
         self.model_spec = self.MODEL_SPECS.get(model_name, self.MODEL_SPECS['gemini-1.5-flash'])
         
+        # 取消時終止此優化器啟動的所有 ffmpeg/ffprobe 行程
+        self.cancel_token = CancelToken()
+        # ffmpeg 名額的優先順序 (背景工作與批次處理為 PRIORITY_BATCH)
+        self.priority = current_priority.get()
+        # 進度回呼：(百分比, 剩餘秒數或 None, 描述)，由背景執行緒呼叫
+        self.progress_callback: Optional[Callable[[float, Optional[float], str], None]] = None
+        
     def analyze_video(self, video_path: str) -> Dict[str, Any]:
         """分析影片檔案
         
@@ -99,6 +571,40 @@ class VideoOptimizer:
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"影片檔案不存在: {video_path}")
         
+        # 相同檔案 (大小、修改時間、inode 未變) 直接使用快取結果
+        cache_key = self.probe_cache.make_key(video_path)
+        cached = self.probe_cache.get(cache_key)
+        if cached is not None:
+            cached['file_path'] = video_path
+            return cached
+        
+        analysis = self._probe_video(video_path)
+        self.probe_cache.set(cache_key, analysis)
+        return analysis
+    
+    def analyze_videos(self, video_paths: List[str],
+                       max_workers: Optional[int] = None) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        """並行分析多個影片檔案
+        
+        Args:
+            video_paths: 影片檔案路徑列表
+            max_workers: 同時執行的 ffprobe 數量 (預設依 CPU 核心數)
+            
+        Returns:
+            路徑對應影片資訊的字典；分析失敗的檔案對應其例外
+        """
+        def probe(path: str) -> Union[Dict[str, Any], Exception]:
+            try:
+                return self.analyze_video(path)
+            except Exception as e:
+                return e
+        
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(video_paths, executor.map(probe, video_paths)))
+    
+    def _probe_video(self, video_path: str) -> Dict[str, Any]:
+        """執行 ffprobe 取得影片資訊"""
         try:
             # 使用 ffprobe 獲取影片資訊
             cmd = [
@@ -106,8 +612,7 @@ class VideoOptimizer:
                 '-show_format', '-show_streams', video_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            info = json.loads(result.stdout)
+            info = json.loads(run_capture(cmd, self.cancel_token, self.priority))
             
             # 提取關鍵資訊
             video_stream = next((s for s in info['streams'] if s['codec_type'] == 'video'), None)
@@ -124,8 +629,12 @@ class VideoOptimizer:
                 'height': int(video_stream['height']),
                 'fps': eval(video_stream['r_frame_rate']),  # 轉換分數格式
                 'codec': video_stream['codec_name'],
+                'pix_fmt': video_stream.get('pix_fmt'),
                 'has_audio': audio_stream is not None,
-                'bit_rate': int(info['format'].get('bit_rate', 0))
+                'audio_codec': audio_stream['codec_name'] if audio_stream else None,
+                'bit_rate': int(info['format'].get('bit_rate', 0)),
+                # 第一個封包的時間 (MPEG-TS 等格式常不為 0)
+                'start_time': float(info['format'].get('start_time', 0) or 0)
             }
             
             logger.info(f"影片分析完成: {analysis}")
@@ -155,6 +664,8 @@ class VideoOptimizer:
             'segment_required': False,
             'compress_required': False,
             'upload_method': 'direct',
+            'encode_mode': 'transcode',
+            'segmentation': SEGMENTATION_MODE,
             'estimated_tokens': 0,
             'recommendations': []
         }
@@ -210,27 +721,248 @@ class VideoOptimizer:
             strategy['segment_required']):
             strategy['needs_processing'] = True
         
+        # 7. 以成本模型比較各處理方案，選擇端到端耗時最短者
+        self.plan_processing(video_info, strategy)
+        
         return strategy
     
-    def optimize_video(self, video_path: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+    def plan_processing(self, video_info: Dict[str, Any], strategy: Dict[str, Any]) -> Dict[str, Any]:
+        """估算各處理方案的端到端耗時並選擇最快的可行方案
+        
+        方案包含直接上傳、串流複製與轉碼。耗時 = 本機處理 + 上傳 + Gemini 處理，
+        各項速度取自本機量測 (cost_model)，尚未量測時使用預設值。
+        結果寫入 strategy['plan']，並相應更新 needs_processing 與 encode_mode
+        
+        Returns:
+            規劃結果字典
+        """
+        duration = video_info['duration']
+        file_size = video_info['file_size']
+        target_resolution = strategy['target_resolution']
+        upload_rate = cost_model.get('upload_bytes_per_sec')
+        processing_rate = cost_model.get('processing_bytes_per_sec')
+        
+        def transfer_seconds(size: float) -> float:
+            return size / upload_rate + size / processing_rate
+        
+        candidates = []
+        
+        # A. 直接上傳原檔
+        original_tokens = int(duration * self._source_token_rate(video_info))
+        reasons = []
+        if strategy['segment_required']:
+            reasons.append('需要分段')
+        if Path(video_info['file_path']).suffix.lower() not in self.GEMINI_VIDEO_FORMATS:
+            reasons.append('容器格式不受 Gemini 支援')
+        if file_size > self.SIZE_LIMITS['gcs_upload']:
+            reasons.append('超過上傳大小上限')
+        if original_tokens > self.model_spec['context_window']:
+            reasons.append('預估 Token 超出模型上下文')
+        candidates.append({
+            'plan': 'upload_original',
+            'feasible': not reasons,
+            'reason': '、'.join(reasons),
+            'prepare_seconds': 0.0,
+            'upload_bytes': file_size,
+            'estimated_seconds': transfer_seconds(file_size),
+            'estimated_tokens': original_tokens
+        })
+        
+        # B. 串流複製 (重新封裝/切割)
+        target_tokens = int(duration * self.RESOLUTION_CONFIGS[target_resolution]['token_rate'])
+        copy_seconds = file_size / cost_model.get('copy_bytes_per_sec')
+        copy_feasible = self.can_stream_copy(video_info, target_resolution)
+        candidates.append({
+            'plan': 'copy',
+            'feasible': copy_feasible,
+            'reason': '' if copy_feasible else '來源非 h264 或解析度高於目標',
+            'prepare_seconds': copy_seconds,
+            'upload_bytes': file_size,
+            'estimated_seconds': copy_seconds + transfer_seconds(file_size),
+            'estimated_tokens': target_tokens
+        })
+        
+        # C. 轉碼
+        transcode_bytes = self._transcode_bytes(video_info, strategy)
+        transcode_seconds = duration / cost_model.get('transcode_speed', target_resolution)
+        candidates.append({
+            'plan': 'transcode',
+            'feasible': True,
+            'reason': '',
+            'prepare_seconds': transcode_seconds,
+            'upload_bytes': transcode_bytes,
+            'estimated_seconds': transcode_seconds + transfer_seconds(transcode_bytes),
+            'estimated_tokens': target_tokens
+        })
+        
+        chosen = min((c for c in candidates if c['feasible']), key=lambda c: c['estimated_seconds'])
+        plan = {
+            'choice': chosen['plan'],
+            'estimated_seconds': chosen['estimated_seconds'],
+            'calibrated': any(cost_model.is_measured(metric) for metric in cost_model.DEFAULTS),
+            'candidates': candidates
+        }
+        strategy['plan'] = plan
+        
+        strategy['needs_processing'] = chosen['plan'] != 'upload_original'
+        strategy['encode_mode'] = 'copy' if chosen['plan'] == 'copy' else 'transcode'
+        strategy['estimated_tokens'] = chosen['estimated_tokens']
+        strategy['recommendations'].append(
+            f"規劃器選擇「{self.PLAN_DESCRIPTIONS[chosen['plan']]}」，預估端到端 {chosen['estimated_seconds']:.0f} 秒"
+        )
+        self._require_size_segments(video_info, strategy)
+        return plan
+    
+    def _transcode_bytes(self, video_info: Dict[str, Any], strategy: Dict[str, Any]) -> int:
+        """轉碼輸出的預估大小 (bytes)"""
+        # 位元率大致隨幀率成長，低幀率時仍保留關鍵幀的基本開銷
+        output_fps = min(strategy['target_fps'], video_info['fps'])
+        fps_factor = max(0.25, min(1.0, output_fps / 30))
+        audio_bitrate = self.AUDIO_BITRATE if video_info.get('has_audio', True) else 0
+        return int(
+            (self.TARGET_VIDEO_BITRATES[strategy['target_resolution']] * fps_factor + audio_bitrate)
+            * video_info['duration'] / 8
+        )
+    
+    def estimate_output_bytes(self, video_info: Dict[str, Any], strategy: Dict[str, Any]) -> int:
+        """處理後輸出的預估總大小 (串流複製約等於原檔大小)"""
+        if strategy.get('encode_mode') == 'copy':
+            return video_info['file_size']
+        return self._transcode_bytes(video_info, strategy)
+    
+    def _require_size_segments(self, video_info: Dict[str, Any], strategy: Dict[str, Any]):
+        """預估輸出超過上傳上限時改為分段 (分段數由 _plan_segments 依大小決定)"""
+        if (strategy['needs_processing'] and not strategy['segment_required']
+                and self.estimate_output_bytes(video_info, strategy) > self.SIZE_LIMITS['gcs_upload']):
+            strategy['segment_required'] = True
+            strategy['recommendations'].append("預估輸出超過上傳大小上限，需要分段處理")
+    
+    def _source_token_rate(self, video_info: Dict[str, Any]) -> int:
+        """原始解析度影片的每秒 Token 數"""
+        low_width, low_height = (int(v) for v in self.RESOLUTION_CONFIGS['low']['scale'].split(':'))
+        if video_info['width'] * video_info['height'] <= low_width * low_height:
+            return self.RESOLUTION_CONFIGS['low']['token_rate']
+        return self.RESOLUTION_CONFIGS['high']['token_rate']
+    
+    def can_stream_copy(self, video_info: Dict[str, Any], target_resolution: str) -> bool:
+        """判斷是否可直接複製影片串流而不重新編碼
+        
+        來源已是 h264 且解析度不高於目標時，重新編碼只會降低畫質並耗費 CPU；
+        Gemini 會在伺服器端自行取樣影格，因此幀率差異不需要本機轉碼
+        """
+        if video_info.get('codec') != 'h264':
+            return False
+        target_width, target_height = (
+            int(v) for v in self.RESOLUTION_CONFIGS[target_resolution]['scale'].split(':')
+        )
+        return video_info['width'] * video_info['height'] <= target_width * target_height
+    
+    def update_encode_mode(self, video_info: Dict[str, Any], strategy: Dict[str, Any]):
+        """依目前的目標解析度設定 encode_mode (copy / transcode)
+        
+        用於呼叫端覆寫目標解析度、強制處理影片的情況
+        """
+        if self.can_stream_copy(video_info, strategy['target_resolution']):
+            strategy['encode_mode'] = 'copy'
+            if strategy['needs_processing']:
+                strategy['recommendations'].append("來源已是 h264 且解析度不高於目標，使用串流複製 (不重新編碼)")
+        else:
+            strategy['encode_mode'] = 'transcode'
+        self._require_size_segments(video_info, strategy)
+    
+    def detect_static_spans(self, video_path: str) -> List[Tuple[float, float]]:
+        """以影格差異找出要保留的原片時間區間 (移除長時間靜態的片段)
+        
+        以低影格率解碼 64x36 灰階影格並以 NumPy 批次計算差異；結果與影片資訊共用快取
+        
+        Returns:
+            要保留的 (起始秒數, 結束秒數) 列表
+        """
+        params = (static_removal.SAMPLE_FPS, static_removal.DIFF_THRESHOLD,
+                  static_removal.MIN_STATIC_SECONDS, static_removal.KEEP_STATIC_SECONDS)
+        cache_key = f'static|{params}|' + self.probe_cache.make_key(video_path)
+        cached = self.probe_cache.get(cache_key)
+        if cached is not None:
+            return [tuple(span) for span in cached['spans']]
+        
+        duration = self.analyze_video(video_path)['duration']
+        cmd = [
+            'ffmpeg', '-i', video_path, '-an', '-sn', '-dn',
+            '-vf', (f"fps={static_removal.SAMPLE_FPS},"
+                    f"scale={static_removal.FRAME_WIDTH}:{static_removal.FRAME_HEIGHT},format=gray"),
+            '-f', 'rawvideo', 'pipe:1'
+        ]
+        tracker = self._progress_tracker(duration, '靜態片段偵測')
+        on_progress = (lambda done: tracker.update(0, done)) if tracker is not None else None
+        
+        logger.info(f"偵測靜態片段: {video_path}")
+        with FFmpegStream(cmd, on_progress, self.cancel_token, self.priority) as stream:
+            differences = static_removal.frame_differences(stream)
+        
+        spans = static_removal.find_keep_spans(differences, duration)
+        self.probe_cache.set(cache_key, {'spans': spans})
+        return spans
+    
+    def apply_static_removal(self, video_info: Dict[str, Any], strategy: Dict[str, Any]) -> bool:
+        """在策略中加入靜態片段移除
+        
+        移除後改為轉碼 (以 select 濾鏡只保留活動區間)，並在 strategy['timeline']
+        記錄輸出時間與原片時間的對應。移除後仍需分段的影片不套用
+        
+        Returns:
+            是否套用
+        """
+        if not static_removal.available():
+            strategy['recommendations'].append("靜態片段移除需要安裝 numpy")
+            return False
+        
+        duration = video_info['duration']
+        spans = self.detect_static_spans(video_info['file_path'])
+        kept = static_removal.kept_duration(spans)
+        if kept >= duration * 0.95:
+            strategy['recommendations'].append("未偵測到明顯的靜態片段")
+            return False
+        if kept > self.model_spec['max_duration_low']:
+            strategy['recommendations'].append("移除靜態片段後仍需分段，未套用移除")
+            return False
+        
+        strategy['keep_spans'] = spans
+        strategy['timeline'] = static_removal.build_timeline(spans)
+        strategy['needs_processing'] = True
+        strategy['segment_required'] = False
+        strategy['encode_mode'] = 'transcode'
+        strategy['estimated_tokens'] = int(strategy['estimated_tokens'] * kept / duration)
+        # 規劃器的估算以完整長度計算，已不適用
+        strategy.pop('plan', None)
+        strategy['recommendations'].append(static_removal.summarize(spans, duration))
+        return True
+    
+    def optimize_video(self, video_path: str, output_dir: Optional[str] = None,
+                       strategy: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """優化影片檔案
         
         Args:
             video_path: 輸入影片路徑
-            output_dir: 輸出目錄 (可選)
+            output_dir: 輸出目錄 (可選，未指定時使用優化輸出快取)
+            strategy: 預先決定的優化策略 (可選，預設自動分析)
             
         Returns:
-            優化結果字典
+            優化結果字典；cached 為 True 時輸出檔案屬於快取，呼叫端不應刪除，
+            from_cache 為 True 表示直接取用先前的快取結果
         """
         # 分析影片
         video_info = self.analyze_video(video_path)
-        strategy = self.get_optimization_strategy(video_info)
+        if strategy is None:
+            strategy = self.get_optimization_strategy(video_info)
         
         result = {
             'original_file': video_path,
             'video_info': video_info,
             'strategy': strategy,
             'optimized_files': [],
+            'segments': [],
+            'cached': False,
+            'from_cache': False,
             'success': True,
             'message': ''
         }
@@ -238,13 +970,30 @@ class VideoOptimizer:
         # 如果不需要處理，直接返回
         if not strategy['needs_processing']:
             result['optimized_files'] = [video_path]
+            result['segments'] = [{'file': video_path, 'start': 0.0, 'duration': video_info['duration']}]
             result['message'] = '影片已符合最佳格式，無需處理'
             return result
         
+        cache_key = None
+        if output_dir is None and self.output_cache.enabled:
+            cache_key = self.output_cache_key(video_path, strategy)
+            cached = self.output_cache.lookup(cache_key)
+            if cached is not None:
+                result['segments'] = cached
+                result['optimized_files'] = [segment['file'] for segment in cached]
+                result['cached'] = True
+                result['from_cache'] = True
+                result['message'] = f'使用快取的優化結果，共 {len(cached)} 個檔案'
+                return result
+            # 其他行程正在建立相同項目時改用暫存目錄
+            output_dir = self.output_cache.begin(cache_key)
+            if output_dir is None:
+                cache_key = None
+        
         try:
             # 設定輸出目錄
             if output_dir is None:
-                output_dir = tempfile.mkdtemp(prefix='gemini_video_opt_')
+                output_dir = make_temp_dir()
             else:
                 os.makedirs(output_dir, exist_ok=True)
             
@@ -252,32 +1001,55 @@ class VideoOptimizer:
             
             if strategy['segment_required']:
                 # 分段處理
-                result['optimized_files'] = self._segment_video(
-                    video_path, output_dir, strategy
-                )
+                result['segments'] = list(self.iter_segments(video_path, strategy, output_dir))
+                result['optimized_files'] = [segment['file'] for segment in result['segments']]
             else:
-                # 單檔處理
-                output_file = Path(output_dir) / f"{input_file.stem}_optimized{input_file.suffix}"
+                # 單檔處理 (串流複製一律輸出 mp4 容器)
+                suffix = '.mp4' if strategy.get('encode_mode') == 'copy' else input_file.suffix
+                output_file = Path(output_dir) / f"{input_file.stem}_optimized{suffix}"
                 self._process_single_video(video_path, str(output_file), strategy)
                 result['optimized_files'] = [str(output_file)]
+                result['segments'] = [{'file': str(output_file), 'start': 0.0, 'duration': video_info['duration']}]
             
             result['message'] = f'影片優化完成，生成 {len(result["optimized_files"])} 個檔案'
             
+            if cache_key is not None:
+                self.output_cache.commit(cache_key, result['segments'])
+                result['cached'] = True
+                for segment in result['segments']:
+                    segment['cached'] = True
+            
         except Exception as e:
+            if cache_key is not None:
+                self.output_cache.abort(cache_key)
             result['success'] = False
             result['message'] = f'優化失敗: {str(e)}'
             logger.error(f"影片優化失敗: {e}")
         
         return result
     
-    def _process_single_video(self, input_path: str, output_path: str, strategy: Dict[str, Any]):
-        """處理單個影片檔案"""
+    def _single_video_command(self, input_path: str, strategy: Dict[str, Any]) -> List[str]:
+        """單檔處理的 ffmpeg 命令 (不含輸出目標)"""
+        if strategy.get('encode_mode') == 'copy':
+            # 僅重新封裝，以磁碟速度完成
+            cmd = ['ffmpeg', '-i', input_path, '-y', '-map', '0:v:0', '-map', '0:a?', '-c:v', 'copy']
+            cmd.extend(self._copy_audio_args(self.analyze_video(input_path)))
+            return cmd
+        
         resolution_config = self.RESOLUTION_CONFIGS[strategy['target_resolution']]
         
         cmd = ['ffmpeg', '-i', input_path, '-y']  # -y 覆蓋輸出檔案
         
-        # 設定解析度
-        cmd.extend(['-vf', f"scale={resolution_config['scale']}"])
+        # 設定解析度 (移除靜態片段時先以 select 保留活動區間並重排時間戳)
+        video_filter = f"scale={resolution_config['scale']}"
+        keep_spans = strategy.get('keep_spans')
+        if keep_spans:
+            expression = static_removal.select_expression(keep_spans)
+            video_filter = f"select='{expression}',setpts=N/FRAME_RATE/TB,{video_filter}"
+            # 無音軌時 -af 會讓 ffmpeg 找不到可套用的串流而失敗
+            if self.analyze_video(input_path).get('has_audio', True):
+                cmd.extend(['-af', f"aselect='{expression}',asetpts=N/SR/TB"])
+        cmd.extend(['-vf', video_filter])
         
         # 設定 FPS
         cmd.extend(['-r', str(strategy['target_fps'])])
@@ -290,53 +1062,740 @@ class VideoOptimizer:
         
         # 音訊處理
         cmd.extend(['-c:a', 'aac', '-b:a', '128k'])
+        return cmd
+    
+    def _process_single_video(self, input_path: str, output_path: str, strategy: Dict[str, Any]):
+        """處理單個影片檔案"""
+        cmd = self._single_video_command(input_path, strategy)
+        duration = self.analyze_video(input_path)['duration']
+        
+        if strategy.get('encode_mode') == 'copy':
+            cmd.extend(['-movflags', '+faststart', output_path])
+            logger.info(f"執行 FFmpeg 命令: {' '.join(cmd)}")
+            started = time.monotonic()
+            self._run_ffmpeg(cmd, self._progress_tracker(duration, '串流複製'))
+            cost_model.record('copy_bytes_per_sec',
+                              os.path.getsize(input_path) / (time.monotonic() - started))
+            return
         
         cmd.append(output_path)
         
         logger.info(f"執行 FFmpeg 命令: {' '.join(cmd)}")
-        subprocess.run(cmd, check=True, capture_output=True)
+        started = time.monotonic()
+        self._run_ffmpeg(cmd, self._progress_tracker(duration, '轉碼'))
+        cost_model.record('transcode_speed',
+                          duration / (time.monotonic() - started),
+                          key=strategy['target_resolution'])
     
-    def _segment_video(self, input_path: str, output_dir: str, strategy: Dict[str, Any]) -> list:
-        """分段處理影片"""
-        video_info = self.analyze_video(input_path)
-        duration = video_info['duration']
+    def open_video_stream(self, input_path: str, strategy: Dict[str, Any]) -> FFmpegStream:
+        """以分段式 MP4 (fMP4) 將單檔處理結果輸出到管線
         
-        # 計算分段時間
+        fMP4 不需在檔尾回寫 moov，可在編碼同時依序讀取並上傳，
+        省去寫入與讀回中間檔案
+        
+        Returns:
+            FFmpegStream，讀取完畢後需呼叫 close() 確認 ffmpeg 執行成功
+        """
+        cmd = self._single_video_command(input_path, strategy)
+        cmd.extend(['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', 'pipe:1'])
+        label = '串流複製' if strategy.get('encode_mode') == 'copy' else '串流轉碼'
+        tracker = self._progress_tracker(self.analyze_video(input_path)['duration'], label)
+        
+        logger.info(f"執行 FFmpeg 命令: {' '.join(cmd)}")
+        on_progress = (lambda done: tracker.update(0, done)) if tracker is not None else None
+        return FFmpegStream(cmd, on_progress, self.cancel_token, self.priority)
+    
+    def _plan_segments(self, duration: float, input_path: Optional[str] = None,
+                       strategy: Optional[Dict[str, Any]] = None) -> List[Tuple[float, float]]:
+        """計算分段的 (起始秒數, 長度) 列表
+        
+        每段不超過 max_duration_low，且預估大小不超過上傳上限 (乘上 SEGMENT_SIZE_MARGIN)。
+        scene 模式下切割點會移到理想等分點附近的場景切換處；偵測失敗時退回等長切割
+        """
         max_duration = self.model_spec['max_duration_low']
+        if input_path is not None and strategy is not None:
+            output_bytes = self.estimate_output_bytes(self.analyze_video(input_path), strategy)
+            if output_bytes > 0:
+                max_bytes = self.SIZE_LIMITS['gcs_upload'] * SEGMENT_SIZE_MARGIN
+                max_duration = min(max_duration, duration * max_bytes / output_bytes)
         segment_count = int(duration / max_duration) + 1
         segment_duration = duration / segment_count
         
-        output_files = []
-        input_file = Path(input_path)
+        mode = (strategy or {}).get('segmentation', SEGMENTATION_MODE)
+        if segment_count > 1 and input_path is not None and mode == 'scene':
+            try:
+                cuts = self._scene_cut_points(duration, segment_count, self.get_scene_changes(input_path),
+                                              max_duration)
+                boundaries = [0.0] + cuts + [duration]
+                return [(boundaries[i], boundaries[i + 1] - boundaries[i]) for i in range(segment_count)]
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                logger.warning(f"場景偵測失敗，改用等長分段: {e}")
         
-        for i in range(segment_count):
-            start_time = i * segment_duration
-            output_file = Path(output_dir) / f"{input_file.stem}_part{i+1:02d}{input_file.suffix}"
+        return [(i * segment_duration, segment_duration) for i in range(segment_count)]
+    
+    def _scene_cut_points(self, duration: float, segment_count: int, scenes: List[float],
+                          max_duration: Optional[float] = None) -> List[float]:
+        """在理想等分點附近選擇場景切換點作為切割點
+        
+        每個切割點只在理想位置前後 SCENE_SEARCH_WINDOW 範圍內尋找，且須讓
+        前一段不超過 max_duration (預設 max_duration_low)、剩餘長度仍能以剩下的分段容納；
+        範圍內沒有場景切換時使用理想位置
+        """
+        if max_duration is None:
+            max_duration = self.model_spec['max_duration_low']
+        ideal_length = duration / segment_count
+        window = ideal_length * SCENE_SEARCH_WINDOW
+        cuts: List[float] = []
+        previous = 0.0
+        for k in range(1, segment_count):
+            ideal = k * ideal_length
+            earliest = max(previous, duration - max_duration * (segment_count - k))
+            latest = previous + max_duration
+            low = max(earliest, ideal - window)
+            high = min(latest, ideal + window)
             
-            cmd = ['ffmpeg', '-i', input_path, '-y']
-            cmd.extend(['-ss', str(start_time)])
-            cmd.extend(['-t', str(segment_duration)])
+            position = bisect.bisect_left(scenes, low)
+            candidates = []
+            while position < len(scenes) and scenes[position] <= high:
+                candidates.append(scenes[position])
+                position += 1
             
-            # 應用優化設定
-            resolution_config = self.RESOLUTION_CONFIGS[strategy['target_resolution']]
-            cmd.extend(['-vf', f"scale={resolution_config['scale']}"])
-            cmd.extend(['-r', str(strategy['target_fps'])])
-            cmd.extend(['-c:v', 'libx264', '-c:a', 'aac'])
+            if candidates:
+                cut = min(candidates, key=lambda t: abs(t - ideal))
+            else:
+                cut = min(max(ideal, earliest), latest)
+            cuts.append(cut)
+            previous = cut
+        return cuts
+    
+    def get_scene_changes(self, video_path: str, threshold: float = SCENE_THRESHOLD) -> List[float]:
+        """偵測場景切換時間 (秒)
+        
+        只解碼關鍵影格並縮小畫面後計算 ffmpeg scene 分數，比完整解碼快得多，
+        且結果恰好落在關鍵影格上，串流複製切割時不需再對齊；結果與影片資訊共用快取
+        """
+        cache_key = f'scenes|{threshold}|' + self.probe_cache.make_key(video_path)
+        cached = self.probe_cache.get(cache_key)
+        if cached is not None:
+            return cached['scenes']
+        
+        fd, metadata_path = tempfile.mkstemp(prefix='gemini_scenes_', suffix='.txt')
+        os.close(fd)
+        try:
+            cmd = [
+                'ffmpeg', '-skip_frame', 'nokey', '-i', video_path, '-an', '-sn', '-dn',
+                '-vf', f"scale=160:-2,select='gt(scene,{threshold})',metadata=print:file={metadata_path}",
+                '-f', 'null', '-'
+            ]
+            logger.info(f"偵測場景切換: {video_path}")
+            self._run_ffmpeg(cmd, self._progress_tracker(self.analyze_video(video_path)['duration'], '場景偵測'))
             
-            cmd.append(str(output_file))
+            scenes = []
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('frame:'):
+                        _, _, pts_time = line.rpartition('pts_time:')
+                        scenes.append(float(pts_time))
+        finally:
+            os.remove(metadata_path)
+        
+        scenes.sort()
+        self.probe_cache.set(cache_key, {'scenes': scenes})
+        return scenes
+    
+    def extract_audio(self, video_path: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+        """只擷取音軌並縮混為精簡的單聲道 AAC
+        
+        用於內容以語音為主的問題 (逐字稿、會議摘要)：上傳量與 Gemini 端
+        處理時間都遠小於完整影片；未指定輸出目錄時使用優化輸出快取
+        
+        Args:
+            video_path: 影片路徑
+            output_dir: 輸出目錄 (可選)
+            
+        Returns:
+            包含 file, duration, cached 的字典；cached 為 True 時呼叫端不應刪除檔案
+            
+        Raises:
+            ValueError: 影片沒有音訊串流
+        """
+        video_info = self.analyze_video(video_path)
+        if not video_info['has_audio']:
+            raise ValueError("影片沒有音訊串流")
+        
+        cache_key = None
+        if output_dir is None and self.output_cache.enabled:
+            settings = {
+                'version': OUTPUT_FORMAT_VERSION,
+                'mode': 'audio',
+                'sample_rate': AUDIO_SAMPLE_RATE,
+                'bitrate': AUDIO_ONLY_BITRATE
+            }
+            cache_key = self.output_cache.make_key(self.source_digest(video_path), settings)
+            cached = self.output_cache.lookup(cache_key)
+            if cached is not None:
+                return cached[0]
+            output_dir = self.output_cache.begin(cache_key)
+            if output_dir is None:
+                cache_key = None
+        
+        temp_dir = None
+        if output_dir is None:
+            output_dir = temp_dir = make_temp_dir()
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        output_file = os.path.join(output_dir, f"{Path(video_path).stem}_audio.aac")
+        cmd = [
+            'ffmpeg', '-y', '-i', video_path, '-map', '0:a:0', '-vn', '-sn', '-dn',
+            '-ac', '1', '-ar', str(AUDIO_SAMPLE_RATE),
+            '-c:a', 'aac', '-b:a', AUDIO_ONLY_BITRATE,
+            '-f', 'adts', output_file
+        ]
+        logger.info(f"擷取音軌: {video_path}")
+        audio = {'file': output_file, 'start': 0.0, 'duration': video_info['duration'], 'cached': False}
+        try:
+            self._run_ffmpeg(cmd, self._progress_tracker(video_info['duration'], '擷取音訊'))
+        except BaseException:
+            if cache_key is not None:
+                self.output_cache.abort(cache_key)
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        
+        if cache_key is not None:
+            self.output_cache.commit(cache_key, [audio])
+            audio['cached'] = True
+        return audio
+    
+    def clip_video(self, video_path: str, ranges: List[Tuple[float, float]],
+                   output_dir: Optional[str] = None) -> Dict[str, Any]:
+        """只保留指定的時間範圍，合併為一個影片檔
+        
+        H.264 (yuv420p) 來源在範圍內完整的 GOP 以串流複製輸出，只有範圍開頭到
+        第一個關鍵影格、最後一個關鍵影格到範圍結尾這兩小段精確重新編碼；
+        其他來源整段重新編碼。各段輸出為 MPEG-TS 後以 concat 合併為 MP4，
+        處理時間與輸出大小只隨範圍長度成長
+        
+        Args:
+            video_path: 影片路徑
+            ranges: (起始秒數, 結束秒數) 列表
+            output_dir: 輸出目錄 (可選，未指定時使用優化輸出快取)
+            
+        Returns:
+            包含 file, duration, timeline, cached 的字典；timeline 為剪輯後時間與
+            原片時間的對應。範圍涵蓋整部影片時 file 即為原檔
+            
+        Raises:
+            ValueError: 範圍不在影片長度內
+        """
+        video_info = self.analyze_video(video_path)
+        duration = video_info['duration']
+        
+        # 限制在影片長度內，排序並合併重疊的範圍
+        spans: List[Tuple[float, float]] = []
+        for start, end in sorted((max(0.0, float(s)), min(duration, float(e))) for s, e in ranges):
+            if end <= start:
+                continue
+            if spans and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+            else:
+                spans.append((start, end))
+        if not spans:
+            raise ValueError("指定的時間範圍不在影片長度內")
+        
+        timeline = static_removal.build_timeline(spans)
+        clip_duration = static_removal.kept_duration(spans)
+        if spans == [(0.0, duration)]:
+            return {'file': video_path, 'start': 0.0, 'duration': duration,
+                    'timeline': timeline, 'cached': False}
+        
+        cache_key = None
+        if output_dir is None and self.output_cache.enabled:
+            settings = {'version': OUTPUT_FORMAT_VERSION, 'mode': 'clip', 'ranges': spans}
+            cache_key = self.output_cache.make_key(self.source_digest(video_path), settings)
+            cached = self.output_cache.lookup(cache_key)
+            if cached is not None:
+                return {**cached[0], 'timeline': timeline}
+            output_dir = self.output_cache.begin(cache_key)
+            if output_dir is None:
+                cache_key = None
+        
+        temp_dir = None
+        if output_dir is None:
+            output_dir = temp_dir = make_temp_dir()
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        copy_allowed = video_info['codec'] == 'h264' and video_info.get('pix_fmt') == 'yuv420p'
+        keyframes = self.get_keyframes(video_path) if copy_allowed else []
+        pieces = [piece for start, end in spans
+                  for piece in self._clip_pieces(start, end, keyframes, copy_allowed)]
+        
+        output_file = os.path.join(output_dir, f"{Path(video_path).stem}_clip.mp4")
+        pieces_dir = tempfile.mkdtemp(prefix='clip_', dir=output_dir)
+        tracker = self._progress_tracker(clip_duration, '剪輯時間範圍')
+        
+        def cut(i: int) -> str:
+            mode, start, end = pieces[i]
+            piece_path = os.path.join(pieces_dir, f"piece_{i:03d}.ts")
+            cmd = ['ffmpeg', '-y', '-ss', f"{start:.3f}", '-i', video_path, '-t', f"{end - start:.3f}",
+                   '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn']
+            if mode == 'copy':
+                cmd.extend(['-c:v', 'copy'])
+            else:
+                cmd.extend(['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p'])
+            # 音訊一律轉為相同參數的 AAC，各段才能直接串接
+            cmd.extend(['-c:a', 'aac', '-b:a', '128k', '-f', 'mpegts', piece_path])
+            self._run_ffmpeg(cmd, tracker, i, end - start)
+            return piece_path
+        
+        logger.info(f"剪輯時間範圍: {video_path} {spans} "
+                    f"(串流複製 {sum(1 for p in pieces if p[0] == 'copy')} 段，"
+                    f"重新編碼 {sum(1 for p in pieces if p[0] == 'encode')} 段)")
+        try:
+            workers = max(1, min(len(pieces), SEGMENT_WORKERS or governor.slots))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='clip') as executor:
+                piece_paths = list(executor.map(cut, range(len(pieces))))
+            
+            list_path = os.path.join(pieces_dir, 'pieces.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for path in piece_paths:
+                    f.write(f"file '{path}'\n")
+            self._run_ffmpeg([
+                'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart', output_file
+            ])
+        except BaseException:
+            if cache_key is not None:
+                self.output_cache.abort(cache_key)
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        finally:
+            shutil.rmtree(pieces_dir, ignore_errors=True)
+        
+        clip = {'file': output_file, 'start': 0.0, 'duration': clip_duration, 'cached': False}
+        if cache_key is not None:
+            self.output_cache.commit(cache_key, [clip])
+            clip['cached'] = True
+        return {**clip, 'timeline': timeline}
+    
+    @staticmethod
+    def _clip_pieces(start: float, end: float, keyframes: List[float],
+                     copy_allowed: bool) -> List[Tuple[str, float, float]]:
+        """將一個時間範圍拆成重新編碼的邊緣與串流複製的中段
+        
+        Returns:
+            ('encode' 或 'copy', 起始秒數, 結束秒數) 列表
+        """
+        if copy_allowed:
+            first = bisect.bisect_left(keyframes, start)
+            last = bisect.bisect_right(keyframes, end) - 1
+            if first < last:
+                head, tail = keyframes[first], keyframes[last]
+                pieces = []
+                if head - start > CLIP_EDGE_EPSILON:
+                    pieces.append(('encode', start, head))
+                pieces.append(('copy', head, tail))
+                if end - tail > CLIP_EDGE_EPSILON:
+                    pieces.append(('encode', tail, end))
+                return pieces
+        return [('encode', start, end)]
+    
+    def extract_contact_sheets(self, video_path: str,
+                               frame_count: int = contact_sheet.FRAME_COUNT) -> Dict[str, Any]:
+        """擷取代表性關鍵影格並拼成縮圖拼貼
+        
+        時間點優先取場景切換處 (偵測只解碼關鍵影格)，每個影格以輸入端
+        -ss 快速定位後只解碼一張，並行擷取；不產生完整影片輸出
+        
+        Args:
+            video_path: 影片路徑
+            frame_count: 影格數
+            
+        Returns:
+            包含 sheets (PIL 圖片)、times 與 method 的字典
+        """
+        video_info = self.analyze_video(video_path)
+        duration = video_info['duration']
+        
+        method = 'scene'
+        try:
+            scenes = self.get_scene_changes(video_path)
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"場景偵測失敗，改為均勻取樣: {e.stderr}")
+            scenes = []
+        if not scenes:
+            method = 'uniform'
+        times = contact_sheet.select_times(duration, frame_count, scenes)
+        
+        output_dir = make_temp_dir()
+        tracker = self._progress_tracker(len(times), '擷取關鍵影格')
+        
+        def extract(i: int) -> str:
+            output_path = os.path.join(output_dir, f"frame_{i:03d}.jpg")
+            cmd = [
+                'ffmpeg', '-y', '-ss', f"{times[i]:.3f}", '-i', video_path,
+                '-frames:v', '1', '-an', '-sn',
+                '-vf', f"scale={contact_sheet.TILE_WIDTH}:-2", '-q:v', '3',
+                output_path
+            ]
+            self._run_ffmpeg(cmd, None)
+            if tracker is not None:
+                tracker.complete(i, 1)
+            return output_path
+        
+        try:
+            workers = max(1, min(len(times), SEGMENT_WORKERS or governor.slots))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keyframe-extract') as executor:
+                paths = list(executor.map(extract, range(len(times))))
+            
+            # 定位點超出串流結尾時 ffmpeg 可能未輸出影格
+            frames = [(t, path) for t, path in zip(times, paths) if os.path.exists(path)]
+            if not frames:
+                raise RuntimeError("無法從影片擷取任何影格")
+            sheets = contact_sheet.build_sheets(frames)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        
+        return {
+            'sheets': sheets,
+            'times': [t for t, _ in frames],
+            'method': method
+        }
+    
+    def source_digest(self, video_path: str) -> str:
+        """來源影片內容的 SHA-256 (依檔案身分快取，避免重複讀取整個檔案)"""
+        cache_key = 'sha256|' + self.probe_cache.make_key(video_path)
+        cached = self.probe_cache.get(cache_key)
+        if cached is not None:
+            return cached['sha256']
+        
+        digest = hashlib.sha256()
+        with open(video_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self.probe_cache.set(cache_key, {'sha256': digest.hexdigest()})
+        return digest.hexdigest()
+    
+    def output_cache_key(self, video_path: str, strategy: Dict[str, Any]) -> str:
+        """依來源內容、優化策略與 ffmpeg 設定建立輸出快取鍵"""
+        settings = {
+            'version': OUTPUT_FORMAT_VERSION,
+            'encode_mode': strategy.get('encode_mode', 'transcode'),
+            'target_resolution': strategy['target_resolution'],
+            'scale': self.RESOLUTION_CONFIGS[strategy['target_resolution']]['scale'],
+            'target_fps': strategy['target_fps'],
+            'compress_required': strategy['compress_required'],
+            'segment_required': strategy['segment_required'],
+            'max_segment_duration': self.model_spec['max_duration_low'] if strategy['segment_required'] else None,
+            'segmentation': (
+                (strategy.get('segmentation', SEGMENTATION_MODE), SCENE_THRESHOLD)
+                if strategy['segment_required'] else None
+            ),
+            'keep_spans': strategy.get('keep_spans')
+        }
+        return self.output_cache.make_key(self.source_digest(video_path), settings)
+    
+    def iter_optimized_segments(self, input_path: str,
+                                strategy: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """依序產出優化後的分段，優先使用優化輸出快取
+        
+        快取未命中時於快取項目目錄中編碼 (產出的分段標記 cached=True，
+        呼叫端不應刪除)，全部完成後才寫入 manifest；中途失敗或停止時捨棄該項目。
+        快取命中或完成時分段帶有 cache_key，呼叫端用完後以 output_cache.release 歸還
+        """
+        if not self.output_cache.enabled:
+            yield from self.iter_segments(input_path, strategy)
+            return
+        
+        cache_key = self.output_cache_key(input_path, strategy)
+        cached = self.output_cache.lookup(cache_key)
+        if cached is not None:
+            yield from cached
+            return
+        
+        output_dir = self.output_cache.begin(cache_key)
+        if output_dir is None:
+            yield from self.iter_segments(input_path, strategy)
+            return
+        
+        segments = []
+        committed = False
+        try:
+            for segment in self.iter_segments(input_path, strategy, output_dir):
+                segment['cached'] = True
+                segments.append(segment)
+                yield segment
+            self.output_cache.commit(cache_key, segments)
+            committed = True
+        finally:
+            if not committed:
+                self.output_cache.abort(cache_key)
+    
+    def _segment_video(self, input_path: str, output_dir: str, strategy: Dict[str, Any]) -> list:
+        """分段處理影片"""
+        return [segment['file'] for segment in self.iter_segments(input_path, strategy, output_dir)]
+    
+    def iter_segments(self, input_path: str, strategy: Dict[str, Any],
+                      output_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """並行編碼影片分段，並依原始順序在每段完成時產出該段資訊
+        
+        供呼叫端在後續分段仍在編碼時，先行上傳/分析已完成的分段。
+        同時進行的 ffmpeg 行程數為 GEMINI_SEGMENT_WORKERS (預設為全域 ffmpeg 名額數)，
+        預先提交的分段不超過該數量
+        
+        Args:
+            input_path: 輸入影片路徑
+            strategy: 優化策略
+            output_dir: 輸出目錄 (可選)
             
+        Yields:
+            包含 file, start, duration, index, count 的分段資訊
+        """
+        video_info = self.analyze_video(input_path)
+        
+        if output_dir is None:
+            output_dir = make_temp_dir()
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        # 計算分段時間
+        segments = self._plan_segments(video_info['duration'], input_path, strategy)
+        segment_count = len(segments)
+        input_file = Path(input_path)
+        
+        if strategy.get('encode_mode') == 'copy':
+            # 串流複製：以關鍵影格邊界切割，單一 ffmpeg 以磁碟速度輸出全部分段
+            cut_points = self._plan_copy_cuts(input_path, video_info, segments)
+            if cut_points is not None:
+                yield from self._copy_segments(input_path, output_dir, cut_points)
+                return
+            logger.warning("關鍵影格間隔超過分段上限，無法串流複製，改為重新編碼")
+        
+        # 多個 ffmpeg 行程並行編碼，同時執行數與每個行程的執行緒數由全域名額決定
+        workers = max(1, min(segment_count, SEGMENT_WORKERS or governor.slots))
+        threads = governor.threads
+        tracker = self._progress_tracker(video_info['duration'], '分段轉碼')
+        
+        def encode(i: int) -> Dict[str, Any]:
+            start_time, segment_duration = segments[i]
+            output_file = Path(output_dir) / f"{input_file.stem}_part{i+1:02d}{input_file.suffix}"
             logger.info(f"處理分段 {i+1}/{segment_count}: {output_file.name}")
-            subprocess.run(cmd, check=True, capture_output=True)
+            self._encode_segment(input_path, str(output_file), start_time, segment_duration,
+                                 strategy, threads, tracker, i)
+            return {
+                'file': str(output_file),
+                'start': start_time,
+                'duration': segment_duration,
+                'index': i,
+                'count': segment_count
+            }
+        
+        # 最多預先提交 workers 個分段，並依原始順序產出結果
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment-encode')
+        pending = deque()
+        next_index = 0
+        started = time.monotonic()
+        try:
+            while next_index < segment_count or pending:
+                while next_index < segment_count and len(pending) < workers:
+                    pending.append(executor.submit(encode, next_index))
+                    next_index += 1
+                yield pending.popleft().result()
             
-            output_files.append(str(output_file))
+            # 記錄整體轉碼速度 (包含並行效果)
+            cost_model.record('transcode_speed',
+                              video_info['duration'] / (time.monotonic() - started),
+                              key=strategy['target_resolution'])
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+    
+    def _progress_tracker(self, total_seconds: float, label: str) -> Optional[ProgressTracker]:
+        """有設定進度回呼時建立進度追蹤"""
+        if self.progress_callback is None:
+            return None
+        return ProgressTracker(total_seconds, self.progress_callback, label)
+    
+    def _run_ffmpeg(self, cmd: List[str], tracker: Optional[ProgressTracker] = None,
+                    key: int = 0, seconds: Optional[float] = None):
+        """執行 ffmpeg，回報進度並可被 cancel_token 終止
+        
+        Args:
+            cmd: ffmpeg 命令
+            tracker: 進度追蹤 (可選)
+            key: 此行程在進度追蹤中的識別
+            seconds: 此行程處理的媒體秒數 (預設為追蹤的總秒數)
+        """
+        on_progress = (lambda done: tracker.update(key, done)) if tracker is not None else None
+        run_ffmpeg(cmd, on_progress, self.cancel_token, self.priority)
+        if tracker is not None:
+            tracker.complete(key, tracker.total_seconds if seconds is None else seconds)
+    
+    def get_keyframes(self, video_path: str) -> List[float]:
+        """取得影片串流的關鍵影格時間 (相對於檔案開頭的秒數)
+        
+        讀取封包旗標而不解碼影格；結果與影片資訊共用快取
+        """
+        cache_key = 'keyframes|' + self.probe_cache.make_key(video_path)
+        cached = self.probe_cache.get(cache_key)
+        if cached is not None:
+            return cached['keyframes']
+        
+        cmd = [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path
+        ]
+        output = run_capture(cmd, self.cancel_token, self.priority)
+        
+        # 封包時間含串流的起始時間；ffmpeg 的 -ss 與 -segment_times 則以檔案開頭為 0
+        start_time = self.analyze_video(video_path).get('start_time', 0.0)
+        keyframes = []
+        for line in output.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.append(max(0.0, float(pts_time) - start_time))
+        keyframes.sort()
         
-        return output_files
+        self.probe_cache.set(cache_key, {'keyframes': keyframes})
+        return keyframes
     
-    def get_processing_summary(self, video_path: str) -> str:
-        """獲取處理建議摘要"""
+    @staticmethod
+    def _copy_audio_args(video_info: Dict[str, Any]) -> List[str]:
+        """串流複製時的音訊參數：MP4 可容納的音訊直接複製，其餘轉為 AAC"""
+        if video_info.get('audio_codec') in (None, 'aac', 'mp3'):
+            return ['-c:a', 'copy']
+        return ['-c:a', 'aac', '-b:a', '128k']
+    
+    @staticmethod
+    def _copy_cut_points(ideal_points: List[float], keyframes: List[float],
+                         duration: float, max_span: float) -> Optional[List[float]]:
+        """選擇串流複製的切割點 (只能在關鍵影格切割)
+        
+        優先使用不晚於理想切割點的最近關鍵影格，但每段長度不超過 max_span：
+        對齊後超過時改用之後的關鍵影格，或在上限內增加切割點。
+        
+        Returns:
+            切割點列表；關鍵影格間隔大於 max_span 而無法滿足上限時回傳 None
+        """
+        keyframes = [keyframe for keyframe in keyframes if 0.0 < keyframe < duration]
+        pending = sorted(ideal_points)
+        cuts = []
+        boundary = 0.0
+        while True:
+            pending = [point for point in pending if point > boundary]
+            if not pending and duration - boundary <= max_span:
+                return cuts
+            if pending and pending[0] <= boundary + max_span:
+                target = pending.pop(0)
+            else:
+                target = boundary + max_span
+            
+            first = bisect.bisect_right(keyframes, boundary)
+            last = bisect.bisect_right(keyframes, target)
+            if last > first:
+                cut = keyframes[last - 1]
+            elif first < len(keyframes) and keyframes[first] - boundary <= max_span:
+                cut = keyframes[first]
+            else:
+                return None
+            cuts.append(cut)
+            boundary = cut
+    
+    def _plan_copy_cuts(self, input_path: str, video_info: Dict[str, Any],
+                        segments: List[Tuple[float, float]]) -> Optional[List[float]]:
+        """依關鍵影格規劃串流複製的切割點，每段仍需符合時長與上傳大小上限
+        
+        Returns:
+            切割點列表；無法以串流複製滿足上限時回傳 None
+        """
+        duration = video_info['duration']
+        max_span = self.model_spec['max_duration_low']
+        if video_info['file_size'] > 0:
+            max_span = min(max_span, self.SIZE_LIMITS['gcs_upload'] * duration / video_info['file_size'])
+        return self._copy_cut_points(
+            [start for start, _ in segments[1:]], self.get_keyframes(input_path), duration, max_span
+        )
+    
+    @staticmethod
+    def _format_cut_time(point: float) -> str:
+        """切割時間無條件捨去到毫秒
+        
+        segment muxer 在切割時間之後的第一個關鍵影格切割，四捨五入可能讓時間
+        略晚於對齊的關鍵影格，使切割點延後一個 GOP
+        """
+        return f"{math.floor(point * 1000) / 1000:.3f}"
+    
+    def _copy_segments(self, input_path: str, output_dir: str,
+                       cut_points: List[float]) -> Iterator[Dict[str, Any]]:
+        """以 segment muxer 串流複製分段 (切割點需為關鍵影格，見 _plan_copy_cuts)"""
+        input_file = Path(input_path)
+        duration = self.analyze_video(input_path)['duration']
+        pattern = str(Path(output_dir) / f"{input_file.stem}_part%02d.mp4")
+        
+        cmd = ['ffmpeg', '-i', input_path, '-y', '-map', '0:v:0', '-map', '0:a?', '-c:v', 'copy']
+        cmd.extend(self._copy_audio_args(self.analyze_video(input_path)))
+        cmd.extend(['-f', 'segment', '-segment_start_number', '1', '-reset_timestamps', '1'])
+        if cut_points:
+            cmd.extend(['-segment_times', ','.join(self._format_cut_time(point) for point in cut_points)])
+        cmd.append(pattern)
+        
+        logger.info(f"串流複製分段: {' '.join(cmd)}")
+        started = time.monotonic()
+        self._run_ffmpeg(cmd, self._progress_tracker(duration, '串流複製分段'))
+        cost_model.record('copy_bytes_per_sec',
+                          os.path.getsize(input_path) / (time.monotonic() - started))
+        
+        boundaries = [0.0] + cut_points + [duration]
+        count = len(boundaries) - 1
+        for i in range(count):
+            yield {
+                'file': pattern % (i + 1),
+                'start': boundaries[i],
+                'duration': boundaries[i + 1] - boundaries[i],
+                'index': i,
+                'count': count
+            }
+    
+    def _encode_segment(self, input_path: str, output_path: str, start_time: float,
+                        segment_duration: float, strategy: Dict[str, Any],
+                        threads: Optional[int] = None,
+                        tracker: Optional[ProgressTracker] = None, key: int = 0):
+        """編碼單一分段
+        
+        -ss 置於 -i 之前以輸入端搜尋 (跳至關鍵影格後再解碼)，
+        避免每段都從檔頭解碼到起始點
+        """
+        cmd = ['ffmpeg', '-ss', str(start_time), '-i', input_path, '-y']
+        cmd.extend(['-t', str(segment_duration)])
+        
+        # 應用優化設定
+        resolution_config = self.RESOLUTION_CONFIGS[strategy['target_resolution']]
+        cmd.extend(['-vf', f"scale={resolution_config['scale']}"])
+        cmd.extend(['-r', str(strategy['target_fps'])])
+        cmd.extend(['-c:v', 'libx264', '-c:a', 'aac'])
+        if threads:
+            cmd.extend(['-threads', str(threads)])
+        
+        cmd.append(output_path)
+        
+        self._run_ffmpeg(cmd, tracker, key, segment_duration)
+    
+    def get_processing_summary(self, video_path: str, remove_static: bool = False) -> str:
+        """獲取處理建議摘要
+        
+        Args:
+            video_path: 影片路徑
+            remove_static: 是否評估靜態片段移除
+        """
         try:
             video_info = self.analyze_video(video_path)
             strategy = self.get_optimization_strategy(video_info)
+            if remove_static:
+                self.apply_static_removal(video_info, strategy)
             
             summary = [
                 f"影片分析 - {self.model_name}",
@@ -351,8 +1810,29 @@ class VideoOptimizer:
                 f"- 目標幀率: {strategy['target_fps']} fps", 
                 f"- 預估 Token: {strategy['estimated_tokens']:,}",
                 f"- 上傳方式: {strategy['upload_method']}",
+                f"- 處理方式: {'串流複製 (不重新編碼)' if strategy['encode_mode'] == 'copy' else '重新編碼'}",
+                *([f"- 分段方式: {'依場景切換點' if strategy['segmentation'] == 'scene' else '等長切割'}"]
+                  if strategy['segment_required'] else []),
             ]
             
+            plan = strategy.get('plan')
+            if plan:
+                summary.append("")
+                calibration = "本機量測" if plan['calibrated'] else "預設值 (尚未量測)"
+                summary.append(f"處理方案評估 (吞吐量來源: {calibration}):")
+                for candidate in plan['candidates']:
+                    name = self.PLAN_DESCRIPTIONS[candidate['plan']]
+                    if not candidate['feasible']:
+                        summary.append(f"  ✗ {name}: 不可行 ({candidate['reason']})")
+                        continue
+                    marker = "→" if candidate['plan'] == plan['choice'] else " "
+                    summary.append(
+                        f"  {marker} {name}: 預估 {candidate['estimated_seconds']:.0f} 秒 "
+                        f"(本機處理 {candidate['prepare_seconds']:.0f} 秒, "
+                        f"上傳 {candidate['upload_bytes'] / (1024*1024):.1f} MB, "
+                        f"約 {candidate['estimated_tokens']:,} tokens)"
+                    )
+            
             if strategy['recommendations']:
                 summary.append("")
                 summary.append("額外建議:")
@@ -367,29 +1847,68 @@ class VideoOptimizer:
 def main():
     """命令列工具主函數"""
     import argparse
+    import glob
     
     parser = argparse.ArgumentParser(description='Gemini 影片優化工具')
-    parser.add_argument('video_path', help='影片檔案路徑')
+    parser.add_argument('video_paths', nargs='*', metavar='video_path',
+                       help='影片檔案路徑；多個路徑、目錄或萬用字元 (如 "videos/**/*.mp4") 以批次模式處理')
     parser.add_argument('--model', default='gemini-1.5-flash', 
                        choices=list(VideoOptimizer.MODEL_SPECS.keys()),
                        help='目標 Gemini 模型')
     parser.add_argument('--output-dir', help='輸出目錄')
     parser.add_argument('--analyze-only', action='store_true', help='僅分析，不處理')
+    parser.add_argument('--calibrate', action='store_true', help='量測本機各解析度的轉碼速度')
+    parser.add_argument('--jobs', type=int, default=0,
+                       help='批次模式同時處理的檔案數 (預設為 ffmpeg 名額數)')
+    parser.add_argument('--manifest', help='批次模式的清單檔路徑 (記錄已完成的檔案，中斷後可續跑)')
     
     args = parser.parse_args()
+    if not args.video_paths and not args.calibrate:
+        parser.error('需要影片檔案路徑')
+    batch = len(args.video_paths) > 1 or any(
+        os.path.isdir(path) or glob.has_magic(path) for path in args.video_paths
+    )
+    if batch and args.analyze_only:
+        parser.error('--analyze-only 僅支援單一影片檔案')
     
     # 設定日誌
     logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
     
+    if args.calibrate:
+        scales = {name: config['scale'] for name, config in VideoOptimizer.RESOLUTION_CONFIGS.items()}
+        for name, speed in cost_model.calibrate_transcode(scales).items():
+            print(f"轉碼速度 ({name}): {speed:.1f}x 即時")
+        if not args.video_paths:
+            return
+    
+    if batch:
+        from video_batch import BatchOptimizer, collect_inputs, format_summary
+        
+        paths = collect_inputs(args.video_paths)
+        if not paths:
+            print("❌ 找不到影片檔案")
+            return
+        # 批次行程內沒有互動式請求，不需保留名額
+        governor.interactive_reserve = 0
+        runner = BatchOptimizer(args.model, args.output_dir, args.manifest, args.jobs)
+        print(f"批次處理 {len(paths)} 個影片 (同時 {runner.jobs} 個，清單: {runner.manifest.path})")
+        try:
+            stats = runner.run(paths)
+        except KeyboardInterrupt:
+            return
+        print(format_summary(stats))
+        return
+    
+    video_path = args.video_paths[0]
     optimizer = VideoOptimizer(args.model)
     
     if args.analyze_only:
         # 僅顯示分析結果
-        summary = optimizer.get_processing_summary(args.video_path)
+        summary = optimizer.get_processing_summary(video_path)
         print(summary)
     else:
         # 執行優化
-        result = optimizer.optimize_video(args.video_path, args.output_dir)
+        result = optimizer.optimize_video(video_path, args.output_dir)
         
         if result['success']:
             print(f"✅ {result['message']}")
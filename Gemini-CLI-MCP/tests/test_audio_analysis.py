@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+純音訊分析單元測試
+
+測試音軌擷取的 ffmpeg 命令、無音軌時的錯誤，以及純音訊模式的上傳、
+提示詞與暫存輸出目錄的清理
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_mcp_server as server
+import video_optimizer
+from video_optimizer import VideoOptimizer, remove_temp_output
+
+
+@pytest.fixture
+def extractor(monkeypatch, tmp_path):
+    """以假的 ffprobe 與 ffmpeg 擷取音軌；暫存目錄建立在 tmp_path 下"""
+    state = SimpleNamespace(commands=[], has_audio=True, fail=False, released=[])
+
+    def run_ffmpeg(self, cmd, *args):
+        state.commands.append(cmd)
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'a' * 1024)
+        if state.fail:
+            raise RuntimeError("ffmpeg failed")
+
+    monkeypatch.setattr(VideoOptimizer, 'analyze_video',
+                        lambda self, path: {'duration': 90.0, 'has_audio': state.has_audio})
+    monkeypatch.setattr(VideoOptimizer, '_run_ffmpeg', run_ffmpeg)
+    monkeypatch.setattr(VideoOptimizer, 'output_cache',
+                        SimpleNamespace(enabled=False, release=state.released.extend))
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return state
+
+
+def test_extract_audio_command(extractor, tmp_path):
+    optimizer = VideoOptimizer('gemini-1.5-flash')
+    audio = optimizer.extract_audio('/videos/talk.mp4', str(tmp_path / "out"))
+
+    assert audio == {'file': str(tmp_path / "out" / "talk_audio.aac"), 'start': 0.0,
+                     'duration': 90.0, 'cached': False}
+    cmd, = extractor.commands
+    assert cmd[cmd.index('-i') + 1] == '/videos/talk.mp4'
+    assert cmd[cmd.index('-map') + 1] == '0:a:0'
+    assert {'-vn', '-sn', '-dn'} <= set(cmd)
+    assert cmd[cmd.index('-ac') + 1] == '1'
+    assert cmd[cmd.index('-ar') + 1] == str(video_optimizer.AUDIO_SAMPLE_RATE)
+    assert cmd[cmd.index('-b:a') + 1] == video_optimizer.AUDIO_ONLY_BITRATE
+    assert cmd[-3:] == ['-f', 'adts', audio['file']]
+
+
+def test_video_without_audio_is_rejected(extractor):
+    extractor.has_audio = False
+    with pytest.raises(ValueError, match="沒有音訊串流"):
+        VideoOptimizer('gemini-1.5-flash').extract_audio('/videos/talk.mp4')
+    assert extractor.commands == []
+
+
+def test_failed_extraction_removes_the_temp_dir(extractor, tmp_path):
+    extractor.fail = True
+    with pytest.raises(RuntimeError):
+        VideoOptimizer('gemini-1.5-flash').extract_audio('/videos/talk.mp4')
+    assert os.listdir(tmp_path) == []
+
+
+def test_remove_temp_output_keeps_other_directories(tmp_path):
+    shared = tmp_path / f"{video_optimizer.TEMP_DIR_PREFIX}1_a"
+    shared.mkdir()
+    (shared / "segment_0.mp4").write_bytes(b'x')
+    (shared / "segment_1.mp4").write_bytes(b'x')
+    remove_temp_output(str(shared / "segment_0.mp4"))
+    # 仍有其他分段時保留目錄，最後一個刪除後才移除
+    assert os.listdir(shared) == ["segment_1.mp4"]
+    remove_temp_output(str(shared / "segment_1.mp4"))
+    assert not shared.exists()
+
+    (tmp_path / "clip.mp4").write_bytes(b'x')
+    remove_temp_output(str(tmp_path / "clip.mp4"))
+    assert tmp_path.exists()
+
+
+@pytest.fixture
+def analysis(monkeypatch, extractor, tmp_path):
+    """假的上傳與模型，記錄送出的內容"""
+    video = tmp_path / "talk.mp4"
+    video.write_bytes(b'v' * 4096)
+    state = SimpleNamespace(video=str(video), uploads=[], released=[], contents=None)
+
+    async def get_or_upload(path):
+        state.uploads.append(path)
+        assert os.path.exists(path)
+        return SimpleNamespace(name="files/audio")
+
+    async def release(uploaded):
+        state.released.append(uploaded.name)
+
+    async def generate_text(gen_model, contents, stream=False):
+        state.contents = contents
+        return "transcript"
+
+    monkeypatch.setattr(server, 'uploaded_file_cache', SimpleNamespace(get_or_upload=get_or_upload, release=release))
+    monkeypatch.setattr(server, 'generate_text', generate_text)
+    monkeypatch.setattr(server, 'model_pool', SimpleNamespace(get=lambda name: SimpleNamespace(model_name=name)))
+    return state
+
+
+def temp_dirs(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name.startswith(video_optimizer.TEMP_DIR_PREFIX)]
+
+
+def test_audio_mode_uploads_only_the_audio_track(analysis, tmp_path):
+    text, info = asyncio.run(server._audio_video_analysis(analysis.video, "請整理逐字稿", None, False))
+
+    assert text == "transcript"
+    assert [os.path.basename(path) for path in analysis.uploads] == ["talk_audio.aac"]
+    prompt, uploaded = analysis.contents
+    assert "完整音軌" in prompt and prompt.endswith("請整理逐字稿")
+    assert uploaded.name == "files/audio" and analysis.released == ["files/audio"]
+    assert "純音訊模式" in info
+    # 音軌與其暫存目錄都已刪除
+    assert temp_dirs(tmp_path) == []
+
+
+def test_keyframe_failure_removes_the_extracted_audio(analysis, monkeypatch, tmp_path):
+    def extract_contact_sheets(self, video_path, count):
+        raise RuntimeError("no frames")
+
+    monkeypatch.setattr(VideoOptimizer, 'extract_contact_sheets', extract_contact_sheets)
+    with pytest.raises(RuntimeError, match="no frames"):
+        asyncio.run(server._audio_video_analysis(analysis.video, "q", 4, False))
+    assert analysis.uploads == []
+    assert temp_dirs(tmp_path) == []
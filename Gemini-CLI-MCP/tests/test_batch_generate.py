@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+批次生成單元測試
+
+以假的模型測試結果依輸入順序回傳、並行數量上限與個別項目的錯誤
+"""
+
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_mcp_server as server
+from rate_governor import RateGovernor
+
+
+class FakeModel:
+    """依提示詞決定延遲與結果，並記錄同時進行的呼叫數"""
+
+    def __init__(self, state, generation_config, system_instruction):
+        self.model_name = 'models/gemini-test'
+        self.state = state
+        self.generation_config = generation_config
+        self.system_instruction = system_instruction
+
+    async def generate_content_async(self, contents):
+        self.state.running += 1
+        self.state.peak = max(self.state.peak, self.state.running)
+        try:
+            prompt = contents if isinstance(contents, str) else contents[-1]['parts'][0]
+            await asyncio.sleep(0.01 * (len(prompt) % 3))
+            if 'boom' in prompt:
+                raise ValueError("blocked prompt")
+            usage = SimpleNamespace(candidates_token_count=len(prompt), total_token_count=None)
+            return SimpleNamespace(text=f"{prompt}|{self.system_instruction}", usage_metadata=usage)
+        finally:
+            self.state.running -= 1
+
+
+@pytest.fixture
+def state(monkeypatch):
+    state = SimpleNamespace(running=0, peak=0, configs=[])
+
+    def get(model_name, generation_config=None, system_instruction=None):
+        state.configs.append(generation_config)
+        return FakeModel(state, generation_config, system_instruction)
+
+    monkeypatch.setattr(server, 'model', SimpleNamespace(model_name='models/gemini-test'), raising=False)
+    monkeypatch.setattr(server, 'model_pool', SimpleNamespace(get=get))
+    monkeypatch.setattr(server, 'rate_governor', RateGovernor(max_retries=0))
+    return state
+
+
+def run_batch(arguments):
+    result = asyncio.run(server.batch_generate_tool(arguments))
+    return json.loads(result[0].text)
+
+
+def test_results_keep_input_order_with_per_item_errors(state):
+    output = run_batch({
+        "items": ["a", "bb", {"prompt": "boom", "temperature": 0.1}, "ccc"],
+        "system_instruction": "sys",
+        "max_concurrency": 4
+    })
+    results = output["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert [r.get("text") for r in results] == ["a|sys", "bb|sys", None, "ccc|sys"]
+    assert results[2]["error"] == "blocked prompt"
+    # 個別項目的生成配置覆寫預設值
+    assert state.configs[2] == {"max_output_tokens": 2048, "temperature": 0.1}
+
+    summary = output["summary"]
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (4, 3, 1)
+    assert summary["output_tokens"] == 6
+
+
+def test_concurrency_is_bounded(state):
+    output = run_batch({"items": [f"prompt {i}" for i in range(10)], "max_concurrency": 3})
+    assert output["summary"]["succeeded"] == 10
+    assert state.peak == 3
+
+
+def test_messages_items_are_sent_as_contents(state):
+    messages = [{"role": "user", "content": "hi"}, {"role": "model", "content": "hello"},
+                {"role": "user", "content": "again"}]
+    output = run_batch({"items": [{"messages": messages, "system_instruction": "item"}]})
+    assert output["results"][0]["text"] == "again|item"
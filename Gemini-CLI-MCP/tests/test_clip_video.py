@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+時間範圍剪輯單元測試
+
+測試範圍拆成重新編碼邊緣與串流複製中段，以及範圍的正規化與 ffmpeg 命令
+"""
+
+import os
+import sys
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from video_optimizer import VideoOptimizer
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0]
+
+
+def test_edges_are_encoded_and_whole_gops_copied():
+    assert VideoOptimizer._clip_pieces(1.0, 9.0, KEYFRAMES, True) == [
+        ('encode', 1.0, 2.0), ('copy', 2.0, 8.0), ('encode', 8.0, 9.0)
+    ]
+
+
+def test_ranges_on_keyframes_need_no_encoding():
+    # 距離關鍵影格在 CLIP_EDGE_EPSILON 內的邊緣不另外編碼
+    assert VideoOptimizer._clip_pieces(2.0, 8.02, KEYFRAMES, True) == [('copy', 2.0, 8.0)]
+
+
+def test_ranges_without_a_full_gop_are_encoded():
+    assert VideoOptimizer._clip_pieces(2.5, 3.5, KEYFRAMES, True) == [('encode', 2.5, 3.5)]
+    assert VideoOptimizer._clip_pieces(1.0, 3.0, KEYFRAMES, True) == [('encode', 1.0, 3.0)]
+
+
+def test_sources_that_cannot_be_copied_are_encoded():
+    assert VideoOptimizer._clip_pieces(1.0, 9.0, KEYFRAMES, False) == [('encode', 1.0, 9.0)]
+
+
+@pytest.fixture
+def clipper(monkeypatch):
+    optimizer = VideoOptimizer('gemini-1.5-flash')
+    info = {'file_path': '/videos/a.mp4', 'duration': 10.0, 'codec': 'h264', 'pix_fmt': 'yuv420p'}
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+    monkeypatch.setattr(optimizer, 'get_keyframes', lambda path: KEYFRAMES)
+    optimizer.commands = []
+    monkeypatch.setattr(optimizer, '_run_ffmpeg', lambda cmd, *args: optimizer.commands.append(cmd))
+    return optimizer
+
+
+def test_ranges_covering_the_whole_video_return_the_source(clipper):
+    clip = clipper.clip_video('/videos/a.mp4', [(0, 6), (5, 20)])
+    assert clip['file'] == '/videos/a.mp4'
+    assert clip['timeline'] == [{'start': 0.0, 'end': 10.0, 'output_start': 0.0}]
+    assert clipper.commands == []
+
+
+def test_ranges_outside_the_video_are_rejected(clipper):
+    with pytest.raises(ValueError):
+        clipper.clip_video('/videos/a.mp4', [(12, 15), (5, 5)])
+
+
+def test_clip_commands_copy_middle_and_concatenate(clipper, tmp_path):
+    clip = clipper.clip_video('/videos/a.mp4', [(7.0, 9.5), (1.0, 5.0), (4.0, 4.5)], str(tmp_path))
+    assert clip['duration'] == pytest.approx(6.5)
+    assert clip['timeline'] == [
+        {'start': 1.0, 'end': 5.0, 'output_start': 0.0},
+        {'start': 7.0, 'end': 9.5, 'output_start': 4.0}
+    ]
+
+    # 各段並行剪輯，最後才合併
+    *cuts, concat = clipper.commands
+    modes = [cmd[cmd.index('-c:v') + 1] for cmd in cuts]
+    starts = [cmd[cmd.index('-ss') + 1] for cmd in cuts]
+    assert sorted(zip(starts, modes)) == [
+        ('1.000', 'libx264'), ('2.000', 'copy'), ('4.000', 'libx264'), ('7.000', 'libx264')
+    ]
+    assert concat[concat.index('-f') + 1] == 'concat'
+    assert concat[-1] == clip['file']
+    # 暫存的分段目錄已清除
+    assert os.listdir(tmp_path) == []
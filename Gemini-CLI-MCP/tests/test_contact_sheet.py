@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+關鍵影格縮圖拼貼單元測試
+
+測試擷取時間點的選擇 (場景切換優先、均勻補齊) 與拼貼圖的版面
+"""
+
+import os
+import sys
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from contact_sheet import MAX_FRAMES, build_prompt, build_sheets, select_times
+
+
+def test_without_scenes_times_are_spread_evenly():
+    assert select_times(100.5, 4, []) == [0.0, 25.0, 50.0, 75.0]
+
+
+def test_extra_scene_changes_are_thinned_evenly():
+    scenes = [float(t) for t in range(1, 21)]
+    assert select_times(100.0, 4, scenes) == [0.0, 5.0, 10.0, 15.0]
+
+
+def test_missing_frames_fill_the_longest_gaps():
+    # 0 與結尾附近的場景切換不重複計入
+    times = select_times(100.5, 4, [0.0, 10.0, 100.2])
+    assert times == [0.0, 10.0, 55.0, 77.5]
+
+
+def test_short_videos_return_fewer_frames():
+    assert select_times(1.0, 8, []) == [0.0]
+
+
+def test_frame_count_is_clamped():
+    assert len(select_times(1000.0, 1000, [])) == MAX_FRAMES
+    assert select_times(1000.0, 0, []) == [0.0]
+
+
+def test_sheets_are_split_into_grids(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    frames = []
+    for i in range(5):
+        path = str(tmp_path / f"frame_{i}.jpg")
+        Image.new('RGB', (320, 180), (i * 40, 80, 160)).save(path)
+        frames.append((i * 61.0, path))
+
+    sheets = build_sheets(frames, columns=2, tile_width=100)
+    assert [sheet.size for sheet in sheets] == [(200, 112), (100, 56)]
+    # 左上角的時間標籤為黑底
+    assert sheets[0].getpixel((1, 1)) == (0, 0, 0)
+
+
+def test_prompt_mentions_frame_and_sheet_counts():
+    prompt = build_prompt("影片在做什麼？", [0.0, 10.0, 20.0], 1)
+    assert "1 張圖片" in prompt and "3 張關鍵影格" in prompt
+    assert prompt.endswith("影片在做什麼？")
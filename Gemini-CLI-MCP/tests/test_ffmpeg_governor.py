@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+ffmpeg 資源排程單元測試
+
+測試名額上限、優先順序、互動式保留名額、等待時取消與執行緒數分配，
+以及名額滿載時等待中的影片處理不會佔住上傳所用的執行緒
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ffmpeg_runner
+from ffmpeg_runner import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, CancelToken,
+                           FFmpegCancelled, ResourceGovernor, current_priority)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def start_waiter(governor, priority, admitted, name, cancel=None):
+    """在背景執行緒等待名額，取得後記錄名稱 (不歸還)"""
+    def run():
+        try:
+            governor.acquire(priority, cancel)
+            admitted.append(name)
+        except FFmpegCancelled:
+            admitted.append(f"{name} cancelled")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def waiting(governor, kind):
+    return governor.stats()['waiting'][kind]
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(ffmpeg_runner, 'ADMISSION_POLL_INTERVAL', 0.01)
+
+
+def test_running_processes_never_exceed_slots():
+    governor = ResourceGovernor(slots=2, threads=1, interactive_reserve=0)
+    admitted = []
+    governor.acquire()
+    governor.acquire()
+
+    thread = start_waiter(governor, PRIORITY_INTERACTIVE, admitted, 'third')
+    wait_until(lambda: waiting(governor, 'interactive') == 1)
+    assert admitted == [] and governor.stats()['running'] == 2
+
+    governor.release()
+    thread.join(5)
+    assert admitted == ['third'] and governor.stats()['running'] == 2
+
+
+def test_interactive_waiters_go_before_earlier_batch_waiters():
+    governor = ResourceGovernor(slots=1, threads=1, interactive_reserve=0)
+    admitted = []
+    governor.acquire()
+
+    batch = start_waiter(governor, PRIORITY_BATCH, admitted, 'batch')
+    wait_until(lambda: waiting(governor, 'batch') == 1)
+    interactive = start_waiter(governor, PRIORITY_INTERACTIVE, admitted, 'interactive')
+    wait_until(lambda: waiting(governor, 'interactive') == 1)
+
+    governor.release()
+    interactive.join(5)
+    assert admitted == ['interactive']
+
+    governor.release()
+    batch.join(5)
+    assert admitted == ['interactive', 'batch']
+
+
+def test_same_priority_is_first_come_first_served():
+    governor = ResourceGovernor(slots=1, threads=1, interactive_reserve=0)
+    admitted = []
+    governor.acquire(PRIORITY_BATCH)
+
+    threads = []
+    for i in range(3):
+        threads.append(start_waiter(governor, PRIORITY_BATCH, admitted, i))
+        wait_until(lambda: waiting(governor, 'batch') == i + 1)
+
+    for thread in threads:
+        governor.release()
+        thread.join(5)
+    assert admitted == [0, 1, 2]
+
+
+def test_batch_work_leaves_the_interactive_reserve_free():
+    governor = ResourceGovernor(slots=3, threads=1, interactive_reserve=1)
+    admitted = []
+    governor.acquire(PRIORITY_BATCH)
+    governor.acquire(PRIORITY_BATCH)
+
+    batch = start_waiter(governor, PRIORITY_BATCH, admitted, 'batch')
+    wait_until(lambda: waiting(governor, 'batch') == 1)
+    # 批次工作等待保留名額時，互動式工作仍可立即取得
+    governor.acquire(PRIORITY_INTERACTIVE)
+    assert governor.stats()['running'] == 3
+
+    governor.release()
+    governor.release()
+    batch.join(5)
+    assert admitted == ['batch']
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    governor = ResourceGovernor(slots=1, threads=1, interactive_reserve=0)
+    admitted = []
+    governor.acquire()
+
+    cancel = CancelToken()
+    cancelled = start_waiter(governor, PRIORITY_INTERACTIVE, admitted, 'first', cancel)
+    wait_until(lambda: waiting(governor, 'interactive') == 1)
+    other = start_waiter(governor, PRIORITY_INTERACTIVE, admitted, 'second')
+    wait_until(lambda: waiting(governor, 'interactive') == 2)
+
+    cancel.cancel()
+    cancelled.join(5)
+    assert admitted == ['first cancelled']
+    assert waiting(governor, 'interactive') == 1
+
+    governor.release()
+    other.join(5)
+    assert admitted == ['first cancelled', 'second']
+
+
+def test_reserve_never_blocks_all_batch_work():
+    assert ResourceGovernor(slots=1, threads=1, interactive_reserve=3).interactive_reserve == 0
+    assert ResourceGovernor(slots=4, threads=1, interactive_reserve=3).interactive_reserve == 3
+
+
+def test_threads_are_added_to_ffmpeg_output_options():
+    governor = ResourceGovernor(slots=2, threads=3)
+    cmd = ['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx264', 'out.mp4']
+    assert governor.apply_threads(cmd) == ['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx264',
+                                           '-threads', '3', 'out.mp4']
+
+    explicit = ['ffmpeg', '-i', 'in.mp4', '-threads', '1', 'out.mp4']
+    assert governor.apply_threads(explicit) == explicit
+    probe = ['ffprobe', '-v', 'quiet', 'in.mp4']
+    assert governor.apply_threads(probe) == probe
+
+
+def test_saturated_governor_does_not_starve_uploads(monkeypatch, tmp_path):
+    import gemini_files
+    import gemini_mcp_server as server
+
+    governor = ResourceGovernor(slots=1, threads=1, interactive_reserve=0)
+    governor.acquire()
+    monkeypatch.setattr(server, 'VIDEO_WORKERS', 2)
+    monkeypatch.setattr(server, '_video_executors', {})
+    monkeypatch.setattr(gemini_files, '_upload_semaphore', None)
+    monkeypatch.setattr(gemini_files, 'cost_model', SimpleNamespace(record=lambda *args: None))
+    monkeypatch.setattr(gemini_files.genai, 'upload_file', lambda path, **kwargs: SimpleNamespace(uri=f"https://files/{path}"))
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b'v')
+
+    def wait_for_slot(optimizer):
+        return server._run_optimizer(optimizer, governor.acquire, current_priority.get(), optimizer.cancel_token)
+
+    async def scenario():
+        # 預設執行緒池只有 2 個執行緒，少於等待名額的影片處理數
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        optimizers = [SimpleNamespace(cancel_token=CancelToken()) for _ in range(6)]
+        waiting = [asyncio.ensure_future(wait_for_slot(optimizer)) for optimizer in optimizers[:4]]
+        token = current_priority.set(PRIORITY_BATCH)
+        waiting += [asyncio.ensure_future(wait_for_slot(optimizer)) for optimizer in optimizers[4:]]
+        current_priority.reset(token)
+        await asyncio.to_thread(wait_until, lambda: governor.stats()['waiting'] == {'interactive': 2, 'batch': 2})
+
+        try:
+            uploaded = await asyncio.wait_for(gemini_files.upload_file_async(str(video)), 5)
+        finally:
+            for task in waiting:
+                task.cancel()
+            await asyncio.gather(*waiting, return_exceptions=True)
+        return uploaded, optimizers
+
+    try:
+        uploaded, optimizers = asyncio.run(scenario())
+    finally:
+        for executor in server._video_executors.values():
+            executor.shutdown(wait=True)
+    assert uploaded.uri == f"https://files/{video}"
+    assert all(optimizer.cancel_token.cancelled for optimizer in optimizers)
+    # 互動式與背景工作各有自己的執行緒池
+    assert set(server._video_executors) == {PRIORITY_INTERACTIVE, PRIORITY_BATCH}
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+ffmpeg 執行層單元測試
+
+以錄下的 -progress 輸出測試進度解析，並以假的子行程測試取消時終止 ffmpeg
+"""
+
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import threading
+from collections import deque
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ffmpeg_runner
+from ffmpeg_runner import CancelToken, FFmpegCancelled, ResourceGovernor, run_ffmpeg
+
+# ffmpeg -progress pipe:1 的實際輸出 (節錄)
+PROGRESS_OUTPUT = """\
+frame=0
+fps=0.00
+bitrate=N/A
+total_size=0
+out_time_us=N/A
+out_time_ms=N/A
+out_time=N/A
+dup_frames=0
+speed=N/A
+progress=continue
+frame=120
+fps=59.91
+bitrate= 512.3kbits/s
+total_size=262192
+out_time_us=4004000
+out_time_ms=4004000
+out_time=00:00:04.004000
+speed=2.00x
+progress=continue
+frame=300
+out_time_us=-23220
+out_time_us=10010000
+out_time=00:00:10.010000
+progress=end
+"""
+
+
+def test_progress_lines_report_output_time():
+    reported = []
+    for line in PROGRESS_OUTPUT.splitlines():
+        assert ffmpeg_runner._parse_progress(line, reported.append)
+    # N/A 略過；負值 (音訊前置延遲) 視為 0
+    assert reported == [4.004, 4.004, 0.0, 10.01]
+
+
+def test_non_progress_lines_are_not_parsed():
+    reported = []
+    assert not ffmpeg_runner._parse_progress("[mp4 @ 0x55d] Starting second pass: moving the moov atom", reported.append)
+    assert not ffmpeg_runner._parse_progress("Stream #0:0 -> #0:0 (h264 (native) -> h264 (libx264))", reported.append)
+    assert not ffmpeg_runner._parse_progress("", reported.append)
+    assert ffmpeg_runner._parse_progress("out_time_us=1000000", None)
+    assert reported == []
+
+
+def test_stderr_progress_is_parsed_and_other_lines_kept():
+    stderr = io.BytesIO(b"ffmpeg version 6.1\nout_time_us=2000000\nprogress=end\nerror: broken pipe\n")
+    tail = deque(maxlen=10)
+    reported = []
+    ffmpeg_runner._drain(stderr, tail, reported.append, progress_on_stderr=True)
+    assert reported == [2.0]
+    assert list(tail) == ["ffmpeg version 6.1", "error: broken pipe"]
+
+
+class StubProcess:
+    """假的 ffmpeg 子行程：輸出進度後持續執行，直到結束或被終止"""
+
+    def __init__(self, lines, returncode=0, hang=False, stderr=""):
+        self.returncode = None
+        self.killed = False
+        self.started = threading.Event()
+        self._finished = threading.Event()
+        self._lines = lines
+        self._exit_code = returncode
+        self._hang = hang
+        self.stdout = self._stdout()
+        self.stderr = io.StringIO(stderr)
+        self.pid = 0
+
+    def _stdout(self):
+        yield from self._lines
+        self.started.set()
+        if self._hang:
+            self._finished.wait(5)
+        self._finish(self._exit_code if not self.killed else -9)
+
+    def _finish(self, code):
+        if self.returncode is None:
+            self.returncode = code
+        self._finished.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._finished.wait(5)
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+        self._finish(-9)
+
+
+@pytest.fixture
+def stub_popen(monkeypatch):
+    """以假的子行程取代 subprocess.Popen，記錄啟動的命令"""
+    state = {'processes': [], 'commands': [], 'factory': lambda: StubProcess([])}
+
+    def popen(cmd, **kwargs):
+        process = state['factory']()
+        state['commands'].append(cmd)
+        state['processes'].append(process)
+        return process
+
+    monkeypatch.setattr(ffmpeg_runner.subprocess, 'Popen', popen)
+    monkeypatch.setattr(ffmpeg_runner, 'governor', ResourceGovernor(slots=2, threads=1, interactive_reserve=0))
+    return state
+
+
+def test_run_ffmpeg_reports_progress(stub_popen):
+    stub_popen['factory'] = lambda: StubProcess(["out_time_us=1500000\n", "progress=continue\n",
+                                                 "out_time_us=3000000\n", "progress=end\n"])
+    reported = []
+    run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.mp4'], reported.append)
+    assert reported == [1.5, 3.0]
+    assert stub_popen['commands'][0][:4] == ['ffmpeg', '-nostats', '-progress', 'pipe:1']
+
+
+def test_failed_ffmpeg_raises_with_stderr_tail(stub_popen):
+    stub_popen['factory'] = lambda: StubProcess([], returncode=1, stderr="in.mp4: Invalid data found\n")
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.mp4'])
+    assert "Invalid data found" in excinfo.value.stderr
+
+
+def test_cancel_token_kills_the_running_process(stub_popen):
+    stub_popen['factory'] = lambda: StubProcess(["out_time_us=1000000\n"], hang=True)
+    cancel = CancelToken()
+    errors = []
+
+    def run():
+        try:
+            run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.mp4'], cancel=cancel)
+        except FFmpegCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while not stub_popen['processes']:
+        threading.Event().wait(0.005)
+    process = stub_popen['processes'][0]
+    assert process.started.wait(5)
+
+    cancel.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert process.killed and len(errors) == 1
+    # 行程已結束並歸還名額
+    assert ffmpeg_runner.governor.stats()['running'] == 0
+
+
+def test_cancelled_token_does_not_start_new_processes(stub_popen):
+    cancel = CancelToken()
+    cancel.cancel()
+    with pytest.raises(FFmpegCancelled):
+        run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.mp4'], cancel=cancel)
+    assert stub_popen['processes'] == []
+
+
+def test_cancelled_tool_call_cancels_the_optimizer():
+    import gemini_mcp_server as server
+
+    class Optimizer:
+        cancel_token = CancelToken()
+
+    started = threading.Event()
+
+    def work():
+        started.set()
+        # 模擬執行中的 ffmpeg：直到被取消權杖終止
+        while not Optimizer.cancel_token.cancelled:
+            threading.Event().wait(0.005)
+        raise FFmpegCancelled("ffmpeg 處理已取消")
+
+    async def scenario():
+        task = asyncio.ensure_future(server._run_optimizer(Optimizer, work))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert Optimizer.cancel_token.cancelled
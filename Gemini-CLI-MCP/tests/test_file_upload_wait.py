@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+檔案處理等待單元測試
+
+以假的 genai.get_file 與時鐘測試自適應退避輪詢、等待期限與處理失敗時的清理
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_files
+
+
+def make_file(state, name="files/a"):
+    return SimpleNamespace(name=name, uri=f"https://files/{name}", state=SimpleNamespace(name=state))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """以假時鐘取代 time 與 asyncio.sleep，記錄每次等待的秒數"""
+    state = SimpleNamespace(now=0.0, sleeps=[])
+    real_sleep = asyncio.sleep
+
+    async def sleep(seconds):
+        state.sleeps.append(round(seconds, 4))
+        state.now += seconds
+        await real_sleep(0)
+
+    monkeypatch.setattr(gemini_files, 'time', SimpleNamespace(monotonic=lambda: state.now))
+    monkeypatch.setattr(gemini_files.asyncio, 'sleep', sleep)
+    monkeypatch.setattr(gemini_files, 'FILE_POLL_INITIAL_INTERVAL', 1.0)
+    monkeypatch.setattr(gemini_files, 'FILE_POLL_MAX_INTERVAL', 10.0)
+    return state
+
+
+def fake_get_file(monkeypatch, states):
+    """依序回傳指定狀態的檔案，最後一個狀態持續不變"""
+    calls = []
+
+    def get_file(name):
+        calls.append(name)
+        return make_file(states[min(len(calls), len(states)) - 1], name)
+
+    monkeypatch.setattr(gemini_files.genai, 'get_file', get_file)
+    return calls
+
+
+def test_processing_file_becomes_active_with_backoff(monkeypatch, clock):
+    calls = fake_get_file(monkeypatch, ["PROCESSING", "PROCESSING", "PROCESSING", "ACTIVE"])
+
+    uploaded = asyncio.run(gemini_files.wait_for_file_active(make_file("PROCESSING"), timeout=600))
+    assert uploaded.state.name == "ACTIVE"
+    assert calls == ["files/a"] * 4
+    assert clock.sleeps == [1.0, 1.5, 2.25, 3.375]
+
+
+def test_poll_interval_is_capped(monkeypatch, clock):
+    fake_get_file(monkeypatch, ["PROCESSING"] * 7 + ["ACTIVE"])
+
+    asyncio.run(gemini_files.wait_for_file_active(make_file("PROCESSING"), timeout=600))
+    assert clock.sleeps[-3:] == [pytest.approx(7.59375, abs=1e-3), 10.0, 10.0]
+
+
+def test_processing_timeout_raises_at_the_deadline(monkeypatch, clock):
+    fake_get_file(monkeypatch, ["PROCESSING"])
+
+    with pytest.raises(TimeoutError, match="timed out after 20s"):
+        asyncio.run(gemini_files.wait_for_file_active(make_file("PROCESSING"), timeout=20))
+    # 最後一次等待縮短到期限為止，不會超過
+    assert clock.sleeps == [1.0, 1.5, 2.25, 3.375, 5.0625, 6.8125]
+    assert clock.now == pytest.approx(20.0)
+
+
+def test_failed_processing_deletes_the_upload(monkeypatch, clock):
+    fake_get_file(monkeypatch, ["PROCESSING", "FAILED"])
+    deleted = []
+
+    async def upload_file_async(path, **kwargs):
+        return make_file("PROCESSING")
+
+    async def delete_file_async(name):
+        deleted.append(name)
+        return True
+
+    monkeypatch.setattr(gemini_files, 'upload_file_async', upload_file_async)
+    monkeypatch.setattr(gemini_files, 'delete_file_async', delete_file_async)
+
+    with pytest.raises(ValueError, match="File processing failed"):
+        asyncio.run(gemini_files.upload_and_wait("/videos/a.mp4"))
+    assert deleted == ["files/a"]
+    assert clock.sleeps == [1.0, 1.5]
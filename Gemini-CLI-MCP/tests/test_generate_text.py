@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+串流輸出單元測試
+
+以假的模型與 MCP session 測試部分文字以進度通知轉送、無 progressToken 時的
+一般呼叫，以及串流中途的錯誤傳遞
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from mcp.server.lowlevel.server import request_ctx
+
+import gemini_mcp_server as server
+from rate_governor import RateGovernor
+
+
+class Chunk:
+    def __init__(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("no text parts")
+        return self._text
+
+
+class StreamResponse:
+    """模擬 generate_content_async(stream=True) 的回應"""
+
+    def __init__(self, parts, error=None):
+        self._parts = parts
+        self._error = error
+        self.usage_metadata = None
+
+    async def __aiter__(self):
+        for part in self._parts:
+            await asyncio.sleep(0)
+            yield Chunk(part)
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def text(self):
+        return ''.join(part for part in self._parts if part)
+
+
+class FakeModel:
+    model_name = 'models/gemini-test'
+
+    def __init__(self, parts, error=None):
+        self.parts = parts
+        self.error = error
+        self.calls = []
+
+    async def generate_content_async(self, contents, stream=False):
+        self.calls.append(stream)
+        if stream:
+            return StreamResponse(self.parts, self.error)
+        return SimpleNamespace(text=''.join(self.parts), usage_metadata=None)
+
+
+class FakeSession:
+    def __init__(self, fail=False):
+        self.notifications = []
+        self.fail = fail
+
+    async def send_progress_notification(self, token, progress, total=None, message=None):
+        self.notifications.append((token, progress, message))
+        if self.fail:
+            raise ConnectionError("client went away")
+
+
+@pytest.fixture(autouse=True)
+def governor(monkeypatch):
+    monkeypatch.setattr(server, 'rate_governor', RateGovernor(max_retries=0))
+
+
+def run_in_request(coro_factory, session, token='token-1'):
+    """在帶有 progressToken 的請求上下文中執行"""
+    async def scenario():
+        meta = SimpleNamespace(progressToken=token)
+        request_ctx.set(SimpleNamespace(meta=meta, session=session))
+        return await coro_factory()
+    return asyncio.run(scenario())
+
+
+def test_partial_text_is_sent_as_progress_notifications():
+    gen_model = FakeModel(['Hel', None, 'lo', '', ' world'])
+    session = FakeSession()
+
+    text = run_in_request(lambda: server.generate_text(gen_model, 'hi', stream=True), session)
+    assert text == 'Hello world'
+    assert gen_model.calls == [True]
+    # 進度為累計字元數，空白與無文字的區塊不送出
+    assert session.notifications == [
+        ('token-1', 3, 'Hel'), ('token-1', 5, 'lo'), ('token-1', 11, ' world')
+    ]
+
+
+def test_without_progress_token_the_full_response_is_awaited():
+    gen_model = FakeModel(['Hello'])
+    session = FakeSession()
+
+    assert run_in_request(lambda: server.generate_text(gen_model, 'hi', stream=True),
+                          session, token=None) == 'Hello'
+    # 不在請求上下文中 (例如背景工作) 時同樣不串流
+    assert asyncio.run(server.generate_text(gen_model, 'hi', stream=True)) == 'Hello'
+    assert gen_model.calls == [False, False]
+    assert session.notifications == []
+
+
+def test_stream_disabled_ignores_progress_token():
+    gen_model = FakeModel(['Hello'])
+    session = FakeSession()
+
+    assert run_in_request(lambda: server.generate_text(gen_model, 'hi', stream=False), session) == 'Hello'
+    assert gen_model.calls == [False] and session.notifications == []
+
+
+def test_mid_stream_error_propagates_after_partial_output():
+    gen_model = FakeModel(['partial '], error=RuntimeError("stream reset"))
+    session = FakeSession()
+
+    with pytest.raises(RuntimeError, match="stream reset"):
+        run_in_request(lambda: server.generate_text(gen_model, 'hi', stream=True), session)
+    assert session.notifications == [('token-1', 8, 'partial ')]
+
+
+def test_failed_notifications_do_not_abort_generation():
+    gen_model = FakeModel(['a', 'b'])
+    session = FakeSession(fail=True)
+
+    assert run_in_request(lambda: server.generate_text(gen_model, 'hi', stream=True), session) == 'ab'
+    assert len(session.notifications) == 2
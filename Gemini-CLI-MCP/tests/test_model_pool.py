@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+模型實例池單元測試
+
+測試 LRU 淘汰、快取鍵正規化與命中統計 (建立模型實例不需要 API 金鑰)
+"""
+
+import os
+import sys
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from model_pool import ModelPool
+
+
+def test_least_recently_used_instance_is_evicted():
+    pool = ModelPool(max_size=2)
+    first = pool.get('gemini-test', {'temperature': 0.1})
+    pool.get('gemini-test', {'temperature': 0.2})
+
+    # 使用 first 後，最久未使用的是 0.2
+    assert pool.get('gemini-test', {'temperature': 0.1}) is first
+    pool.get('gemini-test', {'temperature': 0.3})
+
+    assert pool.evictions == 1
+    assert pool.get('gemini-test', {'temperature': 0.1}) is first
+    assert pool.stats()['size'] == 2
+    before = pool.misses
+    pool.get('gemini-test', {'temperature': 0.2})
+    assert pool.misses == before + 1
+
+
+def test_equivalent_settings_share_one_instance():
+    pool = ModelPool()
+    instance = pool.get('gemini-test', {'temperature': 1, 'max_output_tokens': 2048})
+    assert pool.get('gemini-test', {'max_output_tokens': 2048.0, 'temperature': 1.0}) is instance
+    assert pool.get('gemini-test', None, '') is pool.get('gemini-test', {}, None)
+    assert pool.get('gemini-test', {'temperature': 1}, '系統指令') is not instance
+    assert pool.get('other-model', {'temperature': 1}) is not instance
+
+
+def test_initialization_and_warm_up_do_not_count_as_misses():
+    pool = ModelPool()
+    default = pool.get('gemini-test', track=False)
+    created = pool.warm_up('gemini-test', [None, {'temperature': 0.7}, {'temperature': 0.7}])
+    assert created == 1
+    assert (pool.hits, pool.misses) == (0, 0)
+
+    assert pool.get('gemini-test') is default
+    pool.get('gemini-test', {'temperature': 0.7})
+    assert pool.stats()['hit_rate'] == 1.0
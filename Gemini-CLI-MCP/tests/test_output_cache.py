@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+優化輸出快取單元測試
+
+測試使用中的項目 (lookup 命中或剛完成) 在歸還前不會被淘汰
+"""
+
+import os
+import sys
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from video_optimizer import OutputCache
+
+
+def add_entry(cache, key, size):
+    """建立一個已完成的項目並回傳 commit 交給呼叫端的分段"""
+    entry_dir = cache.begin(key)
+    file_path = os.path.join(entry_dir, f"{key}.mp4")
+    with open(file_path, 'wb') as f:
+        f.write(b'x' * size)
+    segments = [{'file': file_path, 'start': 0.0, 'duration': 10.0}]
+    cache.commit(key, segments)
+    return segments
+
+
+def test_lookup_hit_is_pinned_until_release(tmp_path):
+    cache = OutputCache(str(tmp_path), max_bytes=10_000)
+    cache.release(add_entry(cache, 'a', 600))
+
+    hit = cache.lookup('a')
+    assert hit[0]['cache_key'] == 'a' and hit[0]['cached']
+
+    # 加入新項目超出容量，但 a 仍在使用中
+    cache.max_bytes = 1000
+    cache.release(add_entry(cache, 'b', 600))
+    assert os.path.exists(hit[0]['file'])
+
+    cache.release(hit)
+    assert cache.evict() == 1
+    assert not os.path.exists(hit[0]['file'])
+    assert cache.lookup('a') is None
+
+
+def test_committed_entry_stays_pinned_for_caller(tmp_path):
+    cache = OutputCache(str(tmp_path), max_bytes=1000)
+    first = add_entry(cache, 'a', 600)
+    assert first[0]['cache_key'] == 'a'
+
+    second = add_entry(cache, 'b', 600)
+    assert os.path.exists(first[0]['file'])
+
+    cache.release(first)
+    cache.release(second)
+    cache.evict()
+    assert not os.path.exists(first[0]['file'])
+    assert os.path.exists(second[0]['file'])
+
+
+def test_release_counts_each_entry_once(tmp_path):
+    cache = OutputCache(str(tmp_path), max_bytes=10_000)
+    cache.release(add_entry(cache, 'a', 10))
+
+    first = cache.lookup('a')
+    second = cache.lookup('a')
+    cache.release(first + first)
+    assert cache._pinned == {'a': 1}
+    cache.release(second)
+    assert cache._pinned == {}
+
+
+def test_abort_releases_unfinished_entry(tmp_path):
+    cache = OutputCache(str(tmp_path), max_bytes=10_000)
+    entry_dir = cache.begin('a')
+    assert cache.begin('a') is None
+    cache.abort('a')
+    assert not os.path.exists(entry_dir)
+    assert cache._pinned == {}
+    assert cache.lookup('a') is None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+影片資訊快取單元測試
+
+測試檔案變更後失效、LRU 上限、SQLite 持久化、analyze_video 略過重複的 ffprobe，
+以及 analyze_videos 的並行分析與錯誤彙整
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from video_optimizer import ProbeCache, VideoOptimizer
+
+
+def test_key_changes_when_file_is_modified(tmp_path):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(b'x' * 10)
+    key = ProbeCache.make_key(str(video))
+    assert ProbeCache.make_key(str(video)) == key
+
+    video.write_bytes(b'x' * 20)
+    assert ProbeCache.make_key(str(video)) != key
+
+
+def test_memory_entries_are_bounded_lru():
+    cache = ProbeCache(max_entries=2)
+    cache.set('a', {'duration': 1.0})
+    cache.set('b', {'duration': 2.0})
+    assert cache.get('a') == {'duration': 1.0}
+    cache.set('c', {'duration': 3.0})
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['entries'] == 2
+
+
+def test_returned_info_is_a_copy():
+    cache = ProbeCache()
+    cache.set('a', {'file_path': '/a.mp4'})
+    cache.get('a')['file_path'] = '/b.mp4'
+    assert cache.get('a') == {'file_path': '/a.mp4'}
+
+
+def test_entries_persist_across_instances(tmp_path):
+    db_path = str(tmp_path / 'probes.sqlite3')
+    ProbeCache(db_path).set('a', {'duration': 12.5})
+
+    cache = ProbeCache(db_path)
+    assert cache.get('a') == {'duration': 12.5}
+    assert cache.stats() == {'entries': 1, 'persistent': True, 'hits': 1, 'misses': 0, 'hit_rate': 1.0}
+
+
+def test_analyze_video_probes_each_file_version_once(tmp_path, monkeypatch):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(b'x' * 10)
+    probes = []
+
+    def probe(self, path):
+        probes.append(path)
+        return {'file_path': path, 'duration': float(len(probes))}
+
+    monkeypatch.setattr(VideoOptimizer, 'probe_cache', ProbeCache())
+    monkeypatch.setattr(VideoOptimizer, '_probe_video', probe)
+    optimizer = VideoOptimizer('gemini-1.5-flash')
+
+    assert optimizer.analyze_video(str(video))['duration'] == 1.0
+    assert optimizer.analyze_video(str(video))['duration'] == 1.0
+    video.write_bytes(b'x' * 20)
+    assert optimizer.analyze_video(str(video))['duration'] == 2.0
+    assert len(probes) == 2
+
+    with pytest.raises(FileNotFoundError):
+        optimizer.analyze_video(str(tmp_path / 'missing.mp4'))
+
+
+def test_analyze_videos_probes_in_parallel_and_collects_errors(tmp_path, monkeypatch):
+    paths = []
+    for name in ('a.mp4', 'b.mp4', 'c.mp4'):
+        (tmp_path / name).write_bytes(b'x')
+        paths.append(str(tmp_path / name))
+    paths.insert(1, str(tmp_path / 'missing.mp4'))
+    # 三個 ffprobe 必須同時進行才能通過屏障
+    barrier = threading.Barrier(3, timeout=5)
+
+    def probe(self, path):
+        barrier.wait()
+        if path.endswith('c.mp4'):
+            raise ValueError("無法找到影片串流")
+        return {'file_path': path, 'duration': 1.0}
+
+    monkeypatch.setattr(VideoOptimizer, 'probe_cache', ProbeCache())
+    monkeypatch.setattr(VideoOptimizer, '_probe_video', probe)
+
+    infos = VideoOptimizer('gemini-1.5-flash').analyze_videos(paths, max_workers=4)
+    assert list(infos) == paths
+    assert infos[paths[0]]['duration'] == 1.0 and infos[paths[2]]['duration'] == 1.0
+    assert isinstance(infos[paths[1]], FileNotFoundError)
+    assert isinstance(infos[paths[3]], ValueError)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+API 速率控制器單元測試
+
+測試本機 token 估算、斷路器半開試探與失敗呼叫的額度退還
+"""
+
+import asyncio
+import os
+import sys
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import rate_governor
+from rate_governor import CircuitBreaker, CircuitOpenError, RateGovernor, estimate_tokens
+
+
+def test_estimate_tokens_for_text_and_media():
+    assert estimate_tokens("a" * 400) == 100
+    assert estimate_tokens([{"role": "user", "parts": ["a" * 40]}, {"role": "model", "parts": ["b" * 40]}]) == 20
+
+    video = SimpleNamespace(mime_type="video/mp4", size_bytes=10 ** 9,
+                            video_metadata=SimpleNamespace(video_duration=timedelta(seconds=10)))
+    assert estimate_tokens(["a" * 40, video]) == 10 + 10 * rate_governor.VIDEO_TOKENS_PER_SECOND
+
+    # 沒有時長資訊時依檔案大小推算
+    audio = SimpleNamespace(mime_type="audio/aac", size_bytes=rate_governor.AUDIO_BYTES_PER_SECOND * 60)
+    assert estimate_tokens([audio]) == 60 * rate_governor.AUDIO_TOKENS_PER_SECOND
+
+    image = {"mime_type": "image/jpeg", "data": b"x" * 100}
+    assert estimate_tokens([image, object()]) == rate_governor.IMAGE_TOKENS + rate_governor.FALLBACK_PART_TOKENS
+
+
+def test_half_open_allows_exactly_one_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    # 試探失敗後重新開啟；冷卻結束後允許下一個試探
+    breaker.record_failure()
+    assert breaker.trips == 2
+    breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+    breaker.check()
+
+
+def test_cancelled_probe_lets_next_call_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.0)
+    breaker.record_failure()
+    breaker.check()
+    breaker.release_probe()
+    breaker.check()
+
+
+def test_failed_calls_refund_reserved_tokens(monkeypatch):
+    monkeypatch.setattr(rate_governor, "RETRY_MAX_DELAY", 0.0)
+    governor = RateGovernor(max_retries=1)
+
+    async def invalid():
+        raise google_exceptions.InvalidArgument("bad request")
+
+    async def unavailable():
+        raise google_exceptions.ServiceUnavailable("down")
+
+    async def scenario():
+        with pytest.raises(google_exceptions.InvalidArgument):
+            await governor.call("models/gemini-test", invalid, 5000)
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            await governor.call("gemini-test", unavailable, 5000)
+        return governor._limiter("gemini-test")
+
+    limiter = asyncio.run(scenario())
+    assert limiter._tokens == pytest.approx(limiter.tpm, rel=1e-3)
+    assert limiter.admitted == 3
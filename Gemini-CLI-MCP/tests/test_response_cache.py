@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+回應快取單元測試
+
+測試快取鍵涵蓋系統指令，以及程式碼分析固定低溫度後可快取
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_mcp_server as server
+from model_pool import ModelPool
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """以假的生成函數記錄實際送出的請求"""
+    calls = []
+
+    async def generate_text(gen_model, prompt, stream=False):
+        calls.append((gen_model, prompt))
+        return f"answer {len(calls)}"
+
+    monkeypatch.setattr(server, 'generate_text', generate_text)
+    monkeypatch.setattr(server, 'response_cache', ResponseCache(enabled=True, db_path=""))
+    monkeypatch.setattr(server, 'model_pool', ModelPool())
+    monkeypatch.setattr(server, 'model', server.model_pool.get('gemini-test'), raising=False)
+    return calls
+
+
+def test_system_instruction_is_part_of_the_key(calls):
+    async def scenario():
+        config = {"temperature": 0.0}
+        first = await server.generate_text_cached("gemini_generate", "gemini-test", "hi", False, True, config, "用英文回答")
+        second = await server.generate_text_cached("gemini_generate", "gemini-test", "hi", False, True, config, "用中文回答")
+        again = await server.generate_text_cached("gemini_generate", "gemini-test", "hi", False, True, config, "用英文回答")
+        return first, second, again
+
+    first, second, again = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert first == again != second
+    assert calls[0][0] is not calls[1][0]
+
+
+def test_analyze_code_uses_low_temperature_and_is_cached(calls):
+    arguments = {"code": "print(1)", "language": "python", "stream": False}
+
+    async def scenario():
+        first = await server.analyze_code_tool(arguments)
+        second = await server.analyze_code_tool(arguments)
+        return first[0].text, second[0].text
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert len(calls) == 1
+    assert calls[0][0]._generation_config["temperature"] == server.ANALYZE_CODE_TEMPERATURE
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+分段管線單元測試
+
+以假的優化器、上傳與模型測試分段管線的結果順序、進行中數量上限，
+以及編碼失敗或中途取消時的暫存檔清理與快取釘選歸還
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_mcp_server as server
+from ffmpeg_runner import CancelToken
+
+
+class FakeOptimizer:
+    """逐段寫出分段檔案；fail_at 指定編碼失敗的分段"""
+
+    def __init__(self, directory, count, fail_at=None, cached=()):
+        self.directory = directory
+        self.count = count
+        self.fail_at = fail_at
+        self.cached = set(cached)
+        self.cancel_token = CancelToken()
+        self.released = []
+        self.output_cache = SimpleNamespace(release=self.released.extend)
+        self.produced = 0
+        self._lock = threading.Lock()
+
+    def iter_optimized_segments(self, video_path, strategy):
+        for index in range(self.count):
+            if index == self.fail_at:
+                raise RuntimeError("ffmpeg failed")
+            path = os.path.join(self.directory, f"segment_{index}.mp4")
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            with self._lock:
+                self.produced += 1
+            yield {'file': path, 'index': index, 'count': self.count, 'start': index * 60.0,
+                   'duration': 60.0, 'cached': index in self.cached}
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """假的上傳與模型：分析時間依分段反向遞減，記錄同時進行的數量"""
+    state = SimpleNamespace(running=0, peak=0, finished=0, ahead=0, uploads=[], released=[],
+                            reduce_prompt=None, block=None, optimizer=None)
+
+    async def get_or_upload(path):
+        state.uploads.append(os.path.basename(path))
+        return SimpleNamespace(name=f"files/{os.path.basename(path)}")
+
+    async def release(uploaded):
+        state.released.append(uploaded.name)
+
+    async def generate_text(gen_model, contents, stream=False):
+        if isinstance(contents, str):
+            state.reduce_prompt = contents
+            return "merged"
+        question, uploaded = contents
+        index = int(uploaded.name.rsplit('_', 1)[1].split('.')[0])
+        state.running += 1
+        state.peak = max(state.peak, state.running)
+        if state.optimizer is not None:
+            state.ahead = max(state.ahead, state.optimizer.produced - state.finished)
+        try:
+            if state.block is not None:
+                await state.block.wait()
+            await asyncio.sleep(0.002 * (10 - index))
+            return f"answer {index}"
+        finally:
+            state.running -= 1
+            state.finished += 1
+
+    monkeypatch.setattr(server, 'uploaded_file_cache', SimpleNamespace(get_or_upload=get_or_upload, release=release))
+    monkeypatch.setattr(server, 'generate_text', generate_text)
+    monkeypatch.setattr(server, 'SEGMENT_CONCURRENCY', 2)
+    monkeypatch.setattr(server, 'PIPELINE_DEPTH', 1)
+    return state
+
+
+def test_answers_are_reduced_in_segment_order(tmp_path, fakes):
+    optimizer = FakeOptimizer(str(tmp_path), 6, cached=[1])
+    fakes.optimizer = optimizer
+
+    text, count = asyncio.run(server._pipeline_video_segments(optimizer, '/videos/a.mp4', {}, None, 'q'))
+    assert (text, count) == ("merged", 6)
+    positions = [fakes.reduce_prompt.index(f"answer {i}") for i in range(6)]
+    assert positions == sorted(positions)
+    assert "[第 1 段 00:00:00 - 00:01:00]" in fakes.reduce_prompt
+
+    # 每個上傳的檔案都已釋放；快取中的分段保留，其餘暫存檔刪除
+    assert sorted(fakes.released) == sorted(f"files/{name}" for name in fakes.uploads)
+    assert os.listdir(tmp_path) == ["segment_1.mp4"]
+    assert [segment['index'] for segment in optimizer.released] == list(range(6))
+
+
+def test_in_flight_segments_are_bounded(tmp_path, fakes):
+    optimizer = FakeOptimizer(str(tmp_path), 10)
+    fakes.optimizer = optimizer
+
+    asyncio.run(server._pipeline_video_segments(optimizer, '/videos/a.mp4', {}, None, 'q'))
+    assert fakes.peak == 2
+    # 進行中 2 段 + 佇列 1 段 + 等待放入佇列的 1 段
+    assert fakes.ahead <= 4
+
+
+def test_encoding_failure_cleans_up_and_releases(tmp_path, fakes):
+    optimizer = FakeOptimizer(str(tmp_path), 5, fail_at=3)
+
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        asyncio.run(server._pipeline_video_segments(optimizer, '/videos/a.mp4', {}, None, 'q'))
+    assert optimizer.cancel_token.cancelled
+    assert os.listdir(tmp_path) == []
+    assert [segment['index'] for segment in optimizer.released] == [0, 1, 2]
+    assert fakes.reduce_prompt is None
+
+
+def test_cancel_mid_way_cleans_up_and_releases(tmp_path, fakes):
+    optimizer = FakeOptimizer(str(tmp_path), 8, cached=[0])
+
+    async def scenario():
+        fakes.block = asyncio.Event()
+        pipeline = asyncio.ensure_future(
+            server._pipeline_video_segments(optimizer, '/videos/a.mp4', {}, None, 'q')
+        )
+        while fakes.running < 2:
+            await asyncio.sleep(0.001)
+        pipeline.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pipeline
+
+    asyncio.run(scenario())
+    assert optimizer.cancel_token.cancelled
+    assert fakes.finished == 2 and fakes.running == 0
+    # 上傳過的檔案都已釋放，只留下快取中的分段
+    assert sorted(fakes.released) == sorted(f"files/{name}" for name in fakes.uploads)
+    assert os.listdir(tmp_path) == ["segment_0.mp4"]
+    assert optimizer.released and optimizer.released[0]['index'] == 0
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+靜態片段偵測單元測試
+
+測試影格差異計算、保留區間選擇、時間軸建立、時間戳記換算回原片時間與移除片段的 ffmpeg 命令
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from static_removal import (build_timeline, find_keep_spans, frame_differences,
+                            remap_timestamps, select_expression, summarize, to_original_time)
+from video_optimizer import VideoOptimizer
+
+
+def moving_with_static(frames, static_frames):
+    """長度為 frames - 1 的差異陣列，static_frames 範圍內的影格不變"""
+    differences = np.full(frames - 1, 10.0)
+    differences[static_frames.start:static_frames.stop] = 0.0
+    return differences
+
+
+def test_frame_differences_span_batches():
+    # 2x2 灰階影格，每批 2 張；第 1、2 張之間的差異跨越批次
+    frames = [0, 0, 10, 10, 10]
+    data = b''.join(bytes([value] * 4) for value in frames)
+    differences = frame_differences(io.BytesIO(data), width=2, height=2, batch_frames=2)
+    assert differences.tolist() == [0.0, 10.0, 0.0, 0.0]
+
+
+def test_long_static_run_is_removed_keeping_its_first_second():
+    # 2 fps、60 秒；影格 20~80 (10~40 秒) 靜態
+    differences = moving_with_static(121, range(20, 80))
+    spans = find_keep_spans(differences, 60.0, sample_fps=2, min_static=10, keep_static=1)
+    assert spans == [(0.0, 11.0), (40.0, 60.0)]
+    assert summarize(spans, 60.0) == "移除 29 秒靜態片段 (約 48%)"
+
+
+def test_short_static_runs_are_kept():
+    differences = moving_with_static(121, range(20, 30))
+    assert find_keep_spans(differences, 60.0, sample_fps=2, min_static=10) == [(0.0, 60.0)]
+    assert summarize([(0.0, 60.0)], 60.0) is None
+
+
+def test_static_intro_and_empty_input():
+    differences = moving_with_static(121, range(0, 40))
+    assert find_keep_spans(differences, 60.0, sample_fps=2, min_static=10, keep_static=1) == [(0.0, 1.0), (20.0, 60.0)]
+    assert find_keep_spans(np.zeros(0), 60.0) == [(0.0, 60.0)]
+
+
+def test_timeline_maps_output_time_to_original():
+    timeline = build_timeline([(0.0, 11.0), (40.0, 60.0)])
+    assert timeline == [
+        {'start': 0.0, 'end': 11.0, 'output_start': 0.0},
+        {'start': 40.0, 'end': 60.0, 'output_start': 11.0}
+    ]
+    assert to_original_time(timeline, 5) == 5
+    assert to_original_time(timeline, 11) == 40
+    assert to_original_time(timeline, 15) == 44
+    assert to_original_time(timeline, 100) == 60
+
+
+def test_remap_timestamps_in_text():
+    timeline = build_timeline([(0.0, 11.0), (3640.0, 3700.0)])
+    text = "[00:05] 出現標題，[00:15] 開始講解，結尾在 [00:00:20]；[00:05 - 00:15] 為開場"
+    assert remap_timestamps(text, timeline) == (
+        "[00:05] 出現標題，[01:00:44] 開始講解，結尾在 [01:00:49]；[00:05 - 01:00:44] 為開場"
+    )
+
+
+def test_unbracketed_times_are_left_alone():
+    timeline = build_timeline([(0.0, 11.0), (3640.0, 3700.0)])
+    text = "講者提到 12:30 的會議，[第 1 段 00:00:00 - 00:01:00]；版本 1.2.3 與 [12:345] 不變"
+    assert remap_timestamps(text, timeline) == text
+
+
+def test_select_expression():
+    assert select_expression([(0.0, 1.5), (10.0, 12.0)]) == \
+        "between(t,0.000,1.500)+between(t,10.000,12.000)"
+
+
+@pytest.mark.parametrize("has_audio", [True, False])
+def test_static_removal_command_selects_audio_only_when_present(monkeypatch, has_audio):
+    optimizer = VideoOptimizer('gemini-1.5-flash')
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: {'duration': 60.0, 'has_audio': has_audio})
+    strategy = {'target_resolution': 'standard', 'target_fps': 1, 'compress_required': True,
+                'keep_spans': [(0.0, 1.0), (20.0, 60.0)]}
+
+    cmd = optimizer._single_video_command('/videos/a.mp4', strategy)
+    expression = "between(t,0.000,1.000)+between(t,20.000,60.000)"
+    assert cmd[cmd.index('-vf') + 1].startswith(f"select='{expression}',setpts=N/FRAME_RATE/TB,scale=")
+    if has_audio:
+        assert cmd[cmd.index('-af') + 1] == f"aselect='{expression}',asetpts=N/SR/TB"
+    else:
+        assert '-af' not in cmd
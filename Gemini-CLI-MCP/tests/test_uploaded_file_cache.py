@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+已上傳檔案快取單元測試
+
+以假的上傳與遠端檔案 API 測試並行去重、使用中檔案的淘汰保護與串流上傳，
+並確認串流上傳依賴的 SDK 內部介面仍然存在
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import googleapiclient.http
+import httplib2
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gemini_files
+from gemini_files import UploadedFileCache
+from google.generativeai.client import FileServiceClient
+
+
+def make_file(name):
+    return SimpleNamespace(name=name, uri=f"https://files/{name}",
+                           state=SimpleNamespace(name="ACTIVE"), expiration_time=None)
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """以字典模擬遠端檔案"""
+    files = {}
+    deleted = []
+
+    def get_file(name):
+        if name not in files:
+            raise LookupError(name)
+        return files[name]
+
+    async def delete_file(name):
+        files.pop(name, None)
+        deleted.append(name)
+        return True
+
+    monkeypatch.setattr(gemini_files.genai, 'get_file', get_file)
+    monkeypatch.setattr(gemini_files, 'delete_file_async', delete_file)
+    return SimpleNamespace(files=files, deleted=deleted)
+
+
+def make_uploader(remote, name, size, calls):
+    async def upload():
+        calls.append(name)
+        await asyncio.sleep(0.01)
+        uploaded = make_file(name)
+        remote.files[name] = uploaded
+        return uploaded, size
+    return upload
+
+
+def test_concurrent_first_requests_share_one_upload(tmp_path, remote):
+    cache = UploadedFileCache(str(tmp_path / "index.json"), ttl=3600, max_bytes=1000)
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(*(
+            cache._get_or_create("digest", make_uploader(remote, "files/a", 10, calls), "a")
+            for _ in range(3)
+        ))
+
+    results = asyncio.run(scenario())
+    assert calls == ["files/a"]
+    assert {result.name for result in results} == {"files/a"}
+    assert cache._refs["files/a"] == 3
+
+
+def test_cancelled_first_request_does_not_cancel_waiters(tmp_path, remote):
+    cache = UploadedFileCache(str(tmp_path / "index.json"), ttl=3600, max_bytes=1000)
+    calls = []
+
+    async def scenario():
+        upload = make_uploader(remote, "files/a", 10, calls)
+        first = asyncio.ensure_future(cache._get_or_create("digest", upload, "a"))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache._get_or_create("digest", upload, "a")) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        first.cancel()
+        results = await asyncio.gather(*waiters)
+        assert first.cancelled()
+        return results
+
+    results = asyncio.run(scenario())
+    assert calls == ["files/a"]
+    assert [result.name for result in results] == ["files/a", "files/a"]
+    # 被取消的呼叫端不持有參照
+    assert cache._refs["files/a"] == 2
+    assert "digest" in cache._entries and not cache._inflight
+
+
+def test_upload_finishes_after_every_caller_is_cancelled(tmp_path, remote):
+    cache = UploadedFileCache(str(tmp_path / "index.json"), ttl=3600, max_bytes=1000)
+    calls = []
+
+    async def scenario():
+        caller = asyncio.ensure_future(
+            cache._get_or_create("digest", make_uploader(remote, "files/a", 10, calls), "a")
+        )
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        # 已完成的上傳可供之後的請求重用
+        return await cache._get_or_create("digest", make_uploader(remote, "files/b", 10, calls), "a")
+
+    reused = asyncio.run(scenario())
+    assert calls == ["files/a"] and reused.name == "files/a"
+    assert cache._refs == {"files/a": 1}
+
+
+def test_files_in_use_are_not_evicted(tmp_path, remote):
+    cache = UploadedFileCache(str(tmp_path / "index.json"), ttl=3600, max_bytes=100)
+    calls = []
+
+    async def scenario():
+        first = await cache._get_or_create("a", make_uploader(remote, "files/a", 80, calls), "a")
+        # 超出預算，但 files/a 仍在使用中
+        second = await cache._get_or_create("b", make_uploader(remote, "files/b", 80, calls), "b")
+        assert "files/a" not in remote.deleted
+        assert set(cache._entries) == {"a", "b"}
+
+        await cache.release(first)
+        await cache.release(second)
+        await cache.evict()
+
+    asyncio.run(scenario())
+    assert remote.deleted == ["files/a"]
+    assert set(cache._entries) == {"b"}
+
+
+def test_expired_entries_wait_for_release(tmp_path, remote):
+    cache = UploadedFileCache(str(tmp_path / "index.json"), ttl=3600, max_bytes=1000)
+
+    async def scenario():
+        uploaded = await cache._get_or_create("a", make_uploader(remote, "files/a", 10, []), "a")
+        cache._entries["a"]["expires_at"] = 0
+        await cache.evict()
+        assert remote.deleted == []
+
+        await cache.release(uploaded)
+        await cache.evict()
+        assert remote.deleted == ["files/a"]
+
+    asyncio.run(scenario())
+
+
+class FakeStream:
+    """模擬 ffmpeg 輸出串流"""
+
+    def __init__(self, data, fail=False):
+        self._data = data
+        self._position = 0
+        self._fail = fail
+        self.closed = False
+        self.aborted = False
+
+    def read(self, size):
+        chunk = self._data[self._position:self._position + size]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        self.closed = True
+        if self._fail:
+            raise RuntimeError("ffmpeg failed")
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_stream_media_upload_reads_ahead_and_serializes():
+    media = gemini_files.StreamMediaUpload(FakeStream(b'a' * 10), 'video/mp4', chunksize=4)
+    assert media.size() is None
+    assert media.getbytes(0, 4) == b'aaaa'
+    assert media.getbytes(4, 4) == b'aaaa'
+    assert media.size() == 10
+    assert media.getbytes(8, 4) == b'aa'
+    assert '"_mimetype": "video/mp4"' in media.to_json()
+
+
+def test_stream_upload_falls_back_to_temp_file(monkeypatch):
+    uploads = []
+
+    def upload_file(path, **kwargs):
+        with open(path, 'rb') as f:
+            uploads.append((f.read(), kwargs))
+        return make_file("files/spooled")
+
+    monkeypatch.setattr(gemini_files, 'get_default_file_client', lambda: object())
+    monkeypatch.setattr(gemini_files.genai, 'upload_file', upload_file)
+
+    stream = FakeStream(b'v' * 3000)
+    uploaded, size = gemini_files._upload_stream(lambda: stream, 'video/mp4', 'clip.mp4')
+    assert uploaded.name == "files/spooled" and size == 3000
+    assert uploads == [(b'v' * 3000, {'mime_type': 'video/mp4', 'display_name': 'clip.mp4'})]
+    assert stream.closed
+
+    failing = FakeStream(b'v' * 10, fail=True)
+    with pytest.raises(RuntimeError):
+        gemini_files._upload_stream(lambda: failing, 'video/mp4', None)
+    assert failing.aborted and len(uploads) == 1
+
+
+class ResumableServer:
+    """模擬 resumable 上傳端點，記錄每個分塊的長度與 Content-Range"""
+
+    def __init__(self):
+        self.chunks = []
+        self.received = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if 'upload_id' not in uri:
+            return httplib2.Response({'status': '200', 'location': 'https://upload/files?upload_id=1'}), b''
+        self.chunks.append((len(body), headers['Content-Range']))
+        self.received += len(body)
+        if headers['Content-Range'].endswith('/*'):
+            return httplib2.Response({'status': '308', 'range': f'bytes=0-{self.received - 1}'}), b''
+        return httplib2.Response({'status': '200'}), json.dumps({'file': {'name': 'files/x'}}).encode()
+
+
+def test_stream_media_upload_from_a_pipe():
+    chunk = 256 * 1024
+    total = 2 * chunk + 1000
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, 'wb') as f:
+            for _ in range(total // 1000):
+                f.write(b'v' * 1000)
+            f.write(b'v' * (total % 1000))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with os.fdopen(read_fd, 'rb') as pipe:
+        assert not pipe.seekable()
+        media = gemini_files.StreamMediaUpload(pipe, 'video/mp4', chunksize=chunk)
+        server = ResumableServer()
+        request = googleapiclient.http.HttpRequest(
+            server, lambda resp, content: json.loads(content), 'https://upload/files?uploadType=resumable',
+            method='POST', body='{}', headers={}, resumable=media
+        )
+        result = request.execute()
+        writer.join()
+
+        assert result == {'file': {'name': 'files/x'}}
+        # 總長度在送出最後一塊前才得知；記憶體只保留最多兩塊預讀
+        assert server.chunks == [
+            (chunk, f"bytes 0-{chunk - 1}/*"),
+            (chunk, f"bytes {chunk}-{2 * chunk - 1}/*"),
+            (1000, f"bytes {2 * chunk}-{total - 1}/{total}")
+        ]
+        assert media.bytes_read == media.size() == total
+        assert len(media._buffer) <= 2 * chunk + 1
+        assert pipe.closed
+
+
+def test_sdk_still_exposes_the_private_upload_hooks():
+    """串流上傳依賴 FileServiceClient 的內部屬性；SDK 更新移除時應明確失敗"""
+    client = FileServiceClient(client_options={'api_key': 'test'})
+    assert isinstance(getattr(client, '_local', None), threading.local)
+    assert callable(getattr(client, '_setup_discovery_api', None))
+    assert 'self._local.discovery_api' in inspect.getsource(FileServiceClient._setup_discovery_api)
+
+    setups = []
+    discovery_api = object()
+
+    def setup():
+        setups.append(True)
+        client._local.discovery_api = discovery_api
+
+    client._setup_discovery_api = setup
+    assert gemini_files._get_discovery_api(client) is discovery_api
+    assert gemini_files._get_discovery_api(client) is discovery_api
+    assert len(setups) == 1
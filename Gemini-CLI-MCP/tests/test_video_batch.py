@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+影片批次優化單元測試
+
+測試輸入展開、清單檔的命中/失效，以及中斷後重新執行時略過已完成的檔案
+"""
+
+import os
+import sys
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import video_batch
+from video_batch import (CACHED, FAILED, OPTIMIZED, RESUMED, BatchManifest, BatchOptimizer,
+                         collect_inputs, file_identity, summarize)
+from video_optimizer import VideoOptimizer
+
+
+def write(path, data=b'x'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_collect_inputs_expands_directories_and_globs(tmp_path):
+    a = write(tmp_path / 'videos' / 'a.mp4')
+    b = write(tmp_path / 'videos' / 'nested' / 'b.MOV')
+    write(tmp_path / 'videos' / 'notes.txt')
+    c = write(tmp_path / 'other' / 'c.mkv')
+
+    paths = collect_inputs([str(tmp_path / 'videos'), str(tmp_path / 'other' / '*.mkv'), a])
+    assert paths == sorted([a, b, c], key=os.path.realpath)
+
+
+def test_manifest_hit_until_source_or_outputs_change(tmp_path):
+    source = tmp_path / 'a.mp4'
+    write(source, b'v1')
+    output = write(tmp_path / 'out' / 'a_optimized.mp4')
+    settings = {'model': 'gemini-1.5-flash', 'output_dir': None}
+    entry = {'identity': file_identity(str(source)), 'settings': settings,
+             'status': OPTIMIZED, 'duration': 10.0, 'files': [output]}
+
+    manifest_path = str(tmp_path / 'manifest.json')
+    BatchManifest(manifest_path).record(str(source), entry)
+
+    # 重新載入後仍命中
+    manifest = BatchManifest(manifest_path)
+    assert manifest.lookup(str(source), settings) == entry
+    assert manifest.lookup(str(source), {**settings, 'model': 'gemini-1.5-pro'}) is None
+
+    # 來源內容變更後失效
+    write(source, b'version 2')
+    assert manifest.lookup(str(source), settings) is None
+
+    manifest.record(str(source), {**entry, 'identity': file_identity(str(source))})
+    assert manifest.lookup(str(source), settings) is not None
+    os.remove(output)
+    assert manifest.lookup(str(source), settings) is None
+
+
+def test_corrupt_manifest_starts_over(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text('{not json')
+    assert BatchManifest(str(manifest_path)).lookup(write(tmp_path / 'a.mp4'), {}) is None
+
+
+@pytest.fixture
+def fake_optimize(monkeypatch):
+    """以假的優化結果取代 ffmpeg，記錄處理過的來源"""
+    calls = []
+
+    def optimize_video(self, video_path, output_dir=None, strategy=None):
+        calls.append(video_path)
+        if 'broken' in video_path:
+            raise RuntimeError("ffprobe failed")
+        output = os.path.join(output_dir, 'optimized.mp4')
+        write_output(output)
+        return {'success': True, 'message': 'done', 'video_info': {'duration': 30.0},
+                'strategy': {'needs_processing': True}, 'optimized_files': [output],
+                'segments': [{'file': output}], 'from_cache': 'cached' in video_path}
+
+    def write_output(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'o')
+
+    monkeypatch.setattr(VideoOptimizer, 'optimize_video', optimize_video)
+    return calls
+
+
+def test_rerun_resumes_finished_files(tmp_path, fake_optimize):
+    a = write(tmp_path / 'in' / 'a.mp4')
+    b = write(tmp_path / 'in' / 'b_cached.mp4')
+    broken = write(tmp_path / 'in' / 'broken.mp4')
+    output_dir = str(tmp_path / 'out')
+
+    first = {result['path']: result['status']
+             for result in map(BatchOptimizer('gemini-1.5-flash', output_dir).process, [a, b, broken])}
+    assert first == {a: OPTIMIZED, b: CACHED, broken: FAILED}
+
+    # 清單檔存放在輸出目錄，重新執行時只重試失敗與變更的檔案
+    write(tmp_path / 'in' / 'a.mp4', b'changed')
+    fake_optimize.clear()
+    second = {result['path']: result['status']
+              for result in map(BatchOptimizer('gemini-1.5-flash', output_dir).process, [a, b, broken])}
+    assert second == {a: OPTIMIZED, b: RESUMED, broken: FAILED}
+    assert fake_optimize == [a, broken]
+    assert os.path.exists(os.path.join(output_dir, video_batch.MANIFEST_NAME))
+
+
+def test_run_probes_up_front_and_skips_unreadable_files(tmp_path, fake_optimize, monkeypatch):
+    a = write(tmp_path / 'in' / 'a.mp4')
+    bad = write(tmp_path / 'in' / 'bad.mp4')
+    probed = []
+
+    def analyze_videos(self, paths, max_workers=None):
+        probed.extend(paths)
+        return {path: ValueError("無法找到影片串流") if 'bad' in path else {'duration': 30.0}
+                for path in paths}
+
+    monkeypatch.setattr(VideoOptimizer, 'analyze_videos', analyze_videos)
+    runner = BatchOptimizer('gemini-1.5-flash', str(tmp_path / 'out'))
+    stats = runner.run([a, bad])
+    assert stats['counts'] == {OPTIMIZED: 1, FAILED: 1}
+    assert probed == [a, bad]
+    # 無法分析的檔案不進入優化
+    assert fake_optimize == [a]
+
+    # 重新執行時清單中已完成的檔案不再分析
+    probed.clear()
+    BatchOptimizer('gemini-1.5-flash', str(tmp_path / 'out')).run([a, bad])
+    assert probed == [bad]
+
+
+def test_same_names_in_different_directories_do_not_collide(tmp_path):
+    optimizer = BatchOptimizer('gemini-1.5-flash', str(tmp_path / 'out'))
+    first = optimizer._file_output_dir(str(tmp_path / 'x' / 'a.mp4'))
+    second = optimizer._file_output_dir(str(tmp_path / 'y' / 'a.mp4'))
+    assert first != second
+    assert os.path.basename(first).startswith('a_')
+
+
+def test_throughput_counts_only_processed_files():
+    results = [
+        {'status': OPTIMIZED, 'duration': 60.0},
+        {'status': OPTIMIZED, 'duration': 30.0},
+        {'status': RESUMED, 'duration': 600.0},
+        {'status': FAILED, 'duration': 0.0}
+    ]
+    stats = summarize(results, 10.0)
+    assert stats['counts'] == {OPTIMIZED: 2, RESUMED: 1, FAILED: 1}
+    assert stats['media_seconds'] == 90.0
+    assert stats['files_per_second'] == pytest.approx(0.2)
+    assert stats['media_seconds_per_second'] == pytest.approx(9.0)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+影片背景工作排程單元測試
+
+測試工作狀態、失敗記錄、保留期限與重新啟動後的復原
+"""
+
+import asyncio
+import os
+import sys
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from video_jobs import FAILED, SUCCEEDED, JobScheduler
+
+
+async def _wait_finished(scheduler, job_id, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while scheduler.status(job_id)["status"] not in (SUCCEEDED, FAILED):
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+    return scheduler.get(job_id)
+
+
+def test_runner_exception_marks_job_failed():
+    async def runner(tool, arguments):
+        if arguments.get("fail"):
+            raise RuntimeError("優化失敗: boom")
+        return f"done {arguments['video_path']}"
+
+    async def scenario():
+        scheduler = JobScheduler(db_path="", workers=1)
+        await scheduler.start(runner)
+        try:
+            ok = scheduler.submit("gemini_video_optimizer", {"video_path": "a.mp4"})
+            bad = scheduler.submit("gemini_video_optimizer", {"video_path": "b.mp4", "fail": True})
+            ok_job = await _wait_finished(scheduler, ok["job_id"])
+            bad_job = await _wait_finished(scheduler, bad["job_id"])
+        finally:
+            await scheduler.stop()
+        return ok_job, bad_job, scheduler.status(bad["job_id"])
+
+    ok_job, bad_job, bad_status = asyncio.run(scenario())
+    assert ok_job["status"] == SUCCEEDED and ok_job["result"] == "done a.mp4"
+    assert bad_job["status"] == FAILED
+    assert "boom" in bad_status["error"]
+
+
+def test_finished_jobs_are_pruned_at_runtime(tmp_path):
+    async def runner(tool, arguments):
+        return "ok"
+
+    async def scenario():
+        scheduler = JobScheduler(db_path=str(tmp_path / "jobs.sqlite3"), workers=1, retention=0.05)
+        await scheduler.start(runner)
+        try:
+            first = scheduler.submit("gemini_video_analysis", {"video_path": "a.mp4"})["job_id"]
+            await _wait_finished(scheduler, first)
+            await asyncio.sleep(0.1)
+            second = scheduler.submit("gemini_video_analysis", {"video_path": "b.mp4"})["job_id"]
+            await _wait_finished(scheduler, second)
+        finally:
+            await scheduler.stop()
+        return scheduler, first, second
+
+    scheduler, first, second = asyncio.run(scenario())
+    assert scheduler.get(first) is None
+    assert scheduler.get(second) is not None
+    rows = scheduler._connect().execute("SELECT id FROM jobs").fetchall()
+    assert (first,) not in rows
+
+
+def test_unfinished_jobs_are_requeued_after_restart(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+
+    async def first_run():
+        scheduler = JobScheduler(db_path=db_path, workers=1)
+
+        async def slow(tool, arguments):
+            await asyncio.sleep(10)
+
+        await scheduler.start(slow)
+        job_id = scheduler.submit("gemini_video_analysis", {"video_path": "a.mp4"})["job_id"]
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        return job_id
+
+    async def second_run(job_id):
+        scheduler = JobScheduler(db_path=db_path, workers=1)
+
+        async def fast(tool, arguments):
+            return "recovered"
+
+        await scheduler.start(fast)
+        try:
+            return await _wait_finished(scheduler, job_id)
+        finally:
+            await scheduler.stop()
+
+    job_id = asyncio.run(first_run())
+    job = asyncio.run(second_run(job_id))
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == "recovered"
+    assert job["attempts"] == 2
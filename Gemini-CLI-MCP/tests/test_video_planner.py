@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+影片處理規劃單元測試
+
+測試處理方案選擇與分段規劃 (不需要 ffmpeg 或 API 金鑰)
+"""
+
+import os
+import sys
+
+import pytest
+
+# 添加 src 目錄到路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import video_optimizer
+from video_optimizer import VideoOptimizer
+
+GB = 1024 ** 3
+
+
+def make_info(**overrides):
+    info = {
+        'file_path': '/videos/source.mp4',
+        'duration': 7000.0,
+        'file_size': 3 * GB,
+        'width': 640,
+        'height': 360,
+        'fps': 30.0,
+        'codec': 'h264',
+        'has_audio': True
+    }
+    info.update(overrides)
+    return info
+
+
+@pytest.fixture
+def optimizer(monkeypatch):
+    """以固定成本模型建立優化器，避免讀取本機量測資料"""
+    speeds = {'transcode_speed': 0.5, 'copy_bytes_per_sec': 150 * 1024 * 1024,
+              'upload_bytes_per_sec': 5 * 1024 * 1024, 'processing_bytes_per_sec': 10 * 1024 * 1024}
+    monkeypatch.setattr(video_optimizer.cost_model, 'get', lambda metric, key=None: speeds[metric])
+    monkeypatch.setattr(video_optimizer.cost_model, 'is_measured', lambda metric, key=None: True)
+    return VideoOptimizer('gemini-1.5-flash')
+
+
+def test_copy_over_upload_limit_is_split_by_size(optimizer, monkeypatch):
+    info = make_info()
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+
+    strategy = optimizer.get_optimization_strategy(info)
+    assert strategy['plan']['choice'] == 'copy'
+    assert strategy['segment_required']
+
+    strategy['segmentation'] = 'fixed'
+    segments = optimizer._plan_segments(info['duration'], info['file_path'], strategy)
+    max_bytes = VideoOptimizer.SIZE_LIMITS['gcs_upload']
+    assert len(segments) == 2
+    for _, segment_duration in segments:
+        assert info['file_size'] * segment_duration / info['duration'] < max_bytes
+
+
+def test_small_copy_is_not_segmented(optimizer, monkeypatch):
+    info = make_info(duration=600.0, file_size=200 * 1024 * 1024)
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+
+    strategy = optimizer.get_optimization_strategy(info)
+    assert not strategy['segment_required']
+    assert optimizer._plan_segments(info['duration'], info['file_path'], strategy) == [(0.0, 600.0)]
+
+
+def test_update_encode_mode_requires_segments_for_large_copy(optimizer):
+    info = make_info(file_size=int(1.9 * GB))
+    strategy = optimizer.get_optimization_strategy(info)
+    strategy.update(segment_required=False, needs_processing=True, target_resolution='standard')
+
+    optimizer.update_encode_mode(info, strategy)
+    assert strategy['encode_mode'] == 'copy'
+    assert not strategy['segment_required']
+
+    info['file_size'] = int(2.5 * GB)
+    optimizer.update_encode_mode(info, strategy)
+    assert strategy['segment_required']
+
+
+def test_segment_count_without_strategy_uses_duration_only(optimizer):
+    max_low = optimizer.model_spec['max_duration_low']
+    segments = optimizer._plan_segments(max_low * 2.5)
+    assert len(segments) == 3
+    assert all(duration <= max_low for _, duration in segments)
+
+
+def test_copy_segment_times_do_not_round_past_keyframes(optimizer, monkeypatch, tmp_path):
+    source = tmp_path / 'source.mp4'
+    source.write_bytes(b'x' * 1000)
+    commands = []
+    monkeypatch.setattr(optimizer, 'get_keyframes', lambda path: [0.0, 9.9996, 19.9997])
+    info = make_info(audio_codec='aac', duration=25.0, file_size=1000)
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+    monkeypatch.setattr(optimizer, '_run_ffmpeg', lambda cmd, *args: commands.append(cmd))
+    monkeypatch.setattr(video_optimizer.cost_model, 'record', lambda metric, value, key=None: None)
+
+    cut_points = optimizer._plan_copy_cuts(str(source), info, [(0.0, 10.0), (10.0, 10.0), (20.0, 5.0)])
+    segments = list(optimizer._copy_segments(str(source), str(tmp_path), cut_points))
+    cmd = commands[0]
+    assert cmd[cmd.index('-segment_times') + 1] == '9.999,19.999'
+    assert [segment['start'] for segment in segments] == [0.0, 9.9996, 19.9997]
+
+
+def test_copy_cuts_stay_within_the_span_limit_after_snapping():
+    # 對齊到前一個關鍵影格 (15, 30) 會讓最後一段長達 30 秒
+    cuts = VideoOptimizer._copy_cut_points([20.0, 40.0], [0.0, 15.0, 30.0, 45.0], 60.0, 20.0)
+    assert cuts == [15.0, 30.0, 45.0]
+    boundaries = [0.0] + cuts + [60.0]
+    assert all(b - a <= 20.0 for a, b in zip(boundaries, boundaries[1:]))
+
+
+def test_copy_cuts_fail_when_keyframes_are_further_apart_than_the_limit():
+    keyframes = [0.0, 30.0, 60.0, 90.0]
+    assert VideoOptimizer._copy_cut_points([20.0, 40.0, 60.0, 80.0], keyframes, 100.0, 20.0) is None
+    assert VideoOptimizer._copy_cut_points([50.0], keyframes, 100.0, 60.0) == [30.0, 90.0]
+
+
+def test_copy_segmentation_falls_back_to_encoding_for_sparse_keyframes(optimizer, monkeypatch, tmp_path):
+    source = tmp_path / 'source.mp4'
+    source.write_bytes(b'x' * 1000)
+    info = make_info(duration=100.0, file_size=1000)
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+    monkeypatch.setattr(optimizer, 'get_keyframes', lambda path: [0.0, 30.0, 60.0, 90.0])
+    monkeypatch.setitem(optimizer.model_spec, 'max_duration_low', 20)
+    encoded = []
+    monkeypatch.setattr(optimizer, '_copy_segments', lambda *args: pytest.fail("stream copy used"))
+    monkeypatch.setattr(optimizer, '_encode_segment',
+                        lambda path, output, start, duration, *args: encoded.append((start, duration)))
+
+    strategy = dict(optimizer.get_optimization_strategy(info), encode_mode='copy', segmentation='fixed')
+    segments = list(optimizer.iter_segments(str(source), strategy, str(tmp_path / 'out')))
+    assert encoded == [(segment['start'], segment['duration']) for segment in segments]
+    assert all(duration <= 20.0 for _, duration in encoded)
+
+
+def test_keyframes_are_relative_to_the_stream_start(optimizer, monkeypatch):
+    output = "1.400000,K__\n1.433333,___\n3.400000,K__\nN/A,K__\n"
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: make_info(start_time=1.4))
+    monkeypatch.setattr(video_optimizer, 'run_capture', lambda cmd, *args: output)
+    monkeypatch.setattr(optimizer, 'probe_cache', video_optimizer.ProbeCache())
+    monkeypatch.setattr(video_optimizer.ProbeCache, 'make_key', staticmethod(lambda path: path))
+
+    assert optimizer.get_keyframes('/videos/source.ts') == pytest.approx([0.0, 2.0])
+
+
+def test_scene_cuts_snap_to_nearby_scene_changes(optimizer):
+    cuts = optimizer._scene_cut_points(300.0, 3, [95.0, 130.0, 207.0], max_duration=200.0)
+    assert cuts == [95.0, 207.0]
+
+
+def test_scene_cuts_respect_max_segment_duration(optimizer):
+    # 207 會讓第二段超過 110 秒，改用理想位置
+    cuts = optimizer._scene_cut_points(300.0, 3, [95.0, 130.0, 207.0], max_duration=110.0)
+    assert cuts == [95.0, 200.0]
+    boundaries = [0.0] + cuts + [300.0]
+    assert all(b - a <= 110.0 for a, b in zip(boundaries, boundaries[1:]))
+
+
+def test_scene_cuts_without_scenes_use_ideal_points(optimizer):
+    assert optimizer._scene_cut_points(300.0, 3, []) == [100.0, 200.0]
+
+
+def test_scene_segmentation_plans_contiguous_segments(optimizer, monkeypatch):
+    info = make_info(duration=3.5 * optimizer.model_spec['max_duration_low'], file_size=100 * 1024 * 1024)
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+    max_low = optimizer.model_spec['max_duration_low']
+    scenes = [max_low * 0.9, max_low * 1.8, max_low * 2.6]
+    monkeypatch.setattr(optimizer, 'get_scene_changes', lambda path: scenes)
+
+    strategy = dict(optimizer.get_optimization_strategy(info), segmentation='scene')
+    segments = optimizer._plan_segments(info['duration'], info['file_path'], strategy)
+    assert [start for start, _ in segments] == [0.0] + scenes
+    assert sum(duration for _, duration in segments) == pytest.approx(info['duration'])
+
+
+def test_scene_detection_failure_falls_back_to_fixed(optimizer, monkeypatch):
+    info = make_info(duration=2.5 * optimizer.model_spec['max_duration_low'], file_size=100 * 1024 * 1024)
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: info)
+
+    def fail(path):
+        raise OSError("ffmpeg not found")
+
+    monkeypatch.setattr(optimizer, 'get_scene_changes', fail)
+    strategy = dict(optimizer.get_optimization_strategy(info), segmentation='scene')
+    segments = optimizer._plan_segments(info['duration'], info['file_path'], strategy)
+    assert segments == optimizer._plan_segments(info['duration'])
+
+
+def test_scene_changes_are_parsed_and_cached(optimizer, monkeypatch, tmp_path):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(b'x')
+    runs = []
+
+    def run_ffmpeg(cmd, *args):
+        runs.append(cmd)
+        metadata_path = cmd[cmd.index('-vf') + 1].split('file=')[1]
+        with open(metadata_path, 'w') as f:
+            for t in (40.0, 12.5):
+                f.write(f"frame:0    pts:0      pts_time:{t}\nlavfi.scene_score=0.5\n")
+
+    monkeypatch.setattr(VideoOptimizer, 'probe_cache', video_optimizer.ProbeCache())
+    monkeypatch.setattr(optimizer, 'analyze_video', lambda path: make_info(duration=60.0))
+    monkeypatch.setattr(optimizer, '_run_ffmpeg', run_ffmpeg)
+
+    assert optimizer.get_scene_changes(str(video)) == [12.5, 40.0]
+    assert optimizer.get_scene_changes(str(video)) == [12.5, 40.0]
+    assert len(runs) == 1